@@ -48,6 +48,9 @@ except: mspy.saveModifications(os.path.join(config.confdir,'modifications.xml'))
 try: mspy.loadEnzymes(os.path.join(config.confdir,'enzymes.xml'), clear=False)
 except: mspy.saveEnzymes(os.path.join(config.confdir,'enzymes.xml'))
 
+mspy.ELEMENT_TABLES.load(os.path.join(config.confdir,'isotopes'))
+mspy.AVERAGINE_TABLES.directory = config.confdir
+
 
 # INIT DEFAULT VALUES
 # -------------------
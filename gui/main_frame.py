@@ -811,6 +811,10 @@ class mainFrame(wx.Frame):
         # save config
         config.saveConfig()
         
+        # save precomputed element patterns
+        mspy.ELEMENT_TABLES.save()
+        mspy.AVERAGINE_TABLES.save()
+        
         # quit application
         evt.Skip()
         self.Destroy()
@@ -17,6 +17,7 @@
 
 # load libs
 import threading
+import multiprocessing
 import wx
 import webbrowser
 import tempfile
@@ -47,6 +48,7 @@ class panelMassToFormula(wx.MiniFrame):
         self.currentDocument = None
         self.currentFormulae = None
         self.currentMass = None
+        self.currentRules = None
         
         # make gui items
         self.makeGUI()
@@ -595,6 +597,11 @@ class panelMassToFormula(wx.MiniFrame):
         # get rules
         self.getRules()
         
+        # regenerate formulae if generated by different rules
+        if self.currentFormulae != None and self.currentRules != self.getRulesParams():
+            self.onGenerate()
+            return
+        
         # update compounds list
         self.updateFormulaeList()
     # ----
@@ -698,6 +705,8 @@ class panelMassToFormula(wx.MiniFrame):
         try:
             
             self.currentFormulae = []
+            self.currentRules = self.getRulesParams()
+            rules, HC, NOPSC, RDBE = self.currentRules
             
             # get agent charge
             agentCharge = 1
@@ -739,8 +748,10 @@ class panelMassToFormula(wx.MiniFrame):
                 else:
                     composition[el] = [0, maxComposition[el]]
             
-            # calculate formulae
-            formulae = mspy.formulator(
+            # calculate formulae in chunks
+            buff = []
+            patterns = []
+            formulae = mspy.iformulator(
                 mz = self.currentMass,
                 charge = config.massToFormula['charge'],
                 tolerance = config.massToFormula['tolerance'],
@@ -748,37 +759,58 @@ class panelMassToFormula(wx.MiniFrame):
                 composition = composition,
                 agentFormula = config.massToFormula['ionization'],
                 agentCharge = agentCharge,
-                limit = config.massToFormula['countLimit']
+                chunk = 100,
+                rules = rules,
+                HC = HC,
+                NOPSC = NOPSC,
+                RDBE = RDBE
             )
-            
-            # make compounds
-            buff = []
-            for formula in formulae:
-                
-                # make compound
-                cmpd = mspy.compound(formula)
-                mass = cmpd.mass(0)
-                mz = cmpd.mz(config.massToFormula['charge'], config.massToFormula['ionization'], 1)[0]
-                error = mspy.delta(self.currentMass, mz, config.massToFormula['units'])
-                errorDa = mspy.delta(self.currentMass, mz, 'Da')
+            for chunk, cursor in formulae:
                 
-                # compare isotopic pattern
-                similarity = None
-                if config.massToFormula['checkPattern'] and cmpd.isvalid(charge=config.massToFormula['charge'], agentFormula=config.massToFormula['ionization']):
-                    similarity = self.compareIsotopicPattern(cmpd, config.massToFormula['charge'], config.massToFormula['ionization'], errorDa)
+                # check limit
+                chunk = chunk[:config.massToFormula['countLimit']-len(buff)]
                 
-                # count ratios
-                countC = float(cmpd.count('C', groupIsotopes=True))
-                countH = float(cmpd.count('H', groupIsotopes=True))
-                hc = None
-                if countC:
-                    hc = countH/countC
+                # make compounds
+                for formula in chunk:
+                    
+                    # make compound
+                    cmpd = mspy.compound(formula)
+                    mass = cmpd.mass(0)
+                    mz = cmpd.mz(config.massToFormula['charge'], config.massToFormula['ionization'], 1)[0]
+                    error = mspy.delta(self.currentMass, mz, config.massToFormula['units'])
+                    errorDa = mspy.delta(self.currentMass, mz, 'Da')
+                    
+                    # mark for isotopic pattern comparison
+                    if config.massToFormula['checkPattern'] and cmpd.isvalid(charge=config.massToFormula['charge'], agentFormula=config.massToFormula['ionization']):
+                        patterns.append((len(buff), cmpd, errorDa))
+                    
+                    # count ratios
+                    countC = float(cmpd.count('C', groupIsotopes=True))
+                    countH = float(cmpd.count('H', groupIsotopes=True))
+                    hc = None
+                    if countC:
+                        hc = countH/countC
+                    
+                    # count rdbe
+                    rdbe = cmpd.rdbe()
+                    
+                    # add item
+                    buff.append([cmpd.formula(), mass, mz, error, hc, rdbe, None, cmpd])
                 
-                # count rdbe
-                rdbe = cmpd.rdbe()
-                
-                # add item
-                buff.append([cmpd.formula(), mass, mz, error, hc, rdbe, similarity, cmpd])
+                # stop if limit reached
+                if len(buff) >= config.massToFormula['countLimit']:
+                    break
+            
+            # compare isotopic patterns
+            if patterns:
+                similarities = self.compareIsotopicPatterns(
+                    compounds = [item[1] for item in patterns],
+                    charge = config.massToFormula['charge'],
+                    ionization = config.massToFormula['ionization'],
+                    shifts = [item[2] for item in patterns]
+                )
+                for x, item in enumerate(patterns):
+                    buff[item[0]][6] = similarities[x]
             
             self.currentFormulae = buff
         
@@ -847,12 +879,12 @@ class panelMassToFormula(wx.MiniFrame):
     # ----
     
     
-    def compareIsotopicPattern(self, compound, charge, ionization, shift=0.0):
-        """Compare theoretical and real isotopic pattern."""
+    def compareIsotopicPatterns(self, compounds, charge, ionization, shifts):
+        """Compare theoretical and real isotopic patterns."""
         
         # check document
         if self.currentDocument == None or not self.currentDocument.spectrum.hasprofile():
-            return None
+            return [None]*len(compounds)
         
         # get baseline window
         baselineWindow = 1.
@@ -865,57 +897,49 @@ class panelMassToFormula(wx.MiniFrame):
             offset = config.processing['baseline']['offset']
         )
         
-        # approximate fwhm
-        fwhm = 0.1
-        mz = compound.mz(charge, ionization, 1)[0]
-        peak = mspy.labelpeak(
+        # match patterns to signal
+        rmsd = mspy.matchpatterns(
             signal = self.currentDocument.spectrum.profile,
-            mz = mz+shift,
-            pickingHeight = config.processing['peakpicking']['pickingHeight'],
-            baseline = baseline
-        )
-        if peak:
-            fwhm = peak.fwhm
-        
-        # make pattern
-        pattern = compound.pattern(
-            fwhm = fwhm,
-            threshold = 0.01,
+            compounds = compounds,
             charge = charge,
             agentFormula = ionization,
             agentCharge = 1,
-            real = True
-        )
-        
-        # add error shift to pattern
-        for x in range(len(pattern)):
-            pattern[x][0] += shift
-        
-        # match pattern to signal
-        rms = mspy.matchpattern(
-            signal = self.currentDocument.spectrum.profile,
-            pattern = pattern,
             pickingHeight = config.processing['peakpicking']['pickingHeight'],
             baseline = baseline,
+            shifts = shifts,
+            processes = multiprocessing.cpu_count()
         )
         
-        # calc similarity
-        if rms != None:
-            rms = (1-rms)*100
+        # calc similarities
+        similarities = []
+        for rms in rmsd:
+            if rms != None:
+                rms = (1-rms)*100
+            similarities.append(rms)
         
-        return rms
+        return similarities
     # ----
     
     
-    def applyRules(self, compound):
-        """Apply current rules."""
+    def getRulesParams(self):
+        """Get current rules and their limits."""
         
+        rules = list(config.massToFormula['rules'])
         HC = (config.massToFormula['HCMin'], config.massToFormula['HCMax'])
         NOPSC = (config.massToFormula['NCMax'], config.massToFormula['OCMax'], config.massToFormula['PCMax'], config.massToFormula['SCMax'])
         RDBE = (config.massToFormula['RDBEMin'], config.massToFormula['RDBEMax'])
         
+        return (rules, HC, NOPSC, RDBE)
+    # ----
+    
+    
+    def applyRules(self, compound):
+        """Apply current rules."""
+        
+        rules, HC, NOPSC, RDBE = self.getRulesParams()
+        
         return compound.frules(
-            rules = config.massToFormula['rules'],
+            rules = rules,
             HC = HC,
             NOPSC = NOPSC,
             RDBE = RDBE,
@@ -2788,18 +2788,27 @@ class panelSequence(wx.MiniFrame):
             if config.sequence['digest']['allowMods']:
                 enzyme = None
             
-            # get variations for each peptide
-            buff = []
-            for peptide in peptides:
-                buff += peptide.variations(maxMods=config.sequence['digest']['maxMods'], position=config.sequence['digest']['retainPos'], enzyme=enzyme)
-            peptides = buff
-            
             # get max charge and polarity
             polarity = 1
             if config.sequence['digest']['maxCharge'] < 0:
                 polarity = -1
             maxCharge = abs(config.sequence['digest']['maxCharge'])+1
             
+            # get neutral mass range for all charges
+            masses = []
+            for z in range(1, maxCharge):
+                for mz in (config.sequence['digest']['lowMass'], config.sequence['digest']['highMass']):
+                    masses.append(mspy.mz(mz, 0, currentCharge=z*polarity, massType=config.sequence['digest']['massType']))
+            massRange = None
+            if masses:
+                massRange = (min(masses), max(masses))
+            
+            # get variations for each peptide
+            buff = []
+            for peptide in peptides:
+                buff += peptide.variations(maxMods=config.sequence['digest']['maxMods'], position=config.sequence['digest']['retainPos'], enzyme=enzyme, massRange=massRange, massType=config.sequence['digest']['massType'])
+            peptides = buff
+            
             # get list template
             template = config.sequence['digest']['listTemplateAmino']
             if self.currentSequence.chainType != 'aminoacids':
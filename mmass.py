@@ -23,6 +23,7 @@ from gui import libs
 import sys
 import os
 import threading
+import multiprocessing
 import socket
 import SocketServer
 import wx
@@ -133,6 +134,9 @@ class TCPServerHandler(SocketServer.BaseRequestHandler):
 
 if __name__ == '__main__':
     
+    # enable worker processes in frozen application
+    multiprocessing.freeze_support()
+    
     server = None
     
     # use server
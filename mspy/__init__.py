@@ -30,11 +30,14 @@ from obj_scan import *
 
 # load modules
 from mod_basics import *
+from mod_composition import *
 from mod_pattern import *
 from mod_signal import *
 from mod_calibration import *
 from mod_peakpicking import *
 from mod_proteo import *
+from mod_database import *
+from mod_search import *
 from mod_formulator import *
 from mod_envfit import *
 from mod_mascot import *
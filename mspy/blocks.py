@@ -180,10 +180,71 @@ class modification:
 
 
 
+class elementsdict(dict):
+    """Elements library which counts its changes.
+        revision: (int) number of changes made to the library
+    """
+    
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.revision = 0
+    # ----
+    
+    
+    def changed(self):
+        """Mark library as changed (call after editing element in place)."""
+        self.revision += 1
+    # ----
+    
+    
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.changed()
+    # ----
+    
+    
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.changed()
+    # ----
+    
+    
+    def clear(self):
+        dict.clear(self)
+        self.changed()
+    # ----
+    
+    
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.changed()
+    # ----
+    
+    
+    def setdefault(self, key, value=None):
+        if not key in self:
+            self.changed()
+        return dict.setdefault(self, key, value)
+    # ----
+    
+    
+    def pop(self, *args):
+        self.changed()
+        return dict.pop(self, *args)
+    # ----
+    
+    
+    def popitem(self):
+        self.changed()
+        return dict.popitem(self)
+    # ----
+    
+
+
 # DEFAULT BLOCKS
 # --------------
 
-elements = {
+elements = elementsdict({
     'Ac': element( name='Actinium', symbol='Ac', atomicNumber=89, isotopes={227: (227.02774700000001, 1.0)}, valence=3),
     'Ag': element( name='Silver', symbol='Ag', atomicNumber=47, isotopes={107: (106.90509299999999, 0.51839000000000002), 109: (108.90475600000001, 0.48160999999999998)}, valence=1),
     'Al': element( name='Aluminium', symbol='Al', atomicNumber=13, isotopes={27: (26.981538440000001, 1.0)}, valence=3),
@@ -292,7 +353,7 @@ elements = {
     'Yb': element( name='Ytterbium', symbol='Yb', atomicNumber=70, isotopes={168: (167.93389400000001, 0.0012999999999999999), 170: (169.93475900000001, 0.0304), 171: (170.93632199999999, 0.14280000000000001), 172: (171.93637770000001, 0.21829999999999999), 173: (172.93820679999999, 0.1613), 174: (173.9388581, 0.31830000000000003), 176: (175.94256799999999, 0.12759999999999999)}, valence=2),
     'Zn': element( name='Zinc', symbol='Zn', atomicNumber=30, isotopes={64: (63.929146600000003, 0.48630000000000001), 66: (65.926036800000006, 0.27900000000000003), 67: (66.927130899999995, 0.041000000000000002), 68: (67.924847600000007, 0.1875), 70: (69.925325000000001, 0.0061999999999999998)}, valence=2),
     'Zr': element( name='Zirconium', symbol='Zr', atomicNumber=40, isotopes={96: (95.908276000000001, 0.028000000000000001), 90: (89.904703699999999, 0.51449999999999996), 91: (90.905645000000007, 0.11219999999999999), 92: (91.905040099999994, 0.17150000000000001), 94: (93.906315800000002, 0.17380000000000001)}, valence=4),
-}
+})
 
 monomers = {
     
@@ -1,4 +1,5 @@
 #include <stdlib.h>
+#include <string.h>
 #include <math.h>
 #include <time.h>
 
@@ -32,8 +33,30 @@ typedef struct {
     double width;
 } m_noise;
 
+typedef struct {
+    int elcount;
+    int *minimum;
+    int *maximum;
+    double *masses;
+    double loMass;
+    double hiMass;
+    int rulescount;
+    double *coefs;
+    double *rulesLo;
+    double *rulesHi;
+    int *conditional;
+    double *carbon;
+    double *buffer;
+    double *minRest;
+    double *maxRest;
+    double *carbonRest;
+    double *rulesMinRest;
+    double *rulesMaxRest;
+} m_formula;
+
 
 #define ELEM_SWAP(a,b) { register double t=(a);(a)=(b);(b)=t; }
+#define RULES_EPSILON 1e-6
 
 void array_print( m_arrayd *p_inarr )
 {
@@ -382,6 +405,214 @@ m_noise signal_noise( m_arrayd *p_signal )
     return noise;
 }
 
+int noise_rank_sort( double values[], int len, double sorted[], int rank[] )
+{
+    unsigned long long *p_keys, *p_keysBuff, *p_swapKeys, key;
+    int *p_idx, *p_idxBuff, *p_swapIdx;
+    int counts[2048];
+    int shift, digit, total, tmp, i;
+    
+    // init buffers
+    p_keys = (unsigned long long*) malloc( len*sizeof(unsigned long long) );
+    p_keysBuff = (unsigned long long*) malloc( len*sizeof(unsigned long long) );
+    p_idx = (int*) malloc( len*sizeof(int) );
+    p_idxBuff = (int*) malloc( len*sizeof(int) );
+    if ( p_keys == NULL || p_keysBuff == NULL || p_idx == NULL || p_idxBuff == NULL ) {
+        free(p_keys);
+        free(p_keysBuff);
+        free(p_idx);
+        free(p_idxBuff);
+        return 0;
+    }
+    
+    // make keys preserving order of doubles
+    for ( i = 0; i < len; ++i ) {
+        memcpy( &key, &values[i], sizeof(double) );
+        p_keys[i] = ( key >> 63 ) ? ~key : key | 0x8000000000000000ULL;
+        p_idx[i] = i;
+    }
+    
+    // sort keys by 11-bit digits (stable, ties keep original order)
+    for ( shift = 0; shift < 64; shift += 11 ) {
+        
+        memset( counts, 0, sizeof(counts) );
+        for ( i = 0; i < len; ++i ) {
+            counts[(p_keys[i] >> shift) & 2047]++;
+        }
+        
+        // skip digit shared by all keys
+        if ( counts[(p_keys[0] >> shift) & 2047] == len ) continue;
+        
+        total = 0;
+        for ( digit = 0; digit < 2048; ++digit ) {
+            tmp = counts[digit];
+            counts[digit] = total;
+            total += tmp;
+        }
+        for ( i = 0; i < len; ++i ) {
+            digit = (p_keys[i] >> shift) & 2047;
+            p_keysBuff[counts[digit]] = p_keys[i];
+            p_idxBuff[counts[digit]++] = p_idx[i];
+        }
+        
+        p_swapKeys = p_keys; p_keys = p_keysBuff; p_keysBuff = p_swapKeys;
+        p_swapIdx = p_idx; p_idx = p_idxBuff; p_idxBuff = p_swapIdx;
+    }
+    
+    // store sorted values and ranks
+    for ( i = 0; i < len; ++i ) {
+        sorted[i] = values[p_idx[i]];
+        rank[p_idx[i]] = i;
+    }
+    
+    // free buffers
+    free(p_keys);
+    free(p_keysBuff);
+    free(p_idx);
+    free(p_idxBuff);
+    
+    return 1;
+}
+
+void noise_tree_update( int tree[], int size, int pos, int delta )
+{
+    for ( ++pos; pos <= size; pos += pos & (-pos) ) {
+        tree[pos] += delta;
+    }
+}
+
+int noise_tree_select( int tree[], int size, int step, int k )
+{
+    int pos = 0;
+    
+    // find position of k-th (zero-based) item within window
+    for ( ; step > 0; step >>= 1 ) {
+        if ( pos + step <= size && tree[pos + step] <= k ) {
+            pos += step;
+            k -= tree[pos];
+        }
+    }
+    
+    return pos;
+}
+
+m_arrayd *signal_noise_raster( m_arrayd *p_signal, m_arrayd *p_raster, double window )
+{
+    m_arrayd *p_result;
+    double *p_values, *p_sorted, *p_buff;
+    double x, level, width, lowDev, highDev;
+    int *p_tree, *p_rank;
+    int len, step, lo, hi, idx1, idx2, count, k, first, last, mid, i;
+    
+    len = p_signal->len;
+    
+    // init buffers
+    p_values = (double*) malloc( len*sizeof(double) );
+    p_sorted = (double*) malloc( len*sizeof(double) );
+    p_rank = (int*) malloc( len*sizeof(int) );
+    p_tree = (int*) calloc( len+1, sizeof(int) );
+    p_buff = (double*) malloc( 3*p_raster->len*sizeof(double) );
+    if ( p_values == NULL || p_sorted == NULL || p_rank == NULL || p_tree == NULL || p_buff == NULL ) {
+        free(p_values);
+        free(p_sorted);
+        free(p_rank);
+        free(p_tree);
+        free(p_buff);
+        return NULL;
+    }
+    
+    // sort intensities once and remember rank of each point
+    for ( i = 0; i < len; ++i ) {
+        p_values[i] = p_signal->data[2*i+1];
+    }
+    if ( !noise_rank_sort( p_values, len, p_sorted, p_rank ) ) {
+        free(p_values);
+        free(p_sorted);
+        free(p_rank);
+        free(p_tree);
+        free(p_buff);
+        return NULL;
+    }
+    free(p_values);
+    p_values = p_sorted;
+    
+    // get highest power of two for tree search
+    step = 1;
+    while ( step*2 <= len ) step *= 2;
+    
+    // slide window over raster
+    lo = hi = 0;
+    for ( i = 0; i < p_raster->len; ++i ) {
+        
+        x = p_raster->data[i];
+        idx1 = signal_locate_x( p_signal, x - x*window );
+        idx2 = signal_locate_x( p_signal, x + x*window );
+        
+        // empty window
+        if ( idx1 >= idx2 ) {
+            if ( idx1 > len-1 ) idx1 = len-1;
+            p_buff[3*i] = x;
+            p_buff[3*i+1] = p_signal->data[2*idx1+1];
+            p_buff[3*i+2] = 0.0;
+            continue;
+        }
+        
+        // move window edges
+        while ( hi < idx2 ) noise_tree_update( p_tree, len, p_rank[hi++], 1 );
+        while ( lo > idx1 ) noise_tree_update( p_tree, len, p_rank[--lo], 1 );
+        while ( hi > idx2 ) noise_tree_update( p_tree, len, p_rank[--hi], -1 );
+        while ( lo < idx1 ) noise_tree_update( p_tree, len, p_rank[lo++], -1 );
+        
+        // get noise level (lower median of y-values)
+        count = idx2 - idx1;
+        k = (count - 1) / 2;
+        level = p_values[noise_tree_select( p_tree, len, step, k )];
+        
+        // get noise width (lower median of abs deviations)
+        // the k+1 smallest deviations form a block of neighbouring values,
+        // find the block with the smallest spread around the level
+        first = 0;
+        last = count - k - 1;
+        while ( first < last ) {
+            mid = (first + last) / 2;
+            lowDev = level - p_values[noise_tree_select( p_tree, len, step, mid )];
+            highDev = p_values[noise_tree_select( p_tree, len, step, mid + k )] - level;
+            if ( highDev >= lowDev ) last = mid;
+            else first = mid + 1;
+        }
+        lowDev = level - p_values[noise_tree_select( p_tree, len, step, first )];
+        highDev = p_values[noise_tree_select( p_tree, len, step, first + k )] - level;
+        width = (lowDev > highDev) ? lowDev : highDev;
+        if ( first > 0 ) {
+            lowDev = level - p_values[noise_tree_select( p_tree, len, step, first - 1 )];
+            highDev = p_values[noise_tree_select( p_tree, len, step, first + k - 1 )] - level;
+            if ( lowDev < highDev ) lowDev = highDev;
+            if ( lowDev < width ) width = lowDev;
+        }
+        
+        p_buff[3*i] = x;
+        p_buff[3*i+1] = level;
+        p_buff[3*i+2] = 2 * width;
+    }
+    
+    // free buffers
+    free(p_values);
+    free(p_rank);
+    free(p_tree);
+    
+    // make result array
+    if ( (p_result = (m_arrayd*) malloc( sizeof(m_arrayd)) ) == NULL ) {
+        free(p_buff);
+        return NULL;
+    }
+    p_result->data = p_buff;
+    p_result->len = p_raster->len;
+    p_result->dim = 2;
+    p_result->cell = 3;
+    
+    return p_result;
+}
+
 m_arrayd *signal_local_maxima( m_arrayd *p_signal )
 {
     m_arrayd *p_maxima;
@@ -1118,33 +1349,26 @@ m_arrayd *signal_rescale( m_arrayd *p_signal, double scaleX, double scaleY, doub
     return p_result;
 }
 
-m_arrayd *signal_filter( m_arrayd *p_signal, double resol )
+int signal_filter_range( m_arrayd *p_signal, double resol, int first, int last, double p_buff[] )
 {
-    m_arrayd *p_result;
-    double *p_buff;
     double currentX, currentY, lastX, previousX, previousY, minY, maxY;
     int i, count;
     
-    // init buffer
-    if ( (p_buff = (double*) malloc( 4*2*p_signal->len*sizeof(double)) ) == NULL ) {
-        return NULL;
-    }
-    
     // add first point
-    p_buff[0] = p_signal->data[0];
-    p_buff[1] = p_signal->data[1];
-    lastX = previousX = p_signal->data[0];
-    minY = maxY = previousY = p_signal->data[1];
+    p_buff[0] = p_signal->data[2*first];
+    p_buff[1] = p_signal->data[2*first+1];
+    lastX = previousX = p_signal->data[2*first];
+    minY = maxY = previousY = p_signal->data[2*first+1];
     count = 1;
     
     // filter points
-    for ( i = 1; i < p_signal->len; i++ ) {
+    for ( i = first+1; i <= last; i++ ) {
         currentX = p_signal->data[2*i];
         currentY = p_signal->data[2*i+1];
         
         // if difference between current and previous x-values is higher
         //than resolution save previous point and its minimum and maximum
-        if ( (currentX-lastX) >= resol || i == (p_signal->len-1) ) {
+        if ( (currentX-lastX) >= resol || i == last ) {
             
             // add minimum in range
             if ( p_buff[2*count-2] != lastX || p_buff[2*count-1] != minY ) {
@@ -1186,26 +1410,98 @@ m_arrayd *signal_filter( m_arrayd *p_signal, double resol )
         }
     }
     
+    return count;
+}
+
+m_arrayd *signal_filter( m_arrayd *p_signal, double resol, int threads )
+{
+    m_arrayd *p_result;
+    double *p_buff;
+    int *p_starts, *p_counts;
+    int chunks, c, i, count;
+    
+    // check threads
+    chunks = ( threads > 1 && p_signal->len > 2*threads ) ? threads : 1;
+    
+    // init buffers
+    p_buff = (double*) malloc( 4*2*(p_signal->len+chunks)*sizeof(double) );
+    p_starts = (int*) malloc( (chunks+1)*sizeof(int) );
+    p_counts = (int*) malloc( chunks*sizeof(int) );
+    if ( p_buff == NULL || p_starts == NULL || p_counts == NULL ) {
+        free(p_buff);
+        free(p_starts);
+        free(p_counts);
+        return NULL;
+    }
+    
+    // find chunk starts, chunks can only be split at points which are
+    // farther than resolution from previous point (filter is reset there)
+    p_starts[0] = 0;
+    p_starts[chunks] = p_signal->len-1;
+    #pragma omp parallel for private(i) num_threads(chunks)
+    for ( c = 1; c < chunks; ++c ) {
+        i = (int) ((long) c * p_signal->len / chunks);
+        while ( i < p_signal->len-1 && (p_signal->data[2*i]-p_signal->data[2*i-2]) < resol ) {
+            ++i;
+        }
+        p_starts[c] = i;
+    }
+    
+    // filter chunks, each chunk ends with the first point of following one
+    #pragma omp parallel for private(i) num_threads(chunks)
+    for ( c = 0; c < chunks; ++c ) {
+        
+        // skip empty chunk
+        p_counts[c] = 0;
+        if ( c > 0 && p_starts[c] == p_starts[c-1] ) {
+            continue;
+        }
+        
+        // find start of following chunk
+        i = c+1;
+        while ( i < chunks && p_starts[i] == p_starts[c] ) {
+            ++i;
+        }
+        
+        p_counts[c] = signal_filter_range( p_signal, resol, p_starts[c], p_starts[i], p_buff + 4*2*(p_starts[c]+c) );
+    }
     
     // init results
+    count = 0;
+    for ( c = 0; c < chunks; ++c ) {
+        if ( p_counts[c] > 0 ) count += (count > 0) ? p_counts[c]-1 : p_counts[c];
+    }
     if ( (p_result = (m_arrayd*) malloc( sizeof(m_arrayd)) ) == NULL ) {
+        free(p_buff);
+        free(p_starts);
+        free(p_counts);
         return NULL;
     }
     if ( (p_result->data = (double*) malloc( 2*count*sizeof(double)) ) == NULL ) {
+        free(p_result);
+        free(p_buff);
+        free(p_starts);
+        free(p_counts);
         return NULL;
     }
     p_result->len = count;
     p_result->dim = 2;
     p_result->cell = 2;
     
-    // copy points
-    for ( i = 0; i < count; ++i) {
-        p_result->data[i*2] = p_buff[i*2];
-        p_result->data[i*2+1] = p_buff[i*2+1];
+    // copy points, skip first point of chunk already added by previous one
+    count = 0;
+    for ( c = 0; c < chunks; ++c ) {
+        for ( i = (count > 0) ? 1 : 0; i < p_counts[c]; ++i ) {
+            p_result->data[count*2] = p_buff[4*2*(p_starts[c]+c)+i*2];
+            p_result->data[count*2+1] = p_buff[4*2*(p_starts[c]+c)+i*2+1];
+            ++count;
+        }
     }
     
-    // free buffer
+    // free buffers
     free(p_buff);
+    free(p_starts);
+    free(p_counts);
     
     return p_result;
 }
@@ -1400,35 +1696,13 @@ m_arrayd *signal_profile_raster( m_arrayd *p_peaks, int points )
     return p_raster;
 }
 
-m_arrayd *signal_profile_to_raster( m_arrayd *p_peaks, m_arrayd *p_raster, double noise, int shape )
+void signal_profile_range( m_arrayd *p_peaks, m_arrayd *p_profile, int shape, int first, int last )
 {
-    
-    m_arrayd *p_profile;
     double mz, intens, fwhm, f, minX, maxX;
-    int idx1, idx2;
+    int idx1, idx2, idx;
     int i, j;
     
-    // check input
-    if ( p_peaks->len == 0 || p_raster->len == 0) {
-        return NULL;
-    }
-    
-    // init profile
-    if ( (p_profile = (m_arrayd*) malloc( sizeof(m_arrayd)) ) == NULL ) {
-        return NULL;
-    }
-    if ( (p_profile->data = (double*) malloc( 2*p_raster->len*sizeof(double)) ) == NULL ) {
-        return NULL;
-    }
-    p_profile->len = p_raster->len;
-    p_profile->dim = 2;
-    p_profile->cell = 2;
-    for ( i = 0; i < p_raster->len; ++i) {
-        p_profile->data[2*i] = p_raster->data[i];
-        p_profile->data[2*i+1] = 0;
-    }
-    
-    // model peaks
+    // model peaks within given raster range only
     for ( i = 0; i < p_peaks->len; ++i ) {
         
         mz = p_peaks->data[3*i];
@@ -1442,6 +1716,8 @@ m_arrayd *signal_profile_to_raster( m_arrayd *p_peaks, m_arrayd *p_raster, doubl
             maxX = mz + (5*fwhm);
             idx1 = signal_locate_x( p_profile, minX);
             idx2 = signal_locate_x( p_profile, maxX);
+            idx1 = ( idx1 > first ) ? idx1 : first;
+            idx2 = ( idx2 < last ) ? idx2 : last;
             
             f = (fwhm / 1.66)*(fwhm / 1.66);
             for ( j = idx1; j < idx2; ++j ) {
@@ -1456,6 +1732,8 @@ m_arrayd *signal_profile_to_raster( m_arrayd *p_peaks, m_arrayd *p_raster, doubl
             maxX = mz + (10*fwhm);
             idx1 = signal_locate_x( p_profile, minX);
             idx2 = signal_locate_x( p_profile, maxX);
+            idx1 = ( idx1 > first ) ? idx1 : first;
+            idx2 = ( idx2 < last ) ? idx2 : last;
             
             f = (fwhm / 2.0)*(fwhm / 2.0);
             for ( j = idx1; j < idx2; ++j ) {
@@ -1471,24 +1749,68 @@ m_arrayd *signal_profile_to_raster( m_arrayd *p_peaks, m_arrayd *p_raster, doubl
             idx1 = signal_locate_x( p_profile, minX);
             idx2 = signal_locate_x( p_profile, maxX);
             
+            // find last point of gaussian part (first point at or above mz)
+            idx = signal_locate_x( p_profile, mz);
+            while ( idx > idx1 && p_profile->data[2*idx-2] >= mz ) {
+                --idx;
+            }
+            idx = ( idx+1 < idx2 ) ? idx+1 : idx2;
+            
+            idx1 = ( idx1 > first ) ? idx1 : first;
+            idx2 = ( idx2 < last ) ? idx2 : last;
+            
             // model gaussian part
             f = (fwhm / 1.66)*(fwhm / 1.66);
-            for ( j = idx1; j < idx2; ++j ) {
+            for ( j = idx1; j < idx2 && j < idx; ++j ) {
                 p_profile->data[2*j+1] += intens * exp( -(p_profile->data[2*j]-mz)*(p_profile->data[2*j]-mz) / f );
-                if ( p_profile->data[2*j] >= mz ) break;
             }
             
             // model lorentzian part
             f = (fwhm / 2.0)*(fwhm / 2.0);
-            for ( j++; j < idx2; ++j ) {
+            for ( j = ( idx > idx1 ) ? idx : idx1; j < idx2; ++j ) {
                 p_profile->data[2*j+1] += intens / ( 1.0  + ((p_profile->data[2*j]-mz)*(p_profile->data[2*j]-mz)) / f );
             }
         }
-        
-        // unknown model
-        else {
-            return NULL;
-        }
+    }
+}
+
+m_arrayd *signal_profile_to_raster( m_arrayd *p_peaks, m_arrayd *p_raster, double noise, int shape, int threads )
+{
+    
+    m_arrayd *p_profile;
+    int chunks, c, i;
+    
+    // check input
+    if ( p_peaks->len == 0 || p_raster->len == 0) {
+        return NULL;
+    }
+    
+    // check model
+    if ( shape < 0 || shape > 2 ) {
+        return NULL;
+    }
+    
+    // init profile
+    if ( (p_profile = (m_arrayd*) malloc( sizeof(m_arrayd)) ) == NULL ) {
+        return NULL;
+    }
+    if ( (p_profile->data = (double*) malloc( 2*p_raster->len*sizeof(double)) ) == NULL ) {
+        free(p_profile);
+        return NULL;
+    }
+    p_profile->len = p_raster->len;
+    p_profile->dim = 2;
+    p_profile->cell = 2;
+    for ( i = 0; i < p_raster->len; ++i) {
+        p_profile->data[2*i] = p_raster->data[i];
+        p_profile->data[2*i+1] = 0;
+    }
+    
+    // model peaks, raster is split into independent chunks
+    chunks = ( threads > 1 && p_raster->len > threads ) ? threads : 1;
+    #pragma omp parallel for num_threads(chunks)
+    for ( c = 0; c < chunks; ++c ) {
+        signal_profile_range( p_peaks, p_profile, shape, (int) ((long) c * p_raster->len / chunks), (int) ((long) (c+1) * p_raster->len / chunks) );
     }
     
     // add noise
@@ -1502,7 +1824,7 @@ m_arrayd *signal_profile_to_raster( m_arrayd *p_peaks, m_arrayd *p_raster, doubl
     return p_profile;
 }
 
-m_arrayd *signal_profile( m_arrayd *p_peaks, int points, double noise, int shape )
+m_arrayd *signal_profile( m_arrayd *p_peaks, int points, double noise, int shape, int threads )
 {
     
     m_arrayd *p_profile, *p_raster;
@@ -1514,8 +1836,10 @@ m_arrayd *signal_profile( m_arrayd *p_peaks, int points, double noise, int shape
     }
     
     // make profile
-    p_profile = signal_profile_to_raster( p_peaks, p_raster, noise, shape );
+    p_profile = signal_profile_to_raster( p_peaks, p_raster, noise, shape, threads );
     if ( p_profile == NULL ) {
+        free(p_raster->data);
+        free(p_raster);
         return NULL;
     }
     
@@ -1530,105 +1854,282 @@ m_arrayd *signal_profile( m_arrayd *p_peaks, int points, double noise, int shape
 // COMPOSITION GENERATOR
 // --------------------------------------------------------------------------
 
-void formula_generator( m_arrayi *p_result, int elcount, int minimum[], int maximum[], double masses[], double loMass, double hiMass, int limit, int pos)
+int formula_prepare( m_formula *p_ctx )
 {
-    int *current;
-    double mass;
-    int i;
+    int elcount, rulescount;
+    int i, k;
+    double coef;
     
-    // calculate current mass
-    mass = 0;
-    for ( i = 0; i < elcount; ++i) {
-        mass += minimum[i]*masses[i];
-    }
+    elcount = p_ctx->elcount;
+    rulescount = p_ctx->rulescount;
     
-    // recursion end reached
-    if ( pos == elcount ) {
+    // init single work buffer
+    if ( (p_ctx->buffer = (double*) malloc( (3*elcount + 2*rulescount*elcount + 1)*sizeof(double)) ) == NULL ) {
+        return 0;
+    }
+    p_ctx->minRest = p_ctx->buffer;
+    p_ctx->maxRest = p_ctx->minRest + elcount;
+    p_ctx->carbonRest = p_ctx->maxRest + elcount;
+    p_ctx->rulesMinRest = p_ctx->carbonRest + elcount;
+    p_ctx->rulesMaxRest = p_ctx->rulesMinRest + rulescount*elcount;
+    
+    // calculate limits reachable by positions following current one
+    for ( i = elcount-1; i >= 0; --i ) {
+        if ( i == elcount-1 ) {
+            p_ctx->minRest[i] = 0;
+            p_ctx->maxRest[i] = 0;
+            p_ctx->carbonRest[i] = 0;
+            for ( k = 0; k < rulescount; ++k ) {
+                p_ctx->rulesMinRest[k*elcount+i] = 0;
+                p_ctx->rulesMaxRest[k*elcount+i] = 0;
+            }
+            continue;
+        }
+        
+        p_ctx->minRest[i] = p_ctx->minRest[i+1] + p_ctx->minimum[i+1]*p_ctx->masses[i+1];
+        p_ctx->maxRest[i] = p_ctx->maxRest[i+1] + p_ctx->maximum[i+1]*p_ctx->masses[i+1];
+        p_ctx->carbonRest[i] = p_ctx->carbonRest[i+1] + p_ctx->minimum[i+1]*p_ctx->carbon[i+1];
         
-        // check mass tolerance and store current composition
-        if ( (mass >= loMass) && (mass <= hiMass) && (p_result->len < limit) ) {
-            for ( i = 0; i < elcount; ++i) {
-                p_result->data[p_result->len*elcount+i] = minimum[i];
+        for ( k = 0; k < rulescount; ++k ) {
+            coef = p_ctx->coefs[k*elcount+i+1];
+            if ( coef > 0 ) {
+                p_ctx->rulesMinRest[k*elcount+i] = p_ctx->rulesMinRest[k*elcount+i+1] + coef*p_ctx->minimum[i+1];
+                p_ctx->rulesMaxRest[k*elcount+i] = p_ctx->rulesMaxRest[k*elcount+i+1] + coef*p_ctx->maximum[i+1];
+            }
+            else {
+                p_ctx->rulesMinRest[k*elcount+i] = p_ctx->rulesMinRest[k*elcount+i+1] + coef*p_ctx->maximum[i+1];
+                p_ctx->rulesMaxRest[k*elcount+i] = p_ctx->rulesMaxRest[k*elcount+i+1] + coef*p_ctx->minimum[i+1];
             }
-            p_result->len++;
         }
-        return;
     }
     
-    // duplicate current minima as a new item to allow changes
-    if ( (current = (int*) malloc( elcount*sizeof(int)) ) == NULL ) {
-        return;
+    return 1;
+}
+
+int formula_check( m_formula *p_ctx, int current[], int pos, int *p_jump )
+{
+    double mass, value, coef, carbon, limit, step;
+    int elcount, k, j;
+    
+    elcount = p_ctx->elcount;
+    *p_jump = 1;
+    
+    // get mass of fixed positions
+    mass = 0;
+    for ( j = 0; j <= pos; ++j ) {
+        mass += current[j]*p_ctx->masses[j];
     }
-    for ( i = 0; i < elcount; ++i) {
-        current[i] = minimum[i];
+    
+    // high mass cannot be satisfied by higher counts
+    if ( mass + p_ctx->minRest[pos] > p_ctx->hiMass ) {
+        return -1;
+    }
+    
+    // low mass can be reached by higher counts
+    if ( mass + p_ctx->maxRest[pos] < p_ctx->loMass ) {
+        step = floor((p_ctx->loMass - mass - p_ctx->maxRest[pos]) / p_ctx->masses[pos]);
+        if ( step > *p_jump ) {
+            *p_jump = (step > p_ctx->maximum[pos] - current[pos] + 1) ? p_ctx->maximum[pos] - current[pos] + 1 : (int) step;
+        }
+        return 0;
     }
     
-    // manin recursion loop
-    // increment current position and send data to next recursion
-    while (current[pos] <= maximum[pos]) {
+    // check rules
+    for ( k = 0; k < p_ctx->rulescount; ++k ) {
+        
+        // skip conditional rules if carbon count can be zero
+        if ( p_ctx->conditional[k] ) {
+            carbon = p_ctx->carbonRest[pos];
+            for ( j = 0; j <= pos; ++j ) {
+                carbon += current[j]*p_ctx->carbon[j];
+            }
+            if ( carbon <= 0 ) {
+                continue;
+            }
+        }
         
-        // check high mass and stored items limits
-        if ( (mass > hiMass) || (p_result->len >= limit) ) {
-            break;
+        // get value of fixed positions
+        value = 0;
+        for ( j = 0; j <= pos; ++j ) {
+            value += current[j]*p_ctx->coefs[k*elcount+j];
         }
+        coef = p_ctx->coefs[k*elcount+pos];
         
-        // do next recursion
-        formula_generator( p_result, elcount, current, maximum, masses, loMass, hiMass, limit, pos+1);
+        // value is too high
+        limit = value + p_ctx->rulesMinRest[k*elcount+pos] - p_ctx->rulesHi[k] - RULES_EPSILON;
+        if ( limit > 0 ) {
+            if ( coef >= 0 ) {
+                return -1;
+            }
+            step = floor(limit / -coef);
+            if ( step > *p_jump ) {
+                *p_jump = (step > p_ctx->maximum[pos] - current[pos] + 1) ? p_ctx->maximum[pos] - current[pos] + 1 : (int) step;
+            }
+            return 0;
+        }
+        
+        // value is too low
+        limit = p_ctx->rulesLo[k] - RULES_EPSILON - value - p_ctx->rulesMaxRest[k*elcount+pos];
+        if ( limit > 0 ) {
+            if ( coef <= 0 ) {
+                return -1;
+            }
+            step = floor(limit / coef);
+            if ( step > *p_jump ) {
+                *p_jump = (step > p_ctx->maximum[pos] - current[pos] + 1) ? p_ctx->maximum[pos] - current[pos] + 1 : (int) step;
+            }
+            return 0;
+        }
+    }
+    
+    return 1;
+}
+
+int formula_search( m_formula *p_ctx, int current[], int pos, int increment )
+{
+    int state, jump;
+    
+    // increment current position
+    if ( increment ) {
         current[pos]++;
-        mass += masses[pos];
     }
     
-    // free buffer
-    free(current);
+    // walk through compositions depth first, skip branches which cannot satisfy mass or rules
+    while ( 1 ) {
+        
+        // check current position
+        if ( current[pos] > p_ctx->maximum[pos] ) {
+            state = -1;
+        }
+        else {
+            state = formula_check( p_ctx, current, pos, &jump );
+        }
+        
+        // go to next position or return full composition
+        if ( state == 1 ) {
+            if ( pos == p_ctx->elcount-1 ) {
+                return 1;
+            }
+            pos++;
+            current[pos] = p_ctx->minimum[pos];
+        }
+        
+        // try higher count
+        else if ( state == 0 ) {
+            current[pos] += jump;
+        }
+        
+        // return to previous position
+        else {
+            current[pos] = p_ctx->minimum[pos];
+            pos--;
+            if ( pos < 0 ) {
+                return 0;
+            }
+            current[pos]++;
+        }
+    }
 }
 
-m_arrayi *formula_composition( int elcount, int minimum[], int maximum[], double masses[], double loMass, double hiMass, int limit )
+int formula_generator( m_arrayi *p_result, m_formula *p_ctx, int current[], int limit, int resume )
 {
-    m_arrayi *p_buff, *p_result;
+    int elcount, found;
     int i;
     
-    // init buffer
-    if ( (p_buff = (m_arrayi*) malloc( sizeof(m_arrayd)) ) == NULL ) {
-        return NULL;
+    elcount = p_ctx->elcount;
+    
+    // check empty composition
+    if ( elcount == 0 ) {
+        if ( !resume && (p_ctx->loMass <= 0) && (p_ctx->hiMass >= 0) ) {
+            p_result->len++;
+        }
+        return 0;
     }
-    if ( (p_buff->data = (int*) malloc( limit*elcount*sizeof(double)) ) == NULL ) {
-        return NULL;
+    
+    // continue after given composition
+    if ( resume ) {
+        found = formula_search( p_ctx, current, elcount-1, 1 );
     }
-    p_buff->len = 0;
-    p_buff->dim = 2;
-    p_buff->cell = elcount;
     
-    // generate compositions
-    formula_generator( p_buff, elcount, minimum, maximum, masses, loMass, hiMass, limit, 0);
+    // start from minimal composition
+    else {
+        for ( i = 0; i < elcount; ++i ) {
+            current[i] = p_ctx->minimum[i];
+            if ( p_ctx->minimum[i] > p_ctx->maximum[i] ) {
+                return 0;
+            }
+        }
+        found = formula_search( p_ctx, current, 0, 0 );
+    }
     
-    // check compositions
-    if (p_buff->len == 0) {
-        return NULL;
+    // store compositions
+    while ( found ) {
+        for ( i = 0; i < elcount; ++i) {
+            p_result->data[p_result->len*elcount+i] = current[i];
+        }
+        p_result->len++;
+        
+        // stop if limit reached, current composition is kept as cursor
+        if ( p_result->len >= limit ) {
+            return 1;
+        }
+        
+        found = formula_search( p_ctx, current, elcount-1, 1 );
     }
     
+    return 0;
+}
+
+m_arrayi *formula_composition( m_formula *p_ctx, int limit, int current[], int resume, int *p_more )
+{
+    m_arrayi *p_result;
+    int elcount;
+    
+    elcount = p_ctx->elcount;
+    
     // init results
-    if ( (p_result = (m_arrayi*) malloc( sizeof(m_arrayd)) ) == NULL ) {
+    if ( (p_result = (m_arrayi*) malloc( sizeof(m_arrayi)) ) == NULL ) {
         return NULL;
     }
-    if ( (p_result->data = (int*) malloc( p_buff->len*elcount*sizeof(double)) ) == NULL ) {
+    if ( (p_result->data = (int*) malloc( (limit*elcount+1)*sizeof(int)) ) == NULL ) {
+        free(p_result);
         return NULL;
     }
-    p_result->len = p_buff->len;
+    p_result->len = 0;
     p_result->dim = 2;
     p_result->cell = elcount;
     
-    // copy compositions
-    for ( i = 0; i < p_buff->len*elcount; ++i ) {
-        p_result->data[i] = p_buff->data[i];
+    // init work buffer
+    if ( !formula_prepare( p_ctx ) ) {
+        free(p_result->data);
+        free(p_result);
+        return NULL;
     }
     
-    // free buffer
-    free(p_buff->data);
-    free(p_buff);
+    // generate compositions, current composition is used as cursor
+    *p_more = 0;
+    if ( limit > 0 ) {
+        *p_more = formula_generator( p_result, p_ctx, current, limit, resume );
+    }
+    
+    // free work buffer
+    free(p_ctx->buffer);
     
     return p_result;
 }
 
+void formula_free( m_formula *p_ctx )
+{
+    free(p_ctx->minimum);
+    free(p_ctx->maximum);
+    free(p_ctx->conditional);
+    free(p_ctx->masses);
+    free(p_ctx->carbon);
+    free(p_ctx->coefs);
+    free(p_ctx->rulesLo);
+    free(p_ctx->rulesHi);
+}
+
 
 // HELPERS
 // --------------------------------------------------------------------------
@@ -1655,6 +2156,30 @@ m_arrayd *array_py2md( PyArrayObject *p_inarr )
     return p_outarr;
 }
 
+m_arrayd *array_py2md_copy( PyArrayObject *p_inarr )
+{
+    m_arrayd *p_outarr;
+    int len, dim, cell;
+    
+    // get array dimensions
+    len = (int) PyArray_DIM(p_inarr, 0);
+    dim = cell = (int) PyArray_NDIM(p_inarr);
+    if ( dim == 2 ) cell = (int) PyArray_DIM(p_inarr, 1);
+    
+    // make m_arrayd with own copy of data (freed together with the struct),
+    // original array may be changed by other thread while GIL is released
+    if ( (p_outarr = (m_arrayd*) malloc( sizeof(m_arrayd) + len*cell*sizeof(double)) ) == NULL ) {
+        return NULL;
+    }
+    p_outarr->data = (double *) (p_outarr + 1);
+    p_outarr->len = len;
+    p_outarr->dim = dim;
+    p_outarr->cell = cell;
+    memcpy( p_outarr->data, p_inarr->data, len*cell*sizeof(double) );
+    
+    return p_outarr;
+}
+
 PyArrayObject *array_md2py( m_arrayd *p_inarr )
 {
     PyArrayObject *p_outarr;
@@ -1712,6 +2237,7 @@ PyObject *list_mi2py( m_arrayi *p_inarr )
                 PyList_SetItem( p_inner, j,  p_item);
             }
             PyList_Append(p_outlist, p_inner);
+            Py_DECREF(p_inner);
         }
     }
     
@@ -1723,6 +2249,63 @@ PyObject *list_mi2py( m_arrayi *p_inarr )
 }
 
 
+int formula_py2c( m_formula *p_ctx, PyObject *p_minimum, PyObject *p_maximum, PyObject *p_masses, PyObject *p_rules, PyObject *p_carbon )
+{
+    PyObject *p_rule, *p_coefs;
+    int elcount, rulescount;
+    int i, k;
+    
+    // get sizes
+    elcount = (int) PyTuple_Size(p_minimum);
+    rulescount = 0;
+    if ( p_rules != NULL && p_rules != Py_None ) {
+        rulescount = (int) PyTuple_Size(p_rules);
+    }
+    p_ctx->elcount = elcount;
+    p_ctx->rulescount = rulescount;
+    p_ctx->buffer = NULL;
+    
+    // init arrays
+    p_ctx->minimum = (int*) malloc( (elcount+1)*sizeof(int));
+    p_ctx->maximum = (int*) malloc( (elcount+1)*sizeof(int));
+    p_ctx->conditional = (int*) malloc( (rulescount+1)*sizeof(int));
+    p_ctx->masses = (double*) malloc( (elcount+1)*sizeof(double));
+    p_ctx->carbon = (double*) malloc( (elcount+1)*sizeof(double));
+    p_ctx->coefs = (double*) malloc( (rulescount*elcount+1)*sizeof(double));
+    p_ctx->rulesLo = (double*) malloc( (rulescount+1)*sizeof(double));
+    p_ctx->rulesHi = (double*) malloc( (rulescount+1)*sizeof(double));
+    if ( p_ctx->minimum == NULL || p_ctx->maximum == NULL || p_ctx->conditional == NULL || p_ctx->masses == NULL || p_ctx->carbon == NULL || p_ctx->coefs == NULL || p_ctx->rulesLo == NULL || p_ctx->rulesHi == NULL ) {
+        formula_free( p_ctx );
+        return 0;
+    }
+    
+    // get elements
+    for ( i = 0; i < elcount; ++i) {
+        p_ctx->minimum[i] = (int) PyLong_AsLong(PyTuple_GetItem(p_minimum, i));
+        p_ctx->maximum[i] = (int) PyLong_AsLong(PyTuple_GetItem(p_maximum, i));
+        p_ctx->masses[i] = (double) PyFloat_AsDouble(PyTuple_GetItem(p_masses, i));
+        p_ctx->carbon[i] = 0;
+        if ( p_carbon != NULL && p_carbon != Py_None ) {
+            p_ctx->carbon[i] = (double) PyFloat_AsDouble(PyTuple_GetItem(p_carbon, i));
+        }
+    }
+    
+    // get rules (coefficients, low limit, high limit, applied only if carbon present)
+    for ( k = 0; k < rulescount; ++k) {
+        p_rule = PyTuple_GetItem(p_rules, k);
+        p_coefs = PyTuple_GetItem(p_rule, 0);
+        for ( i = 0; i < elcount; ++i) {
+            p_ctx->coefs[k*elcount+i] = (double) PyFloat_AsDouble(PyTuple_GetItem(p_coefs, i));
+        }
+        p_ctx->rulesLo[k] = (double) PyFloat_AsDouble(PyTuple_GetItem(p_rule, 1));
+        p_ctx->rulesHi[k] = (double) PyFloat_AsDouble(PyTuple_GetItem(p_rule, 2));
+        p_ctx->conditional[k] = (int) PyLong_AsLong(PyTuple_GetItem(p_rule, 3));
+    }
+    
+    return 1;
+}
+
+
 // PYTHON WRAPERS
 // --------------------------------------------------------------------------
 
@@ -1795,11 +2378,16 @@ static PyObject *_wrap_signal_locate_max_y( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // get index
+    Py_BEGIN_ALLOW_THREADS
     result = signal_locate_max_y( p_msignal );
+    Py_END_ALLOW_THREADS
     
     // free memory
     free(p_msignal);
@@ -1818,11 +2406,16 @@ static PyObject *_wrap_signal_box( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // get bounding box
+    Py_BEGIN_ALLOW_THREADS
     result = signal_box( p_msignal );
+    Py_END_ALLOW_THREADS
     
     // free memory
     free(p_msignal);
@@ -1912,11 +2505,16 @@ static PyObject *_wrap_signal_area( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // get area
+    Py_BEGIN_ALLOW_THREADS
     result = signal_area( p_msignal );
+    Py_END_ALLOW_THREADS
     
     // free memory
     free(p_msignal);
@@ -1935,11 +2533,16 @@ static PyObject *_wrap_signal_noise( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // get noise
+    Py_BEGIN_ALLOW_THREADS
     result = signal_noise( p_msignal );
+    Py_END_ALLOW_THREADS
     
     // free memory
     free(p_msignal);
@@ -1947,6 +2550,49 @@ static PyObject *_wrap_signal_noise( PyObject *self, PyObject *args )
     return Py_BuildValue("dd", result.level, result.width);
 }
 
+static PyObject *_wrap_signal_noise_raster( PyObject *self, PyObject *args )
+{
+    PyArrayObject *p_signal, *p_raster, *p_results;
+    m_arrayd *p_msignal, *p_mraster, *p_mresults;
+    double window;
+    
+    // get params
+    if ( !PyArg_ParseTuple(args, "OOd", &p_signal, &p_raster, &window) ) {
+        return NULL;
+    }
+    
+    // copy signal and raster to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    p_mraster = array_py2md_copy(p_raster);
+    if ( p_msignal == NULL || p_mraster == NULL ) {
+        free(p_msignal);
+        free(p_mraster);
+        return PyErr_NoMemory();
+    }
+    
+    // get noise for raster points
+    Py_BEGIN_ALLOW_THREADS
+    p_mresults = signal_noise_raster( p_msignal, p_mraster, window );
+    Py_END_ALLOW_THREADS
+    
+    // free memory
+    free(p_msignal);
+    free(p_mraster);
+    
+    if ( p_mresults == NULL ) {
+        return PyErr_NoMemory();
+    }
+    
+    // make numpy array
+    p_results = array_md2py( p_mresults );
+    
+    // free memory
+    free(p_mresults->data);
+    free(p_mresults);
+    
+    return PyArray_Return(p_results);
+}
+
 static PyObject *_wrap_signal_local_maxima( PyObject *self, PyObject *args )
 {
     PyArrayObject *p_signal, *p_results;
@@ -1957,11 +2603,16 @@ static PyObject *_wrap_signal_local_maxima( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // get local maxima
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_local_maxima( p_msignal );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -1987,11 +2638,16 @@ static PyObject *_wrap_signal_crop( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // crop signal
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_crop( p_msignal, minX, maxX );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2015,11 +2671,16 @@ static PyObject *_wrap_signal_offset( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // offset signal
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_offset( p_msignal, x, y );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2043,11 +2704,16 @@ static PyObject *_wrap_signal_multiply( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // multiply signal
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_multiply( p_msignal, x, y );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2070,11 +2736,16 @@ static PyObject *_wrap_signal_normalize( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // normalize signal
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_normalize( p_msignal );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2098,11 +2769,16 @@ static PyObject *_wrap_signal_smooth_ma( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // smooth signal
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_smooth_ma( p_msignal, window, cycles );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2126,11 +2802,16 @@ static PyObject *_wrap_signal_smooth_ga( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // smooth signal
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_smooth_ga( p_msignal, window, cycles );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2153,12 +2834,19 @@ static PyObject *_wrap_signal_combine( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signals to m_arrayd
-    p_msignalA = array_py2md(p_signalA);
-    p_msignalB = array_py2md(p_signalB);
+    // copy signals to m_arrayd
+    p_msignalA = array_py2md_copy(p_signalA);
+    p_msignalB = array_py2md_copy(p_signalB);
+    if ( p_msignalA == NULL || p_msignalB == NULL ) {
+        free(p_msignalA);
+        free(p_msignalB);
+        return PyErr_NoMemory();
+    }
     
     // combine signals
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_combine( p_msignalA, p_msignalB );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2182,12 +2870,19 @@ static PyObject *_wrap_signal_overlay( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signals to m_arrayd
-    p_msignalA = array_py2md(p_signalA);
-    p_msignalB = array_py2md(p_signalB);
+    // copy signals to m_arrayd
+    p_msignalA = array_py2md_copy(p_signalA);
+    p_msignalB = array_py2md_copy(p_signalB);
+    if ( p_msignalA == NULL || p_msignalB == NULL ) {
+        free(p_msignalA);
+        free(p_msignalB);
+        return PyErr_NoMemory();
+    }
     
     // overlay signals
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_overlay( p_msignalA, p_msignalB );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2211,12 +2906,19 @@ static PyObject *_wrap_signal_subtract( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signals to m_arrayd
-    p_msignalA = array_py2md(p_signalA);
-    p_msignalB = array_py2md(p_signalB);
+    // copy signals to m_arrayd
+    p_msignalA = array_py2md_copy(p_signalA);
+    p_msignalB = array_py2md_copy(p_signalB);
+    if ( p_msignalA == NULL || p_msignalB == NULL ) {
+        free(p_msignalA);
+        free(p_msignalB);
+        return PyErr_NoMemory();
+    }
     
     // subtract signals
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_subtract( p_msignalA, p_msignalB );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2240,12 +2942,19 @@ static PyObject *_wrap_signal_subbase( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signals to m_arrayd
-    p_msignal = array_py2md(p_signal);
-    p_mbaseline = array_py2md(p_baseline);
+    // copy signals to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    p_mbaseline = array_py2md_copy(p_baseline);
+    if ( p_msignal == NULL || p_mbaseline == NULL ) {
+        free(p_msignal);
+        free(p_mbaseline);
+        return PyErr_NoMemory();
+    }
     
     // subtract baseline
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_subbase( p_msignal, p_mbaseline );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2272,11 +2981,16 @@ static PyObject *_wrap_signal_rescale( PyObject *self, PyObject *args )
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // rescale signal
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_rescale( p_msignal, scaleX, scaleY, shiftX, shiftY );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2294,23 +3008,36 @@ static PyObject *_wrap_signal_filter( PyObject *self, PyObject *args )
     PyArrayObject *p_signal, *p_results;
     m_arrayd *p_msignal, *p_mresults;
     double resol;
+    int threads;
     
     // get params
-    if ( !PyArg_ParseTuple(args, "Od", &p_signal, &resol) ) {
+    threads = 1;
+    if ( !PyArg_ParseTuple(args, "Od|i", &p_signal, &resol, &threads) ) {
         return NULL;
     }
     
-    // convert signal to m_arrayd
-    p_msignal = array_py2md(p_signal);
+    // copy signal to m_arrayd
+    p_msignal = array_py2md_copy(p_signal);
+    if ( p_msignal == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // filter signal
-    p_mresults = signal_filter( p_msignal, resol );
+    Py_BEGIN_ALLOW_THREADS
+    p_mresults = signal_filter( p_msignal, resol, threads );
+    Py_END_ALLOW_THREADS
+    
+    // free memory
+    free(p_msignal);
+    
+    if ( p_mresults == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // make numpy array
     p_results = array_md2py( p_mresults );
     
     // free memory
-    free(p_msignal);
     free(p_mresults->data);
     free(p_mresults);
     
@@ -2332,7 +3059,9 @@ static PyObject *_wrap_signal_gaussian( PyObject *self, PyObject *args )
     }
     
     // make gaussian peak
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_gaussian( x, minY, maxY, fwhm, points );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2357,7 +3086,9 @@ static PyObject *_wrap_signal_lorentzian( PyObject *self, PyObject *args )
     }
     
     // make gaussian peak
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_lorentzian( x, minY, maxY, fwhm, points );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2382,7 +3113,9 @@ static PyObject *_wrap_signal_gausslorentzian( PyObject *self, PyObject *args )
     }
     
     // make gauss-lorentzian peak
+    Py_BEGIN_ALLOW_THREADS
     p_mresults = signal_gausslorentzian( x, minY, maxY, fwhm, points );
+    Py_END_ALLOW_THREADS
     
     // make numpy array
     p_results = array_md2py( p_mresults );
@@ -2401,23 +3134,37 @@ static PyObject *_wrap_signal_profile( PyObject *self, PyObject *args )
     double noise;
     int shape;
     int points;
+    int threads;
     
     // get params
-    if ( !PyArg_ParseTuple(args, "Oidi", &p_peaks, &points, &noise, &shape) ) {
+    threads = 1;
+    if ( !PyArg_ParseTuple(args, "Oidi|i", &p_peaks, &points, &noise, &shape, &threads) ) {
         return NULL;
     }
     
-    // convert peaks to m_arrayd
-    p_mpeaks = array_py2md(p_peaks);
+    // copy peaks to m_arrayd
+    p_mpeaks = array_py2md_copy(p_peaks);
+    if ( p_mpeaks == NULL ) {
+        return PyErr_NoMemory();
+    }
     
     // make profile
-    p_mresults = signal_profile( p_mpeaks, points, noise, shape );
+    Py_BEGIN_ALLOW_THREADS
+    p_mresults = signal_profile( p_mpeaks, points, noise, shape, threads );
+    Py_END_ALLOW_THREADS
+    
+    // free memory
+    free(p_mpeaks);
+    
+    if ( p_mresults == NULL ) {
+        PyErr_SetString(PyExc_ValueError, "Cannot make profile, check peaks and shape!");
+        return NULL;
+    }
     
     // make numpy array
     p_results = array_md2py( p_mresults );
     
     // free memory
-    free(p_mpeaks);
     free(p_mresults->data);
     free(p_mresults);
     
@@ -2430,25 +3177,41 @@ static PyObject *_wrap_signal_profile_to_raster( PyObject *self, PyObject *args
     m_arrayd *p_mpeaks, *p_mraster, *p_mresults;
     double noise;
     int shape;
+    int threads;
     
     // get params
-    if ( !PyArg_ParseTuple(args, "OOdi", &p_peaks, &p_raster, &noise, &shape) ) {
+    threads = 1;
+    if ( !PyArg_ParseTuple(args, "OOdi|i", &p_peaks, &p_raster, &noise, &shape, &threads) ) {
         return NULL;
     }
     
-    // convert peaks and raster to m_arrayd
-    p_mpeaks = array_py2md(p_peaks);
-    p_mraster = array_py2md(p_raster);
+    // copy peaks and raster to m_arrayd
+    p_mpeaks = array_py2md_copy(p_peaks);
+    p_mraster = array_py2md_copy(p_raster);
+    if ( p_mpeaks == NULL || p_mraster == NULL ) {
+        free(p_mpeaks);
+        free(p_mraster);
+        return PyErr_NoMemory();
+    }
     
     // make profile
-    p_mresults = signal_profile_to_raster( p_mpeaks, p_mraster, noise, shape );
+    Py_BEGIN_ALLOW_THREADS
+    p_mresults = signal_profile_to_raster( p_mpeaks, p_mraster, noise, shape, threads );
+    Py_END_ALLOW_THREADS
+    
+    // free memory
+    free(p_mpeaks);
+    free(p_mraster);
+    
+    if ( p_mresults == NULL ) {
+        PyErr_SetString(PyExc_ValueError, "Cannot make profile, check peaks, raster and shape!");
+        return NULL;
+    }
     
     // make numpy array
     p_results = array_md2py( p_mresults );
     
     // free memory
-    free(p_mpeaks);
-    free(p_mraster);
     free(p_mresults->data);
     free(p_mresults);
     
@@ -2462,46 +3225,110 @@ static PyObject *_wrap_formula_composition( PyObject *self, PyObject *args )
     PyObject *p_minimum, *p_maximum, *p_masses;
     PyObject *p_results;
     m_arrayi *p_mresults;
-    int *p_cminimum, *p_cmaximum;
-    double *p_cmasses;
-    double loMass, hiMass;
-    int limit, elcount;
-    int i;
+    m_formula ctx;
+    int *p_ccurrent;
+    int limit, more;
     
     // get params
-    if ( !PyArg_ParseTuple(args, "OOOddi", &p_minimum, &p_maximum, &p_masses, &loMass, &hiMass, &limit) ) {
+    if ( !PyArg_ParseTuple(args, "OOOddi", &p_minimum, &p_maximum, &p_masses, &ctx.loMass, &ctx.hiMass, &limit) ) {
         return NULL;
     }
     
-    // get elements count
-    elcount = (int) PyTuple_Size(p_minimum);
+    // init generator
+    if ( !formula_py2c( &ctx, p_minimum, p_maximum, p_masses, NULL, NULL ) ) {
+        return PyErr_NoMemory();
+    }
+    if ( (p_ccurrent = (int*) malloc( (ctx.elcount+1)*sizeof(int)) ) == NULL ) {
+        formula_free( &ctx );
+        return PyErr_NoMemory();
+    }
     
-    // init input arrays
-    if ( (p_cminimum = (int*) malloc( elcount*sizeof(int)) ) == NULL ) {
-        return NULL;
+    // generate compositions
+    Py_BEGIN_ALLOW_THREADS
+    p_mresults = formula_composition( &ctx, limit, p_ccurrent, 0, &more );
+    Py_END_ALLOW_THREADS
+    
+    // make python list
+    p_results = list_mi2py( p_mresults );
+    
+    // free memory
+    formula_free( &ctx );
+    free(p_ccurrent);
+    
+    if ( p_mresults != NULL ) {
+        free(p_mresults->data);
+        free(p_mresults);
     }
-    if ( (p_cmaximum = (int*) malloc( elcount*sizeof(int)) ) == NULL ) {
+    
+    return p_results;
+}
+
+// ----------
+
+static PyObject *_wrap_formula_composition_chunk( PyObject *self, PyObject *args )
+{
+    PyObject *p_minimum, *p_maximum, *p_masses, *p_cursor, *p_rules, *p_carbon;
+    PyObject *p_compositions, *p_results;
+    m_arrayi *p_mresults;
+    m_formula ctx;
+    int *p_ccurrent;
+    int limit, resume, more;
+    int i;
+    
+    // get params
+    p_rules = NULL;
+    p_carbon = NULL;
+    if ( !PyArg_ParseTuple(args, "OOOddiO|OO", &p_minimum, &p_maximum, &p_masses, &ctx.loMass, &ctx.hiMass, &limit, &p_cursor, &p_rules, &p_carbon) ) {
         return NULL;
     }
-    if ( (p_cmasses = (double*) malloc( elcount*sizeof(double)) ) == NULL ) {
+    
+    // check cursor
+    resume = (p_cursor != Py_None);
+    if ( resume && PyTuple_Size(p_cursor) != PyTuple_Size(p_minimum) ) {
+        PyErr_SetString(PyExc_ValueError, "Cursor size is not equal to elements count!");
         return NULL;
     }
-    for ( i = 0; i < elcount; ++i) {
-        p_cminimum[i] = (int) PyLong_AsLong(PyTuple_GetItem(p_minimum, i));
-        p_cmaximum[i] = (int) PyLong_AsLong(PyTuple_GetItem(p_maximum, i));
-        p_cmasses[i] = (double) PyFloat_AsDouble(PyTuple_GetItem(p_masses, i));
+    
+    // init generator
+    if ( !formula_py2c( &ctx, p_minimum, p_maximum, p_masses, p_rules, p_carbon ) ) {
+        return PyErr_NoMemory();
+    }
+    if ( (p_ccurrent = (int*) malloc( (ctx.elcount+1)*sizeof(int)) ) == NULL ) {
+        formula_free( &ctx );
+        return PyErr_NoMemory();
+    }
+    if ( resume ) {
+        for ( i = 0; i < ctx.elcount; ++i) {
+            p_ccurrent[i] = (int) PyLong_AsLong(PyTuple_GetItem(p_cursor, i));
+        }
     }
     
     // generate compositions
-    p_mresults = formula_composition( elcount, p_cminimum, p_cmaximum, p_cmasses, loMass, hiMass, limit );
+    Py_BEGIN_ALLOW_THREADS
+    p_mresults = formula_composition( &ctx, limit, p_ccurrent, resume, &more );
+    Py_END_ALLOW_THREADS
     
     // make python list
-    p_results = list_mi2py( p_mresults );
+    p_compositions = list_mi2py( p_mresults );
+    
+    // make cursor
+    if ( more ) {
+        p_cursor = PyTuple_New( ctx.elcount );
+        for ( i = 0; i < ctx.elcount; ++i ) {
+            PyTuple_SetItem( p_cursor, i, PyInt_FromLong(p_ccurrent[i]) );
+        }
+    }
+    else {
+        Py_INCREF(Py_None);
+        p_cursor = Py_None;
+    }
+    
+    // make results
+    p_results = Py_BuildValue("(NN)", p_compositions, p_cursor);
     
     // free memory
-    free(p_cminimum);
-    free(p_cmaximum);
-    free(p_cmasses);
+    formula_free( &ctx );
+    free(p_ccurrent);
     
     if ( p_mresults != NULL ) {
         free(p_mresults->data);
@@ -2529,6 +3356,7 @@ static PyMethodDef calculations_methods[] = {
    {"signal_width", _wrap_signal_width, METH_VARARGS, "signal_width( PyArray, double, double )"},
    {"signal_area", _wrap_signal_area, METH_VARARGS, "signal_area( PyArray )"},
    {"signal_noise", _wrap_signal_noise, METH_VARARGS, "signal_noise( PyArray )"},
+   {"signal_noise_raster", _wrap_signal_noise_raster, METH_VARARGS, "signal_noise_raster( PyArray, PyArray, double )"},
    {"signal_local_maxima", _wrap_signal_local_maxima, METH_VARARGS, "signal_local_maxima( PyArray )"},
    
    {"signal_crop", _wrap_signal_crop, METH_VARARGS, "signal_crop( PyArray, double, double )"},
@@ -2543,15 +3371,16 @@ static PyMethodDef calculations_methods[] = {
    {"signal_subbase", _wrap_signal_subbase, METH_VARARGS, "signal_subbase( PyArray, PyArray )"},
    
    {"signal_rescale", _wrap_signal_rescale, METH_VARARGS, "signal_rescale( PyArray, double, double, double, double )"},
-   {"signal_filter", _wrap_signal_filter, METH_VARARGS, "signal_filter( PyArray, double )"},
+   {"signal_filter", _wrap_signal_filter, METH_VARARGS, "signal_filter( PyArray, double, int )"},
    
    {"signal_gaussian", _wrap_signal_gaussian, METH_VARARGS, "signal_gaussian( double, double, double, double, int, double )"},
    {"signal_lorentzian", _wrap_signal_lorentzian, METH_VARARGS, "signal_lorentzian( double, double, double, double, int, double )"},
    {"signal_gausslorentzian", _wrap_signal_gausslorentzian, METH_VARARGS, "signal_gausslorentzian( double, double, double, double, int, double )"},
-   {"signal_profile", _wrap_signal_profile, METH_VARARGS, "signal_profile( PyArray, int, double, int )"},
-   {"signal_profile_to_raster", _wrap_signal_profile_to_raster, METH_VARARGS, "signal_profile_to_raster( PyArray, PyArray, double, int )"},
+   {"signal_profile", _wrap_signal_profile, METH_VARARGS, "signal_profile( PyArray, int, double, int, int )"},
+   {"signal_profile_to_raster", _wrap_signal_profile_to_raster, METH_VARARGS, "signal_profile_to_raster( PyArray, PyArray, double, int, int )"},
    
    {"formula_composition", _wrap_formula_composition, METH_VARARGS, "formula_composition( PyTupleObject, PyTupleObject, PyTupleObject, double, double, int )"},
+   {"formula_composition_chunk", _wrap_formula_composition_chunk, METH_VARARGS, "formula_composition_chunk( PyTupleObject, PyTupleObject, PyTupleObject, double, double, int, PyTupleObject, PyTupleObject, PyTupleObject )"},
    
    {NULL, NULL, 0, NULL}
 };
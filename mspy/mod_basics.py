@@ -52,6 +52,14 @@ ELEMENT_PATTERN = re.compile(r'''
             ([\-]?[\d]*) # atom count
 ''', re.X)
 
+FORMULA_TOKENS_PATTERN = re.compile(r'''
+            ([A-Z][a-z]{0,2}) # atom symbol
+            (?:\{([\d]+)\})? # isotope
+            ([\-]?[\d]*) # atom count
+            |(\() # start parenthesis
+            |\)([\d]*) # end parenthesis and count
+''', re.X)
+
 
 # BASIC FUNCTIONS
 # ---------------
@@ -230,6 +238,16 @@ def frules(compound, rules=['HC','NOPSC','NOPS','RDBE','RDBEInt'], HC=(0.1, 3.0)
     countP = float(compound.count('P', groupIsotopes=True))
     countS = float(compound.count('S', groupIsotopes=True))
     
+    # get RDBE
+    rdbeValue = rdbe(compound)
+    
+    return _frules(countC, countH, countN, countO, countP, countS, rdbeValue, rules, HC, NOPSC, RDBE)
+# ----
+
+
+def _frules(countC, countH, countN, countO, countP, countS, rdbeValue, rules, HC, NOPSC, RDBE):
+    """Check formula rules for given atom counts and RDBE."""
+    
     # get carbon ratios
     if countC:
         ratioHC = countH / countC
@@ -238,9 +256,6 @@ def frules(compound, rules=['HC','NOPSC','NOPS','RDBE','RDBEInt'], HC=(0.1, 3.0)
         ratioPC = countP / countC
         ratioSC = countS / countC
     
-    # get RDBE
-    rdbeValue = rdbe(compound)
-    
     # check HC rule
     if 'HC' in rules and countC:
         if (ratioHC < HC[0] or ratioHC > HC[1]):
@@ -0,0 +1,178 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import numpy
+
+# load blocks
+import blocks
+
+
+# elements placed at the beginning of composition vectors
+LEADING_ATOMS = ('C', 'H', 'N', 'O', 'P', 'S')
+
+
+# COMPOSITION REGISTRY
+# --------------------
+
+class compositionregistry:
+    """Fixed order of elements and isotopes used for composition vectors.
+        Composition vectors are numpy integer arrays, so they can be simply
+        added, subtracted and scaled. Leading elements (C, H, N, O, P, S)
+        come first, followed by remaining elements and specified isotopes.
+    """
+    
+    def __init__(self):
+        
+        self.revision = blocks.elements.revision
+        
+        # get atoms
+        symbols = sorted(blocks.elements.keys())
+        self.atoms = [x for x in LEADING_ATOMS if x in blocks.elements]
+        self.atoms += [x for x in symbols if not x in LEADING_ATOMS]
+        for symbol in symbols:
+            for massNo in sorted(blocks.elements[symbol].isotopes):
+                self.atoms.append('%s{%d}' % (symbol, massNo))
+        
+        # make index and masses
+        self.index = {}
+        self._masses = {}
+        self._table = numpy.zeros((len(self.atoms), 2), dtype=numpy.float64)
+        for x, atom in enumerate(self.atoms):
+            
+            if '{' in atom:
+                symbol, massNo = atom[:-1].split('{')
+                isotope = blocks.elements[symbol].isotopes[int(massNo)]
+                atomMass = (isotope[0], isotope[0])
+            else:
+                atomMass = blocks.elements[atom].mass
+            
+            self.index[atom] = x
+            self._masses[atom] = atomMass
+            self._table[x] = atomMass
+    # ----
+    
+    
+    def __len__(self):
+        """Get number of registered atoms."""
+        return len(self.atoms)
+    # ----
+    
+    
+    def vector(self, composition, length=None):
+        """Convert composition to vector.
+            composition (dict or mspy.compound) - elemental composition
+            length (int) - vector length, all atoms by default
+        """
+        
+        # get composition
+        if not isinstance(composition, dict):
+            composition = composition.composition()
+        
+        # make vector
+        if length == None:
+            length = len(self.atoms)
+        vector = numpy.zeros(length, dtype=numpy.int64)
+        for atom, count in composition.items():
+            x = self.index[atom]
+            if x >= length:
+                raise ValueError, 'Atom is not covered by vector length! --> ' + atom
+            vector[x] = count
+        
+        return vector
+    # ----
+    
+    
+    def composition(self, vector):
+        """Convert vector to composition.
+            vector (numpy.array) - composition vector
+        """
+        
+        composition = {}
+        for x in numpy.flatnonzero(vector):
+            composition[self.atoms[x]] = int(vector[x])
+        
+        return composition
+    # ----
+    
+    
+    def mass(self, composition):
+        """Calculate monoisotopic and average mass of composition.
+            composition (dict) - elemental composition
+        """
+        
+        massMo = 0
+        massAv = 0
+        for atom, count in composition.items():
+            atomMass = self._masses[atom]
+            massMo += atomMass[0]*count
+            massAv += atomMass[1]*count
+        
+        return (massMo, massAv)
+    # ----
+    
+    
+    def nominalmass(self, composition):
+        """Calculate nominal mass of composition.
+            composition (dict) - elemental composition
+        """
+        
+        nominalmass = 0
+        for atom, count in composition.items():
+            nominalmass += round(self._masses[atom][0])*count
+        
+        return nominalmass
+    # ----
+    
+    
+    def masses(self, vectors):
+        """Calculate monoisotopic and average masses for composition vectors.
+            vectors (numpy.array) - N x E matrix or single vector, E can be
+                lower than registry size to cover leading atoms only
+        """
+        
+        vectors = numpy.asarray(vectors)
+        return numpy.dot(vectors, self._table[:vectors.shape[-1]])
+    # ----
+    
+
+
+# current registry
+_registry = None
+
+
+def registry():
+    """Get composition registry for current elements."""
+    
+    global _registry
+    
+    # make new registry if elements changed
+    if _registry == None or _registry.revision != blocks.elements.revision:
+        _registry = compositionregistry()
+    
+    return _registry
+# ----
+
+
+def masses(vectors):
+    """Calculate monoisotopic and average masses for composition vectors.
+        vectors (numpy.array) - N x E matrix or single vector
+    """
+    
+    return registry().masses(vectors)
+# ----
+
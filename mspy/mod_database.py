@@ -0,0 +1,485 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import os
+import collections
+import multiprocessing
+import numpy
+
+# load stopper
+from mod_stopper import CHECK_FORCE_QUIT
+
+# load building blocks
+import blocks
+
+# load objects
+import obj_sequence
+
+# load modules
+import mod_basics
+import mod_proteo
+
+# load parsers
+import parser_fasta
+
+
+# DIGEST INDEX
+# ------------
+
+# stored peptide record
+DIGEST_DTYPE = [
+    ('mass', numpy.float64),
+    ('protein', numpy.int32),
+    ('start', numpy.int32),
+    ('stop', numpy.int32),
+    ('miscleavages', numpy.int8),
+    ('variant', numpy.int32),
+]
+
+
+def digestdatabase(fastaPath, path, enzyme, miscleavage=1, fixedMods=[], variableMods=[], maxMods=1, allowMods=False, minMass=500., maxMass=5000., massType=0, processes=None, chunkSize=100):
+    """Digest all sequences of FASTA database and save their peptides as digest index.
+        Peptides are stored as references to protein and position only, sorted
+        by neutral mass. Sequences are digested in worker processes.
+        fastaPath: (str) FASTA database path
+        path: (str) index files path without extension (.digest and .npy files are created)
+        enzyme: (str) enzyme name - must be defined in mspy.enzymes
+        miscleavage: (int) number of allowed misscleavages
+        fixedMods: (list) fixed modifications as [name, position], position is amino acid or nTerm/cTerm
+        variableMods: (list) variable modifications as [name, position], position is amino acid or nTerm/cTerm
+        maxMods: (int) maximum variable modifications allowed per one residue
+        allowMods: (bool) do not care about modifications in cleavage site
+        minMass: (float) min neutral mass of stored peptides
+        maxMass: (float) max neutral mass of stored peptides
+        massType: (0 or 1) mass type, 0 = monoisotopic, 1 = average
+        processes: (int or None) number of worker processes
+        chunkSize: (int) number of sequences sent to worker at once
+    """
+    
+    # check enzyme
+    if not enzyme in blocks.enzymes:
+        raise KeyError, 'Unknown enzyme! -> ' + enzyme
+    
+    # check modifications
+    for name, position in list(fixedMods) + list(variableMods):
+        if not name in blocks.modifications:
+            raise KeyError, 'Unknown modification! --> ' + name
+    
+    fixedMods = [(name, position) for name, position in fixedMods]
+    variableMods = [(name, position) for name, position in variableMods]
+    params = (enzyme, miscleavage, fixedMods, variableMods, maxMods, allowMods, minMass, maxMass, massType)
+    
+    # get database size and time to recognize later changes
+    stat = os.stat(fastaPath)
+    
+    # get sequences chunks
+    proteins = []
+    def chunks():
+        chunk = []
+        for title, accession, chain, offset in parser_fasta.parseFASTA(fastaPath).records():
+            chunk.append((len(proteins), chain))
+            proteins.append((offset, accession or title.split(' ')[0]))
+            if len(chunk) == chunkSize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    # collect peptides with global variants
+    data = []
+    variants = [()]
+    variantIds = {(): 0}
+    def collect(result):
+        peptides, chunkVariants = result
+        lookup = []
+        for variant in chunkVariants:
+            if not variant in variantIds:
+                variantIds[variant] = len(variants)
+                variants.append(variant)
+            lookup.append(variantIds[variant])
+        peptides['variant'] = numpy.array(lookup, dtype=numpy.int32)[peptides['variant']]
+        data.append(peptides)
+    
+    # digest in current process
+    if not processes or processes < 2:
+        for chunk in chunks():
+            collect(_digestdatabase(chunk, params))
+    
+    # digest in worker processes
+    else:
+        pending = collections.deque()
+        pool = multiprocessing.Pool(processes, _digestdatabaseInit, (params,))
+        try:
+            for chunk in chunks():
+                pending.append(pool.apply_async(_digestdatabaseWorker, (chunk,)))
+                while len(pending) >= processes*2:
+                    collect(_waitResult(pending.popleft()))
+            while pending:
+                collect(_waitResult(pending.popleft()))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    
+    # sort peptides by mass
+    if data:
+        data = numpy.concatenate(data)
+    else:
+        data = numpy.zeros(0, dtype=DIGEST_DTYPE)
+    data = data[numpy.argsort(data['mass'], kind='mergesort')]
+    
+    # make index
+    index = ['mspy-digestindex %d' % (digestindex.version)]
+    index.append('fasta\t%s\t%d\t%d' % (os.path.abspath(fastaPath), stat.st_size, int(stat.st_mtime)))
+    index.append('enzyme\t%s' % enzyme)
+    index.append('miscleavage\t%d' % miscleavage)
+    index.append('maxMods\t%d' % maxMods)
+    index.append('allowMods\t%d' % int(allowMods))
+    index.append('massRange\t%r\t%r' % (minMass, maxMass))
+    index.append('massType\t%d' % massType)
+    for name, position in fixedMods:
+        index.append('fixed\t%s\t%s' % (name, position))
+    for name, position in variableMods:
+        index.append('variable\t%s\t%s' % (name, position))
+    for variant in variants:
+        index.append('variant' + ''.join(['\t%s\t%s' % mod for mod in variant]))
+    for offset, accession in proteins:
+        index.append('protein\t%d\t%s' % (offset, accession))
+    
+    # save index
+    dataFile = file(path+'.npy', 'wb')
+    numpy.save(dataFile, data)
+    dataFile.close()
+    indexFile = file(path+'.digest', 'w')
+    indexFile.write('\n'.join(index))
+    indexFile.close()
+    
+    return digestindex(path)
+# ----
+
+
+def _digestdatabase(chunk, params):
+    """Digest chunk of sequences and get peptides records with chunk variants."""
+    
+    enzyme, miscleavage, fixedMods, variableMods, maxMods, allowMods, minMass, maxMass, massType = params
+    
+    # check modifications in cleavage site
+    variationsEnzyme = enzyme
+    if allowMods:
+        variationsEnzyme = None
+    
+    buff = []
+    variants = [()]
+    variantIds = {(): 0}
+    for protein, chain in chunk:
+        
+        CHECK_FORCE_QUIT()
+        
+        # make sequence
+        try:
+            sequence = obj_sequence.sequence(chain)
+        except KeyError:
+            continue
+        if not sequence.chain:
+            continue
+        
+        # apply modifications
+        for name, position in fixedMods:
+            sequence.modify(name, position, 'f')
+        for name, position in variableMods:
+            sequence.modify(name, position, 'v')
+        
+        # digest sequence
+        for peptide in mod_proteo.digest(sequence, enzyme, miscleavage, allowMods):
+            start, stop = peptide.history[-1][1:3]
+            fixedCount = len([mod for mod in peptide.modifications if mod[2] == 'f'])
+            
+            # store variations within mass range
+            for variation in peptide.variations(maxMods=maxMods, position=False, enzyme=variationsEnzyme, massRange=(minMass, maxMass), massType=massType):
+                variant = tuple([(mod[0], mod[1]) for mod in variation.modifications[fixedCount:]])
+                if not variant in variantIds:
+                    variantIds[variant] = len(variants)
+                    variants.append(variant)
+                buff.append((variation.mass(massType), protein, start, stop, peptide.miscleavages, variantIds[variant]))
+    
+    return numpy.array(buff, dtype=DIGEST_DTYPE), variants
+# ----
+
+
+def _digestdatabaseInit(params):
+    """Set digest params within worker process."""
+    
+    global _digestParams
+    _digestParams = params
+# ----
+
+
+def _digestdatabaseWorker(chunk):
+    """Digest chunk of sequences within worker process."""
+    return _digestdatabase(chunk, _digestParams)
+# ----
+
+
+def _waitResult(result):
+    """Wait for worker result while checking force quit."""
+    
+    while True:
+        try:
+            return result.get(0.1)
+        except multiprocessing.TimeoutError:
+            CHECK_FORCE_QUIT()
+# ----
+
+
+
+class digestindex:
+    """Sorted peptide masses of digested FASTA database stored on disk.
+        Peptide records are memory-mapped and refer to protein and position
+        only, sequence objects are made on request.
+        path: (str) index files path without extension
+    """
+    
+    version = 2
+    cacheSize = 100
+    
+    def __init__(self, path):
+        
+        self.path = path
+        
+        self.fastaPath = None
+        self.fastaSize = None
+        self.fastaTime = None
+        self.enzyme = None
+        self.miscleavage = 0
+        self.maxMods = 1
+        self.allowMods = False
+        self.minMass = 0.
+        self.maxMass = 0.
+        self.massType = 0
+        self.fixedMods = []
+        self.variableMods = []
+        self.variants = []
+        self.proteins = []
+        
+        self._parser = None
+        self._sequences = collections.OrderedDict()
+        
+        # read index
+        indexFile = file(path+'.digest', 'r')
+        index = indexFile.read().splitlines()
+        indexFile.close()
+        
+        # check version
+        if not index or index[0].split() != ['mspy-digestindex', str(self.version)]:
+            raise ValueError, 'Unsupported digest index! --> ' + path
+        
+        # read params
+        for line in index[1:]:
+            items = line.split('\t')
+            if items[0] == 'protein':
+                self.proteins.append((int(items[1]), items[2]))
+            elif items[0] == 'variant':
+                self.variants.append(tuple(zip(items[1::2], items[2::2])))
+            elif items[0] == 'fasta':
+                self.fastaPath = items[1]
+                self.fastaSize = int(items[2])
+                self.fastaTime = int(items[3])
+            elif items[0] == 'enzyme':
+                self.enzyme = items[1]
+            elif items[0] == 'miscleavage':
+                self.miscleavage = int(items[1])
+            elif items[0] == 'maxMods':
+                self.maxMods = int(items[1])
+            elif items[0] == 'allowMods':
+                self.allowMods = bool(int(items[1]))
+            elif items[0] == 'massRange':
+                self.minMass = float(items[1])
+                self.maxMass = float(items[2])
+            elif items[0] == 'massType':
+                self.massType = int(items[1])
+            elif items[0] == 'fixed':
+                self.fixedMods.append((items[1], items[2]))
+            elif items[0] == 'variable':
+                self.variableMods.append((items[1], items[2]))
+        
+        # check database was not changed since indexing
+        if not self.fastaPath or not os.path.exists(self.fastaPath):
+            raise ValueError, 'FASTA database of digest index not found! --> ' + path
+        stat = os.stat(self.fastaPath)
+        if stat.st_size != self.fastaSize or int(stat.st_mtime) != self.fastaTime:
+            raise ValueError, 'FASTA database was changed since indexing! --> ' + self.fastaPath
+        
+        # read data
+        self.data = numpy.load(path+'.npy', mmap_mode='r')
+        self.masses = self.data['mass']
+    # ----
+    
+    
+    def __len__(self):
+        """Get number of stored peptides."""
+        return len(self.data)
+    # ----
+    
+    
+    def find(self, lowMass, highMass):
+        """Get indices of peptides within neutral mass range.
+            lowMass: (float) low neutral mass
+            highMass: (float) high neutral mass
+        """
+        
+        lo = numpy.searchsorted(self.masses, lowMass, side='left')
+        hi = numpy.searchsorted(self.masses, highMass, side='right')
+        
+        return numpy.arange(lo, hi)
+    # ----
+    
+    
+    def search(self, mass, charge, tolerance, tolUnits='Da'):
+        """Get indices of peptides matching specified ion.
+            mass: (float) m/z value to search for
+            charge: (int) charge of the m/z value
+            tolerance: (float) mass tolerance
+            tolUnits: ('Da', 'ppm') tolerance units
+        """
+        
+        # set mass limits
+        if tolUnits == 'ppm':
+            lowMass = mass - (tolerance * mass/1000000)
+            highMass = mass + (tolerance * mass/1000000)
+        else:
+            lowMass = mass - tolerance
+            highMass = mass + tolerance
+        
+        # get neutral masses
+        if charge != 0:
+            lowMass = mod_basics.mz(lowMass, 0, currentCharge=charge, massType=self.massType)
+            highMass = mod_basics.mz(highMass, 0, currentCharge=charge, massType=self.massType)
+        
+        return self.find(lowMass, highMass)
+    # ----
+    
+    
+    def protein(self, i):
+        """Get modified protein sequence of given protein index."""
+        
+        # use cached sequence
+        if i in self._sequences:
+            sequence = self._sequences.pop(i)
+            self._sequences[i] = sequence
+            return sequence
+        
+        # get parser
+        if self._parser == None:
+            self._parser = parser_fasta.parseFASTA(self.fastaPath)
+        
+        # read sequence
+        sequence = self._parser.sequenceat(self.proteins[i][0])
+        
+        # apply modifications
+        for name, position in self.fixedMods:
+            sequence.modify(name, position, 'f')
+        for name, position in self.variableMods:
+            sequence.modify(name, position, 'v')
+        
+        # keep recently used sequences only
+        if len(self._sequences) >= self.cacheSize:
+            self._sequences.popitem(last=False)
+        self._sequences[i] = sequence
+        
+        return sequence
+    # ----
+    
+    
+    def peptide(self, i):
+        """Get peptide sequence of given peptide index."""
+        
+        record = self.data[i]
+        peptide = self._slice(record)
+        
+        # apply variable modifications
+        mods = [mod for mod in peptide.modifications if mod[2] == 'f']
+        for name, position in self.variants[int(record['variant'])]:
+            mods.append([name, position, 'f'])
+        peptide.modifications[:] = mods
+        peptide.reset()
+        
+        return peptide
+    # ----
+    
+    
+    def positioned(self, i):
+        """Get all variants of given peptide index having variable modifications
+        at specific positions, e.g. for fragments calculation."""
+        
+        record = self.data[i]
+        variant = self.variants[int(record['variant'])]
+        
+        # all modifications are positioned already
+        if not [mod for mod in variant if mod[1] == '']:
+            return [self.peptide(i)]
+        
+        # check modifications in cleavage site
+        enzyme = self.enzyme
+        if self.allowMods:
+            enzyme = None
+        
+        # make positioned variations of the same mass
+        peptide = self._slice(record)
+        fixedCount = len([mod for mod in peptide.modifications if mod[2] == 'f'])
+        mass = float(record['mass'])
+        variations = peptide.variations(maxMods=self.maxMods, position=True, enzyme=enzyme, massRange=(mass-1e-4, mass+1e-4), massType=self.massType)
+        
+        # keep variations with stored modifications
+        variant = sorted(variant)
+        buff = []
+        for variation in variations:
+            mods = []
+            for mod in variation.modifications[fixedCount:]:
+                if mod[1] in ('nTerm', 'cTerm'):
+                    mods.append((mod[0], mod[1]))
+                else:
+                    mods.append((mod[0], ''))
+            if sorted(mods) == variant:
+                buff.append(variation)
+        
+        return buff
+    # ----
+    
+    
+    def _slice(self, record):
+        """Get peptide of given record with fixed and variable modifications of protein."""
+        
+        sequence = self.protein(int(record['protein']))
+        start = int(record['start'])
+        stop = int(record['stop'])
+        
+        # get peptide
+        peptide = sequence[start:stop]
+        peptide.miscleavages = int(record['miscleavages'])
+        
+        # add terminal groups
+        if start != 0:
+            peptide.nTermFormula = blocks.enzymes[self.enzyme].nTermFormula
+        if stop != len(sequence):
+            peptide.cTermFormula = blocks.enzymes[self.enzyme].cTermFormula
+        
+        return peptide
+    # ----
+
+
+
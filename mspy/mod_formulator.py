@@ -15,9 +15,17 @@
 #     main directory of the program.
 # -------------------------------------------------------------------------
 
+# load libs
+import math
+import multiprocessing
+import numpy
+
 # load stopper
 from mod_stopper import CHECK_FORCE_QUIT
 
+# load blocks
+import blocks
+
 # load objects
 import obj_compound
 
@@ -29,7 +37,7 @@ import calculations
 # MASS TO FORMULA FUNCTIONS
 # -------------------------
 
-def formulator(mz, charge=0, tolerance=1., units='ppm', composition={}, agentFormula='H', agentCharge=1, limit=1000):
+def formulator(mz, charge=0, tolerance=1., units='ppm', composition={}, agentFormula='H', agentCharge=1, limit=1000, rules=[], HC=(0.1, 3.0), NOPSC=(4,3,2,3), RDBE=(-1,40)):
     """Generate formulae for given mass, tolerance and composition limits.
         mz (float) - searched m/z value
         charge (int) - current charge
@@ -39,8 +47,335 @@ def formulator(mz, charge=0, tolerance=1., units='ppm', composition={}, agentFor
         agentFormula (str) - charging agent formula
         agentCharge (int) - charging agent unit charge
         limit (int) - maximum formulae allowed to be calculated
+        rules (list of str) - formula rules to be checked (see mspy.frules)
+        HC (tuple) - H/C limits
+        NOPSC (tuple) - NOPS/C max values
+        RDBE (tuple) - RDBE limits
+    """
+    
+    # get search params
+    params = _params(mz, charge, tolerance, units, composition, agentFormula, agentCharge)
+    if not params:
+        return []
+    elements, minComposition, maxComposition, elementMasses, loMass, hiMass = params
+    
+    # generate compositions
+    if not rules:
+        comps = _compositions(minComposition, maxComposition, elementMasses, loMass, hiMass, limit)
+        return _formulae(elements, comps)
+    
+    # generate formulae passing rules
+    formulae = []
+    for chunk, cursor in iformulator(mz, charge, tolerance, units, composition, agentFormula, agentCharge, limit, None, rules, HC, NOPSC, RDBE):
+        formulae += chunk[:limit-len(formulae)]
+        if len(formulae) >= limit:
+            break
+    
+    return formulae
+# ----
+
+
+def iformulator(mz, charge=0, tolerance=1., units='ppm', composition={}, agentFormula='H', agentCharge=1, chunk=1000, cursor=None, rules=[], HC=(0.1, 3.0), NOPSC=(4,3,2,3), RDBE=(-1,40)):
+    """Generate formulae for given mass, tolerance and composition limits in chunks.
+        Yields (formulae, cursor) for each chunk. Generation can be resumed
+        later by passing the cursor of last processed chunk. Cursor of last
+        chunk is None.
+        mz (float) - searched m/z value
+        charge (int) - current charge
+        tolerance (float) - mass tolerance
+        units (ppm or Da) - mass tolerance units
+        composition (dict of 'element':[min count, max count]) - composition limits
+        agentFormula (str) - charging agent formula
+        agentCharge (int) - charging agent unit charge
+        chunk (int) - maximum formulae calculated at once
+        cursor (tuple or None) - position to resume generation after
+        rules (list of str) - formula rules to be checked (see mspy.frules)
+        HC (tuple) - H/C limits
+        NOPSC (tuple) - NOPS/C max values
+        RDBE (tuple) - RDBE limits
     """
     
+    # get search params
+    params = _params(mz, charge, tolerance, units, composition, agentFormula, agentCharge)
+    if not params:
+        return
+    elements, minComposition, maxComposition, elementMasses, loMass, hiMass = params
+    
+    # check cursor
+    if cursor != None and len(cursor) != len(elements):
+        raise ValueError, "Cursor doesn't match composition limits!"
+    
+    # get element symbols and valences
+    symbols, valences = _valences(elements)
+    
+    # get linear rules to skip compositions early
+    constraints, carbon = _constraints(symbols, valences, rules, HC, NOPSC, RDBE)
+    
+    # generate chunks
+    while True:
+        
+        CHECK_FORCE_QUIT()
+        
+        comps, cursor = calculations.formula_composition_chunk(tuple(minComposition), tuple(maxComposition), tuple(elementMasses), float(loMass), float(hiMass), int(chunk), cursor, constraints, carbon)
+        
+        # check all rules precisely
+        if rules:
+            comps = [c for c in comps if _checkrules(symbols, valences, c, rules, HC, NOPSC, RDBE)]
+        
+        if comps or cursor == None:
+            yield _formulae(elements, comps), cursor
+        
+        if cursor == None:
+            return
+# ----
+
+
+def batchformulator(peaks, charge=0, tolerance=1., units='ppm', composition={}, agentFormula='H', agentCharge=1, limit=1000, rules=[], HC=(0.1, 3.0), NOPSC=(4,3,2,3), RDBE=(-1,40), processes=None):
+    """Generate formulae for multiple m/z values sharing the same composition limits.
+        Decomposition table is built once for all values. Formulae for each
+        value are the same as calculated by mspy.formulator.
+        peaks (list of float or mspy.peak) - searched m/z values
+        charge (int) - current charge, used for peaks without charge
+        tolerance (float) - mass tolerance
+        units (ppm or Da) - mass tolerance units
+        composition (dict of 'element':[min count, max count]) - composition limits
+        agentFormula (str) - charging agent formula
+        agentCharge (int) - charging agent unit charge
+        limit (int) - maximum formulae allowed to be calculated for each value
+        rules (list of str) - formula rules to be checked (see mspy.frules)
+        HC (tuple) - H/C limits
+        NOPSC (tuple) - NOPS/C max values
+        RDBE (tuple) - RDBE limits
+        processes (int or None) - number of worker processes for large batches
+    """
+    
+    # get mass ranges
+    windows = []
+    for peak in peaks:
+        
+        # get peak m/z and charge
+        mz = peak
+        peakCharge = charge
+        if not isinstance(peak, (int, float)):
+            mz = peak.mz
+            if peak.charge != None:
+                peakCharge = peak.charge
+        
+        windows.append(_window(mz, peakCharge, tolerance, units, agentFormula, agentCharge))
+    
+    # check mass ranges
+    maxMass = max([w[1] for w in windows if w] or [0])
+    if not maxMass:
+        return [[] for w in windows]
+    
+    # make decomposition table
+    table = decompositiontable(composition, maxMass)
+    params = (limit, rules, HC, NOPSC, RDBE)
+    
+    # calculate formulae in current process
+    if not processes or processes < 2 or len(windows) <= processes:
+        return _batchformulae(table, windows, params)
+    
+    # split windows into chunks
+    chunks = []
+    size = max(1, int(math.ceil(len(windows) / (processes*4.))))
+    for x in range(0, len(windows), size):
+        chunks.append(windows[x:x+size])
+    
+    # calculate formulae in worker processes
+    pool = multiprocessing.Pool(processes, _batchInit, (table, params))
+    try:
+        results = pool.map_async(_batchWorker, chunks)
+        while not results.ready():
+            results.wait(0.1)
+            CHECK_FORCE_QUIT()
+        results = results.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    
+    # join chunks
+    buff = []
+    for chunk in results:
+        buff += chunk
+    
+    return buff
+# ----
+
+
+class decompositiontable:
+    """Precomputed decompositions of neutral masses into elemental compositions.
+        Elements are split into leading and trailing group and all compositions
+        of each group are generated once. Compositions for any mass range are
+        then found by binary search within sorted masses of the trailing group.
+        composition (dict of 'element':[min count, max count]) - composition limits
+        maxMass (float) - maximum neutral mass to be decomposed
+    """
+    
+    def __init__(self, composition, maxMass):
+        
+        self.maxMass = maxMass
+        
+        # get elements
+        self.elements, self.minComposition, self.maxComposition, self.elementMasses = _elements(composition, maxMass)
+        
+        # split elements into groups of similar size
+        sizes = [max(1, self.maxComposition[i] - self.minComposition[i] + 1) for i in range(len(self.elements))]
+        split = 0
+        best = None
+        for x in range(len(sizes)+1):
+            size = max(numpy.prod(sizes[:x]), numpy.prod(sizes[x:]))
+            if best == None or size < best:
+                best = size
+                split = x
+        
+        # generate compositions of leading group in formulator order
+        restMass = sum([self.minComposition[i]*self.elementMasses[i] for i in range(len(self.elements))])
+        self._headCounts, self._headMasses, restMass = self._generate(range(split), restMass)
+        
+        # generate compositions of trailing group sorted by mass
+        counts, masses, restMass = self._generate(range(split, len(self.elements)), restMass)
+        order = numpy.argsort(masses, kind='mergesort')
+        self._tailCounts = counts[order]
+        self._tailMasses = masses[order]
+    # ----
+    
+    
+    def __len__(self):
+        """Get number of stored group compositions."""
+        return len(self._headMasses) + len(self._tailMasses)
+    # ----
+    
+    
+    def decompose(self, loMass, hiMass, limit=None, block=4096):
+        """Get all compositions within given neutral mass range.
+            Compositions are returned as numpy array in the same order as
+            generated by mspy.formulator.
+            loMass (float) - low mass limit
+            hiMass (float) - high mass limit
+            limit (int or None) - maximum compositions to be returned
+            block (int) - number of leading compositions searched at once
+        """
+        
+        # check mass range
+        if hiMass > self.maxMass:
+            raise ValueError, 'Mass range is not covered by decomposition table!'
+        
+        epsilon = 1e-6
+        tails = self._tailMasses
+        
+        # search leading compositions by blocks
+        buff = []
+        found = 0
+        for start in range(0, len(self._headMasses), block):
+            
+            CHECK_FORCE_QUIT()
+            
+            # find matching trailing compositions for each leading composition
+            heads = self._headMasses[start:start+block]
+            lo = numpy.searchsorted(tails, loMass - heads - epsilon, side='left')
+            hi = numpy.searchsorted(tails, hiMass - heads + epsilon, side='right')
+            counts = hi - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            
+            # make compositions
+            headIdx = numpy.repeat(numpy.arange(start, start+len(heads)), counts)
+            offsets = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+            tailIdx = numpy.arange(total) - offsets + numpy.repeat(lo, counts)
+            comps = numpy.hstack((self._headCounts[headIdx], self._tailCounts[tailIdx]))
+            
+            # check exact masses as summed by formulator
+            masses = numpy.zeros(total, dtype=numpy.float64)
+            for i, elMass in enumerate(self.elementMasses):
+                masses += comps[:,i] * elMass
+            comps = comps[(masses >= loMass) & (masses <= hiMass)]
+            
+            # sort compositions
+            order = numpy.lexsort(comps.T[::-1])
+            buff.append(comps[order])
+            found += len(comps)
+            
+            # check limit
+            if limit != None and found >= limit:
+                break
+        
+        # join blocks
+        if not buff:
+            return numpy.zeros((0, len(self.elements)), dtype=numpy.int64)
+        comps = numpy.vstack(buff)
+        
+        # apply limit
+        if limit != None:
+            comps = comps[:limit]
+        
+        return comps
+    # ----
+    
+    
+    def formulae(self, loMass, hiMass, limit=None, rules=[], HC=(0.1, 3.0), NOPSC=(4,3,2,3), RDBE=(-1,40)):
+        """Get formulae within given neutral mass range.
+            loMass (float) - low mass limit
+            hiMass (float) - high mass limit
+            limit (int or None) - maximum formulae to be returned
+            rules (list of str) - formula rules to be checked (see mspy.frules)
+            HC (tuple) - H/C limits
+            NOPSC (tuple) - NOPS/C max values
+            RDBE (tuple) - RDBE limits
+        """
+        
+        # get compositions
+        if not rules:
+            comps = self.decompose(loMass, hiMass, limit)
+            return _formulae(self.elements, comps.tolist())
+        
+        # get compositions passing rules
+        symbols, valences = _valences(self.elements)
+        comps = []
+        for comp in self.decompose(loMass, hiMass).tolist():
+            if _checkrules(symbols, valences, comp, rules, HC, NOPSC, RDBE):
+                comps.append(comp)
+                if limit != None and len(comps) >= limit:
+                    break
+        
+        return _formulae(self.elements, comps)
+    # ----
+    
+    
+    def _generate(self, indices, restMass):
+        """Generate all compositions of given elements up to max mass."""
+        
+        counts = numpy.zeros((1, 0), dtype=numpy.int64)
+        masses = numpy.zeros(1, dtype=numpy.float64)
+        
+        # add elements one by one
+        for i in indices:
+            
+            CHECK_FORCE_QUIT()
+            
+            elMass = self.elementMasses[i]
+            restMass -= self.minComposition[i] * elMass
+            
+            # add all counts of current element
+            n = numpy.arange(self.minComposition[i], self.maxComposition[i]+1, dtype=numpy.int64)
+            masses = (masses[:,numpy.newaxis] + n*elMass).ravel()
+            counts = numpy.hstack((numpy.repeat(counts, len(n), axis=0), numpy.tile(n, len(counts))[:,numpy.newaxis]))
+            
+            # remove compositions exceeding max mass
+            keep = masses + restMass <= self.maxMass + 1e-6
+            masses = masses[keep]
+            counts = counts[keep]
+        
+        return counts, masses, restMass
+    # ----
+    
+
+
+def _window(mz, charge, tolerance, units, agentFormula, agentCharge):
+    """Get neutral mass range for given search."""
+    
     # get neutral mass
     if charge != 0 and agentFormula:
         mass = mod_basics.mz(mz, 0, currentCharge=charge, agentFormula=agentFormula, agentCharge=agentCharge)
@@ -49,7 +384,7 @@ def formulator(mz, charge=0, tolerance=1., units='ppm', composition={}, agentFor
     
     # check neutral mass
     if mass <= 0:
-        return []
+        return None
     
     # get mass limits
     if units == 'ppm':
@@ -62,6 +397,13 @@ def formulator(mz, charge=0, tolerance=1., units='ppm', composition={}, agentFor
         loMass = mass - tolerance
         hiMass = mass + tolerance
     
+    return loMass, hiMass
+# ----
+
+
+def _elements(composition, hiMass):
+    """Get elements sorted by mass together with count limits and masses."""
+    
     # sort elements by masses to speed up processing
     buff = []
     for el in composition:
@@ -84,9 +426,94 @@ def formulator(mz, charge=0, tolerance=1., units='ppm', composition={}, agentFor
     for i in range(len(maxComposition)):
         maxComposition[i] = min(maxComposition[i], int(hiMass/elementMasses[i]))
     
-    # generate compositions
+    return elements, minComposition, maxComposition, elementMasses
+# ----
+
+
+def _params(mz, charge, tolerance, units, composition, agentFormula, agentCharge):
+    """Get elements, composition limits and mass range for given search."""
+    
+    # get mass limits
+    window = _window(mz, charge, tolerance, units, agentFormula, agentCharge)
+    if not window:
+        return None
+    loMass, hiMass = window
+    
+    # get elements
+    elements, minComposition, maxComposition, elementMasses = _elements(composition, hiMass)
+    
+    return elements, minComposition, maxComposition, elementMasses, loMass, hiMass
+# ----
+
+
+def _valences(elements):
+    """Get element symbols and valences."""
+    
+    symbols = []
+    valences = []
+    for el in elements:
+        symbol = mod_basics.ELEMENT_PATTERN.match(el).group(1)
+        symbols.append(symbol)
+        valences.append(blocks.elements[symbol].valence or 0)
+    
+    return symbols, valences
+# ----
+
+
+def _constraints(symbols, valences, rules, HC, NOPSC, RDBE):
+    """Get linear form of formula rules as (coefficients, min, max, carbon needed) and carbon positions."""
+    
+    # make coefficients
+    def coefs(weights):
+        return tuple([float(weights.get(x, 0.)) for x in symbols])
+    
+    carbon = coefs({'C':1})
+    constraints = []
+    inf = float('inf')
+    
+    # H/C ratio
+    if 'HC' in rules:
+        constraints.append((coefs({'H':1, 'C':-HC[0]}), 0., inf, 1))
+        constraints.append((coefs({'H':1, 'C':-HC[1]}), -inf, 0., 1))
+    
+    # NOPS/C ratios
+    if 'NOPSC' in rules:
+        for x, el in enumerate(('N', 'O', 'P', 'S')):
+            constraints.append((coefs({el:1, 'C':-NOPSC[x]}), -inf, 0., 1))
+    
+    # RDBE range
+    if 'RDBE' in rules:
+        weights = {}
+        for x, symbol in enumerate(symbols):
+            if valences[x]:
+                weights[symbol] = (valences[x] - 2) / 2.
+        constraints.append((coefs(weights), RDBE[0]-1., RDBE[1]-1., 0))
+    
+    return tuple(constraints), carbon
+# ----
+
+
+def _checkrules(symbols, valences, comp, rules, HC, NOPSC, RDBE):
+    """Check formula rules for given composition."""
+    
+    # count atoms and RDBE
+    counts = {'C':0, 'H':0, 'N':0, 'O':0, 'P':0, 'S':0}
+    rdbeValue = 0
+    for x, count in enumerate(comp):
+        if symbols[x] in counts:
+            counts[symbols[x]] += count
+        if valences[x]:
+            rdbeValue += (valences[x] - 2) * count
+    rdbeValue = rdbeValue / 2. + 1.
+    
+    return mod_basics._frules(float(counts['C']), float(counts['H']), float(counts['N']), float(counts['O']), float(counts['P']), float(counts['S']), rdbeValue, rules, HC, NOPSC, RDBE)
+# ----
+
+
+def _formulae(elements, comps):
+    """Make formulae from compositions."""
+    
     formulae = []
-    comps = _compositions(minComposition, maxComposition, elementMasses, loMass, hiMass, limit)
     for comp in comps:
         
         CHECK_FORCE_QUIT()
@@ -119,3 +546,42 @@ def _compositions(minimum, maximum, masses, loMass, hiMass, limit):
     return calculations.formula_composition(tuple(minimum), tuple(maximum), tuple(masses), float(loMass), float(hiMass), int(limit))
 # ----
 
+
+def _batchformulae(table, windows, params):
+    """Get formulae for mass ranges using decomposition table."""
+    
+    limit, rules, HC, NOPSC, RDBE = params
+    
+    buff = []
+    for window in windows:
+        
+        CHECK_FORCE_QUIT()
+        
+        if window:
+            buff.append(table.formulae(window[0], window[1], limit, rules, HC, NOPSC, RDBE))
+        else:
+            buff.append([])
+    
+    return buff
+# ----
+
+
+# decomposition table and params within worker process
+_batchTable = None
+_batchParams = None
+
+
+def _batchInit(table, params):
+    """Set decomposition table within worker process."""
+    
+    global _batchTable, _batchParams
+    _batchTable = table
+    _batchParams = params
+# ----
+
+
+def _batchWorker(windows):
+    """Get formulae for chunk of mass ranges within worker process."""
+    return _batchformulae(_batchTable, windows, _batchParams)
+# ----
+
@@ -16,7 +16,13 @@
 # -------------------------------------------------------------------------
 
 # load libs
+import sys
+import os
 import math
+import hashlib
+import threading
+import collections
+import multiprocessing
 import numpy
 
 # load stopper
@@ -36,10 +42,306 @@ import mod_signal
 import mod_peakpicking
 
 
+# elements order used to share partial patterns
+ATOM_ORDER = ('C', 'H', 'N', 'O', 'S', 'P')
+
+
+# PATTERN CACHE
+# -------------
+
+class patterncache:
+    """Bounded LRU cache of calculated isotopic patterns.
+        maxSize (int) - approximate memory limit in bytes
+    """
+    
+    def __init__(self, maxSize=32*1024*1024):
+        
+        self.maxSize = maxSize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        
+        self._patterns = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._peakSize = sys.getsizeof([0., 0.]) + 2*sys.getsizeof(0.)
+    # ----
+    
+    
+    def __len__(self):
+        """Get number of stored patterns."""
+        return len(self._patterns)
+    # ----
+    
+    
+    def __repr__(self):
+        return 'patterncache(patterns=%d, size=%d, hits=%d, misses=%d)' % (len(self), self.size, self.hits, self.misses)
+    # ----
+    
+    
+    def get(self, key):
+        """Get copy of stored pattern or None if not available."""
+        
+        with self._lock:
+            
+            # pattern not stored
+            if not key in self._patterns:
+                self.misses += 1
+                return None
+            
+            # move pattern to the end of queue
+            item = self._patterns.pop(key)
+            self._patterns[key] = item
+            self.hits += 1
+        
+        return [list(p) for p in item[0]]
+    # ----
+    
+    
+    def store(self, key, pattern):
+        """Store copy of pattern and remove least recently used if full."""
+        
+        # get item size
+        size = sys.getsizeof(pattern) + len(pattern)*self._peakSize
+        if size > self.maxSize:
+            return
+        
+        with self._lock:
+            
+            # remove previous item
+            if key in self._patterns:
+                self.size -= self._patterns.pop(key)[1]
+            
+            # store pattern
+            self._patterns[key] = ([list(p) for p in pattern], size)
+            self.size += size
+            
+            # remove least recently used patterns
+            self._shrink()
+    # ----
+    
+    
+    def clear(self):
+        """Remove all stored patterns and reset counters."""
+        
+        with self._lock:
+            self._patterns.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+    # ----
+    
+    
+    def setsize(self, maxSize):
+        """Set memory limit in bytes."""
+        
+        with self._lock:
+            self.maxSize = maxSize
+            self._shrink()
+    # ----
+    
+    
+    def _shrink(self):
+        """Remove least recently used patterns to fit memory limit."""
+        
+        while self._patterns and self.size > self.maxSize:
+            key, item = self._patterns.popitem(last=False)
+            self.size -= item[1]
+    # ----
+    
+
+
+# init pattern cache
+PATTERN_CACHE = patterncache()
+
+
+
+# ELEMENT TABLES
+# --------------
+
+class elementtables:
+    """Precomputed isotopic patterns of elements at power-of-two atom counts.
+        threshold (float) - internal relative abundance threshold of stored patterns
+        window (float) - grouping window of stored patterns
+    """
+    
+    version = 1
+    
+    def __init__(self, threshold=1e-9, window=1e-4):
+        
+        self.threshold = threshold
+        self.window = window
+        self.path = None
+        
+        self._tables = {} # symbol: [signature, [pattern of 1, 2, 4... atoms]]
+        self._changed = False
+        self._lock = threading.Lock()
+    # ----
+    
+    
+    def pattern(self, atom, count, threshold, window):
+        """Get normalized pattern for given number of atoms.
+            atom (str) - atom symbol with optional isotope mass number
+            count (int) - number of atoms
+            threshold (float) - internal relative abundance threshold
+            window (float) - grouping window
+        """
+        
+        # calculate directly for specified isotopes or finer params than stored
+        if not atom in blocks.elements or threshold < self.threshold or window < self.window:
+            return _power(_normalize(_atomPattern(atom)), count, threshold, window)
+        
+        # get stored powers
+        powers = self._powers(atom, count.bit_length())
+        
+        # combine powers
+        finalPattern = []
+        for x, power in enumerate(powers):
+            if count >> x & 1:
+                
+                CHECK_FORCE_QUIT()
+                
+                # group stored pattern within current window
+                power = power[power[:,1] >= threshold]
+                power = _normalize(_consolidate(power, window))
+                
+                finalPattern = _convolve(finalPattern, power, threshold, window)
+        
+        return finalPattern
+    # ----
+    
+    
+    def clear(self):
+        """Remove all stored patterns."""
+        
+        with self._lock:
+            self._tables = {}
+            self._changed = True
+    # ----
+    
+    
+    def load(self, path):
+        """Load stored patterns from cache files (memory-mapped).
+            path (str) - cache files path without extension
+        """
+        
+        self.path = path
+        
+        # read index
+        try:
+            indexFile = file(path+'.idx', 'r')
+            index = indexFile.read().splitlines()
+            indexFile.close()
+        except IOError:
+            return False
+        
+        # check version and params
+        header = index[0].split()
+        if header != ['mspy-elementtables', str(self.version), repr(self.threshold), repr(self.window)]:
+            return False
+        
+        # read data
+        try:
+            data = numpy.load(path+'.npy', mmap_mode='r')
+        except (IOError, ValueError):
+            return False
+        
+        # make tables
+        tables = {}
+        for line in index[1:]:
+            symbol, signature, start, stop = line.split()
+            if not symbol in tables:
+                tables[symbol] = [signature, []]
+            tables[symbol][1].append(data[int(start):int(stop)])
+        
+        with self._lock:
+            self._tables = tables
+            self._changed = False
+        
+        return True
+    # ----
+    
+    
+    def save(self, path=None):
+        """Save stored patterns into cache files.
+            path (str) - cache files path without extension
+        """
+        
+        # get path
+        if path == None:
+            path = self.path
+        if path == None or (not self._changed and os.path.exists(path+'.npy')):
+            return False
+        
+        with self._lock:
+            
+            # make index and release memory-mapped data
+            index = ['mspy-elementtables %d %r %r' % (self.version, self.threshold, self.window)]
+            data = []
+            start = 0
+            for symbol in sorted(self._tables):
+                signature, powers = self._tables[symbol]
+                for x in range(len(powers)):
+                    powers[x] = numpy.array(powers[x])
+                    data.append(powers[x])
+                    index.append('%s %s %d %d' % (symbol, signature, start, start+len(powers[x])))
+                    start += len(powers[x])
+            
+            if data:
+                data = numpy.concatenate(data)
+            else:
+                data = numpy.zeros((0, 2))
+            
+            # save data
+            try:
+                dataFile = file(path+'.npy', 'wb')
+                numpy.save(dataFile, data)
+                dataFile.close()
+                indexFile = file(path+'.idx', 'w')
+                indexFile.write('\n'.join(index))
+                indexFile.close()
+            except IOError:
+                return False
+            
+            self._changed = False
+        
+        return True
+    # ----
+    
+    
+    def _powers(self, atom, count):
+        """Get stored patterns for first powers of two, calculate missing."""
+        
+        with self._lock:
+            
+            # check current isotopes
+            signature = hashlib.md5(repr(sorted(blocks.elements[atom].isotopes.items()))).hexdigest()
+            if not atom in self._tables or self._tables[atom][0] != signature:
+                atomPattern = numpy.array(_normalize(_atomPattern(atom)))
+                self._tables[atom] = [signature, [atomPattern]]
+                self._changed = True
+            
+            # calculate missing powers
+            powers = self._tables[atom][1]
+            while len(powers) < count:
+                CHECK_FORCE_QUIT()
+                power = _convolve(powers[-1], powers[-1], self.threshold, self.window)
+                powers.append(numpy.array(power))
+                self._changed = True
+            
+            return powers[:count]
+    # ----
+    
+
+
+# init element tables
+ELEMENT_TABLES = elementtables()
+
+
+
 # ISOTOPIC PATTERN FUNCTIONS
 # --------------------------
 
-def pattern(compound, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True, model='gaussian'):
+def pattern(compound, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True, model='gaussian', method='classic'):
     """Calculate isotopic pattern for given compound.
         compound (str or mspy.compound) - compound
         fwhm (float) - gaussian peak width
@@ -49,107 +351,88 @@ def pattern(compound, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agen
         agentCharge (int) - charging agent unit charge
         real (bool) - get real peaks from calculated profile
         model (gaussian, lorentzian, gausslorentzian) - peak shape function
+        method (classic or convolution) - pattern calculation method, convolution is much faster for large compounds but approximate
     """
     
-    # check compound
-    if not isinstance(compound, obj_compound.compound):
-        compound = obj_compound.compound(compound)
+    return _pattern(compound, fwhm, threshold, charge, agentFormula, agentCharge, real, model, method, None)
+# ----
+
+
+def patterns(compounds, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True, model='gaussian', method='classic', processes=None):
+    """Calculate isotopic patterns for list of compounds.
+        compounds (list of str or mspy.compound) - compounds
+        fwhm (float) - gaussian peak width
+        threshold (float) - relative intensity threshold for isotopes (in %/100)
+        charge (int) - charge to be calculated
+        agentFormula (str or mspy.compound) - charging agent formula
+        agentCharge (int) - charging agent unit charge
+        real (bool) - get real peaks from calculated profile
+        model (gaussian, lorentzian, gausslorentzian) - peak shape function
+        method (classic or convolution) - pattern calculation method, convolution is much faster for large compounds but approximate
+        processes (int or None) - number of worker processes for large batches
+    """
     
     # check agent formula
     if agentFormula != 'e' and not isinstance(agentFormula, obj_compound.compound):
         agentFormula = obj_compound.compound(agentFormula)
     
-    # add charging agent to compound
-    if charge and agentFormula != 'e':
-        formula = compound.formula()
-        for atom, count in agentFormula.composition().items():
-            formula += '%s%d' % (atom, count*(charge/agentCharge))
-        compound = obj_compound.compound(formula)
+    # calculate patterns in current process sharing element and partial patterns
+    if not processes or processes < 2 or len(compounds) <= processes:
+        memo = {}
+        buff = []
+        for compound in compounds:
+            buff.append(_pattern(compound, fwhm, threshold, charge, agentFormula, agentCharge, real, model, method, memo))
+        return buff
     
-    # get composition and check for negative atom counts
-    composition = compound.composition()
-    for atom in composition:
-        if composition[atom] < 0:
-            raise ValueError, 'Pattern cannot be calculated for this formula! --> ' + compound.formula()
+    # get cached patterns
+    buff = []
+    missing = []
+    for x, compound in enumerate(compounds):
+        if not isinstance(compound, obj_compound.compound):
+            compound = obj_compound.compound(compound)
+        key = _patternKey(compound, fwhm, threshold, charge, agentFormula, agentCharge, real, model, method)
+        buff.append(PATTERN_CACHE.get(key))
+        if buff[-1] == None:
+            missing.append((x, key, compound.formula()))
     
-    # set internal thresholds
-    internalThreshold = threshold/100.
-    groupingWindow = fwhm/4.
+    if not missing:
+        return buff
     
-    # calculate pattern
-    finalPattern = []
-    for atom in composition:
-        
-        # get isotopic profile for current atom or specified isotope only
-        atomCount = composition[atom]
-        atomPattern = []
-        match = mod_basics.ELEMENT_PATTERN.match(atom)
-        symbol, massNumber, tmp = match.groups()
-        if massNumber:
-            isotope = blocks.elements[symbol].isotopes[int(massNumber)]
-            atomPattern.append([isotope[0], 1.]) # [mass, abundance]
-        else:
-            for massNumber, isotope in blocks.elements[atom].isotopes.items():
-                if isotope[1] > 0.:
-                    atomPattern.append(list(isotope)) # [mass, abundance]
-        
-        # add atoms
-        for i in range(atomCount):
-            
-            CHECK_FORCE_QUIT()
-            
-            # if pattern is empty (first atom) add current atom pattern
-            if len(finalPattern) == 0:
-                finalPattern = _normalize(atomPattern)
-                continue
-            
-            # add atom to each peak of final pattern
-            currentPattern = []
-            for patternIsotope in finalPattern:
-                
-                # skip peak under relevant abundance threshold
-                if patternIsotope[1] < internalThreshold:
-                    continue
-                
-                # add each isotope of current atom to peak
-                for atomIsotope in atomPattern:
-                    mass = patternIsotope[0] + atomIsotope[0]
-                    abundance = patternIsotope[1] * atomIsotope[1]
-                    currentPattern.append([mass, abundance])
-            
-            # group isotopes and normalize pattern
-            finalPattern = _consolidate(currentPattern, groupingWindow)
-            finalPattern = _normalize(finalPattern)
+    # split missing compounds into continuous chunks to keep related formulae together
+    agent = agentFormula
+    if agentFormula != 'e':
+        agent = agentFormula.formula()
+    params = (fwhm, threshold, charge, agent, agentCharge, real, model, method)
     
-    # correct charge
-    if charge:
-        for i in range(len(finalPattern)):
-            finalPattern[i][0] = (finalPattern[i][0] - mod_basics.ELECTRON_MASS*charge) / abs(charge)
+    chunks = []
+    size = max(1, int(math.ceil(len(missing) / (processes*4.))))
+    for x in range(0, len(missing), size):
+        formulae = [item[2] for item in missing[x:x+size]]
+        chunks.append((formulae, params))
     
-    # group isotopes
-    finalPattern = _consolidate(finalPattern, groupingWindow)
-    
-    # get real peaks from profile
-    if real:
-        prof = profile(finalPattern, fwhm=fwhm, points=100, model=model)
-        finalPattern = []
-        for isotope in mod_signal.maxima(prof):
-            finalPattern.append(isotope)
-            centroid = mod_signal.centroid(prof, isotope[0], isotope[1]*0.99)
-            if abs(centroid-isotope[0]) < fwhm/100.:
-                finalPattern[-1][0] = centroid
-    
-    # normalize pattern
-    finalPattern = _normalize(finalPattern)
+    # calculate patterns in worker processes
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map_async(_patternsWorker, chunks)
+        while not results.ready():
+            results.wait(0.1)
+            CHECK_FORCE_QUIT()
+        results = results.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
     
-    # discard peaks below threshold
-    filteredPeaks = []
-    for peak in finalPattern:
-        if peak[1] >= threshold:
-            filteredPeaks.append(list(peak))
-    finalPattern = filteredPeaks
+    # store patterns
+    x = 0
+    for chunk in results:
+        for item in chunk:
+            i, key, formula = missing[x]
+            PATTERN_CACHE.store(key, item)
+            buff[i] = item
+            x += 1
     
-    return finalPattern
+    return buff
 # ----
 
 
@@ -195,7 +478,7 @@ def gausslorentzian(x, minY, maxY, fwhm=0.1, points=500):
 # ----
 
 
-def profile(peaklist, fwhm=0.1, points=10, noise=0, raster=None, forceFwhm=False, model='gaussian'):
+def profile(peaklist, fwhm=0.1, points=10, noise=0, raster=None, forceFwhm=False, model='gaussian', threads=1):
     """Make profile spectrum for given peaklist.
         peaklist (mspy.peaklist) - peaklist
         fwhm (float) - default peak fwhm
@@ -204,6 +487,7 @@ def profile(peaklist, fwhm=0.1, points=10, noise=0, raster=None, forceFwhm=False
         raster (1D numpy.array) - m/z raster
         forceFwhm (bool) - use default fwhm for all peaks
         model (gaussian, lorentzian, gausslorentzian) - peak shape function
+        threads (int) - number of threads used to model raster chunks
     """
     
     # check peaklist type
@@ -232,9 +516,9 @@ def profile(peaklist, fwhm=0.1, points=10, noise=0, raster=None, forceFwhm=False
     
     # make profile
     if raster != None:
-        data = calculations.signal_profile_to_raster(numpy.array(peaks), raster, float(noise), shape)
+        data = calculations.signal_profile_to_raster(numpy.array(peaks), raster, float(noise), shape, int(threads))
     else:
-        data = calculations.signal_profile(numpy.array(peaks), int(points), float(noise), shape)
+        data = calculations.signal_profile(numpy.array(peaks), int(points), float(noise), shape, int(threads))
     
     # make baseline
     baseline = []
@@ -301,6 +585,366 @@ def matchpattern(signal, pattern, pickingHeight=0.75, baseline=None):
 # ----
 
 
+def matchpatterns(signal, compounds, charge=0, agentFormula='H', agentCharge=1, pickingHeight=0.75, baseline=None, shifts=None, processes=None):
+    """Compare signal with isotopic patterns of multiple compounds.
+        Pattern peak width is taken from signal peak at compound m/z. Results
+        are returned in the same order as given compounds.
+        signal (numpy array) - signal data points
+        compounds (list of str or mspy.compound) - compounds to compare
+        charge (int) - charge to be calculated
+        agentFormula (str) - charging agent formula
+        agentCharge (int) - charging agent unit charge
+        pickingHeight (float) - centroiding height
+        baseline (numpy array) - signal baseline
+        shifts (list of float or None) - m/z shift of each pattern
+        processes (int or None) - number of worker processes for large batches
+    """
+    
+    # check signal type
+    if not isinstance(signal, numpy.ndarray):
+        raise TypeError, "Signal must be NumPy array!"
+    
+    # check baseline type
+    if baseline is not None and not isinstance(baseline, numpy.ndarray):
+        raise TypeError, "Baseline must be NumPy array!"
+    
+    # check shifts
+    if shifts == None:
+        shifts = [0.0]*len(compounds)
+    elif len(shifts) != len(compounds):
+        raise ValueError, "Number of shifts doesn't match number of compounds!"
+    
+    # get formulae to be sent to workers
+    items = []
+    for x, compound in enumerate(compounds):
+        if isinstance(compound, obj_compound.compound):
+            compound = compound.formula()
+        items.append((compound, shifts[x]))
+    
+    params = (charge, agentFormula, agentCharge, pickingHeight)
+    
+    # compare patterns in current process
+    if not processes or processes < 2 or len(items) <= processes:
+        return _matchpatterns(signal, baseline, items, params)
+    
+    # split items into chunks
+    chunks = []
+    size = max(1, int(math.ceil(len(items) / (processes*4.))))
+    for x in range(0, len(items), size):
+        chunks.append(items[x:x+size])
+    
+    # compare patterns in worker processes
+    buff = []
+    pool = multiprocessing.Pool(processes, _matchpatternsInit, (signal, baseline, params))
+    try:
+        results = pool.imap(_matchpatternsWorker, chunks)
+        while len(buff) < len(items):
+            try:
+                buff += results.next(0.1)
+            except multiprocessing.TimeoutError:
+                pass
+            CHECK_FORCE_QUIT()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    
+    return buff
+# ----
+
+
+def _pattern(compound, fwhm, threshold, charge, agentFormula, agentCharge, real, model, method, memo):
+    """Calculate isotopic pattern for given compound.
+        memo (dict or None) - storage of element and partial patterns shared by batch
+    """
+    
+    # check compound
+    if not isinstance(compound, obj_compound.compound):
+        compound = obj_compound.compound(compound)
+    
+    # check agent formula
+    if agentFormula != 'e' and not isinstance(agentFormula, obj_compound.compound):
+        agentFormula = obj_compound.compound(agentFormula)
+    
+    # check cache
+    key = _patternKey(compound, fwhm, threshold, charge, agentFormula, agentCharge, real, model, method)
+    cached = PATTERN_CACHE.get(key)
+    if cached != None:
+        return cached
+    
+    # add charging agent to compound
+    if charge and agentFormula != 'e':
+        formula = compound.formula()
+        for atom, count in agentFormula.composition().items():
+            formula += '%s%d' % (atom, count*(charge/agentCharge))
+        compound = obj_compound.compound(formula)
+    
+    # get composition and check for negative atom counts
+    composition = compound.composition()
+    for atom in composition:
+        if composition[atom] < 0:
+            raise ValueError, 'Pattern cannot be calculated for this formula! --> ' + compound.formula()
+    
+    # set internal thresholds
+    internalThreshold = threshold/100.
+    groupingWindow = fwhm/4.
+    
+    # calculate pattern
+    if method == 'convolution':
+        finalPattern = _convolutionPattern(composition, internalThreshold, groupingWindow, memo)
+    elif method == 'classic':
+        finalPattern = _classicPattern(composition, internalThreshold, groupingWindow)
+    else:
+        raise ValueError, 'Unknown pattern calculation method! --> ' + method
+    
+    # correct charge
+    if charge:
+        for i in range(len(finalPattern)):
+            finalPattern[i][0] = (finalPattern[i][0] - mod_basics.ELECTRON_MASS*charge) / abs(charge)
+    
+    # group isotopes
+    finalPattern = _consolidate(finalPattern, groupingWindow)
+    
+    # get real peaks from profile
+    if real:
+        prof = profile(finalPattern, fwhm=fwhm, points=100, model=model)
+        finalPattern = []
+        for isotope in mod_signal.maxima(prof):
+            finalPattern.append(isotope)
+            centroid = mod_signal.centroid(prof, isotope[0], isotope[1]*0.99)
+            if abs(centroid-isotope[0]) < fwhm/100.:
+                finalPattern[-1][0] = centroid
+    
+    # normalize pattern
+    finalPattern = _normalize(finalPattern)
+    
+    # discard peaks below threshold
+    filteredPeaks = []
+    for peak in finalPattern:
+        if peak[1] >= threshold:
+            filteredPeaks.append(list(peak))
+    finalPattern = filteredPeaks
+    
+    # store pattern in cache
+    PATTERN_CACHE.store(key, finalPattern)
+    
+    return finalPattern
+# ----
+
+
+def _patternKey(compound, fwhm, threshold, charge, agentFormula, agentCharge, real, model, method):
+    """Make pattern cache key for given compound and params."""
+    
+    agent = agentFormula
+    if agentFormula != 'e':
+        agent = agentFormula.formula()
+    
+    return (blocks.elements.revision, tuple(sorted(compound.composition().items())), fwhm, threshold, charge, agent, agentCharge, model, real, method)
+# ----
+
+
+def _patternsWorker(args):
+    """Calculate patterns for chunk of formulae within worker process."""
+    
+    formulae, params = args
+    fwhm, threshold, charge, agentFormula, agentCharge, real, model, method = params
+    
+    if agentFormula != 'e':
+        agentFormula = obj_compound.compound(agentFormula)
+    
+    memo = {}
+    buff = []
+    for formula in formulae:
+        buff.append(_pattern(formula, fwhm, threshold, charge, agentFormula, agentCharge, real, model, method, memo))
+    
+    return buff
+# ----
+
+
+def _classicPattern(composition, threshold, window):
+    """Calculate isotopic pattern by adding atoms one by one.
+        composition (dict) - elemental composition
+        threshold (float) - internal relative abundance threshold
+        window (float) - grouping window
+    """
+    
+    finalPattern = []
+    for atom in composition:
+        
+        # get isotopic profile for current atom or specified isotope only
+        atomPattern = _atomPattern(atom)
+        
+        # add atoms
+        for i in range(composition[atom]):
+            
+            CHECK_FORCE_QUIT()
+            
+            # if pattern is empty (first atom) add current atom pattern
+            if len(finalPattern) == 0:
+                finalPattern = _normalize(atomPattern)
+                continue
+            
+            # add atom to each peak of final pattern
+            currentPattern = []
+            for patternIsotope in finalPattern:
+                
+                # skip peak under relevant abundance threshold
+                if patternIsotope[1] < threshold:
+                    continue
+                
+                # add each isotope of current atom to peak
+                for atomIsotope in atomPattern:
+                    mass = patternIsotope[0] + atomIsotope[0]
+                    abundance = patternIsotope[1] * atomIsotope[1]
+                    currentPattern.append([mass, abundance])
+            
+            # group isotopes and normalize pattern
+            finalPattern = _consolidate(currentPattern, window)
+            finalPattern = _normalize(finalPattern)
+    
+    return finalPattern
+# ----
+
+
+def _convolutionPattern(composition, threshold, window, memo=None):
+    """Calculate isotopic pattern by convolution of element patterns.
+        composition (dict) - elemental composition
+        threshold (float) - internal relative abundance threshold
+        window (float) - grouping window
+        memo (dict or None) - storage of element and partial patterns shared by batch
+    """
+    
+    # init storage
+    if memo == None:
+        memo = {}
+    if not memo:
+        memo['elements'] = {}
+        memo['partials'] = {}
+    
+    # sort elements to share partial patterns within related compositions
+    atoms = composition.keys()
+    atoms.sort(key=_atomOrder)
+    
+    finalPattern = []
+    partial = (threshold, window)
+    for atom in atoms:
+        
+        # use previously calculated partial pattern
+        partial += ((atom, composition[atom]),)
+        if partial in memo['partials']:
+            finalPattern = memo['partials'][partial]
+            continue
+        
+        # get pattern for all atoms of current element
+        element = (atom, composition[atom], threshold, window)
+        if element in memo['elements']:
+            elementPattern = memo['elements'][element]
+        else:
+            elementPattern = ELEMENT_TABLES.pattern(atom, composition[atom], threshold, window)
+            memo['elements'][element] = elementPattern
+        
+        # add element to final pattern
+        finalPattern = _convolve(finalPattern, elementPattern, threshold, window)
+        memo['partials'][partial] = finalPattern
+    
+    return [list(p) for p in finalPattern]
+# ----
+
+
+def _atomOrder(atom):
+    """Get sorting key of atom placing the most common elements first."""
+    
+    if atom in ATOM_ORDER:
+        return (ATOM_ORDER.index(atom), atom)
+    
+    return (len(ATOM_ORDER), atom)
+# ----
+
+
+def _atomPattern(atom):
+    """Get isotopic pattern of single atom or specified isotope.
+        atom (str) - atom symbol with optional isotope mass number
+    """
+    
+    atomPattern = []
+    
+    # get specified isotope only
+    match = mod_basics.ELEMENT_PATTERN.match(atom)
+    symbol, massNumber, tmp = match.groups()
+    if massNumber:
+        isotope = blocks.elements[symbol].isotopes[int(massNumber)]
+        atomPattern.append([isotope[0], 1.]) # [mass, abundance]
+    
+    # get all isotopes
+    else:
+        for massNumber, isotope in blocks.elements[atom].isotopes.items():
+            if isotope[1] > 0.:
+                atomPattern.append(list(isotope)) # [mass, abundance]
+    
+    return atomPattern
+# ----
+
+
+def _power(atomPattern, count, threshold, window):
+    """Calculate pattern of atoms count by repeated squaring.
+        atomPattern (list of [mass, abundance]) - single atom pattern
+        count (int) - number of atoms
+        threshold (float) - internal relative abundance threshold
+        window (float) - grouping window
+    """
+    
+    finalPattern = []
+    currentPattern = atomPattern
+    while count:
+        
+        CHECK_FORCE_QUIT()
+        
+        # add current power of two
+        if count & 1:
+            finalPattern = _convolve(finalPattern, currentPattern, threshold, window)
+        
+        # square current pattern
+        count >>= 1
+        if count:
+            currentPattern = _convolve(currentPattern, currentPattern, threshold, window)
+    
+    return finalPattern
+# ----
+
+
+def _convolve(patternA, patternB, threshold, window):
+    """Combine two normalized patterns, group isotopes and normalize result.
+        patternA (list of [mass, abundance]) - first pattern
+        patternB (list of [mass, abundance]) - second pattern
+        threshold (float) - internal relative abundance threshold
+        window (float) - grouping window
+    """
+    
+    # check patterns
+    if not len(patternA):
+        return [list(p) for p in patternB]
+    if not len(patternB):
+        return [list(p) for p in patternA]
+    
+    # skip peaks under relevant abundance threshold
+    patternA = numpy.asarray(patternA)
+    patternA = patternA[patternA[:,1] >= threshold]
+    patternB = numpy.asarray(patternB)
+    patternB = patternB[patternB[:,1] >= threshold]
+    
+    # combine each peak of first pattern with each peak of second pattern
+    masses = numpy.add.outer(patternA[:,0], patternB[:,0]).flatten()
+    abundances = numpy.multiply.outer(patternA[:,1], patternB[:,1]).flatten()
+    
+    # group isotopes and normalize pattern
+    finalPattern = numpy.column_stack((masses, abundances))
+    finalPattern = _consolidate(finalPattern, window)
+    finalPattern = _normalize(finalPattern)
+    
+    return finalPattern
+# ----
+
+
 def _consolidate(isotopes, window):
     """Group peaks within specified window.
         isotopes: (list of [mass, abundance]) isotopes list
@@ -349,3 +993,64 @@ def _normalize(data):
 # ----
 
 
+def _matchpatterns(signal, baseline, items, params):
+    """Compare signal with isotopic patterns of given formulae."""
+    
+    charge, agentFormula, agentCharge, pickingHeight = params
+    
+    # check agent formula
+    if agentFormula != 'e':
+        agentFormula = obj_compound.compound(agentFormula)
+    
+    memo = {}
+    buff = []
+    for formula, shift in items:
+        
+        CHECK_FORCE_QUIT()
+        
+        compound = obj_compound.compound(formula)
+        
+        # approximate fwhm
+        fwhm = 0.1
+        mz = compound.mz(charge, agentFormula, agentCharge)[0]
+        peak = mod_peakpicking.labelpeak(
+            signal = signal,
+            mz = mz+shift,
+            pickingHeight = pickingHeight,
+            baseline = baseline
+        )
+        if peak:
+            fwhm = peak.fwhm
+        
+        # make shifted pattern
+        pattern = _pattern(compound, fwhm, 0.01, charge, agentFormula, agentCharge, True, 'gaussian', 'classic', memo)
+        pattern = [[p[0]+shift, p[1]] for p in pattern]
+        
+        # match pattern to signal
+        buff.append(matchpattern(signal, pattern, pickingHeight, baseline))
+    
+    return buff
+# ----
+
+
+# signal and params within worker process
+_matchSignal = None
+_matchBaseline = None
+_matchParams = None
+
+
+def _matchpatternsInit(signal, baseline, params):
+    """Set signal and params within worker process."""
+    
+    global _matchSignal, _matchBaseline, _matchParams
+    _matchSignal = signal
+    _matchBaseline = baseline
+    _matchParams = params
+# ----
+
+
+def _matchpatternsWorker(items):
+    """Compare patterns for chunk of formulae within worker process."""
+    return _matchpatterns(_matchSignal, _matchBaseline, items, _matchParams)
+# ----
+
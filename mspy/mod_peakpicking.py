@@ -16,8 +16,11 @@
 # -------------------------------------------------------------------------
 
 # load libs
+import os
 import copy
 import math
+import hashlib
+import threading
 import numpy
 import time
 
@@ -470,13 +473,14 @@ def envmono(isotopes, charge, intensity='maximum'):
 # ----
 
 
-def deisotope(peaklist, maxCharge=1, mzTolerance=0.15, intTolerance=0.5, isotopeShift=0.0):
+def deisotope(peaklist, maxCharge=1, mzTolerance=0.15, intTolerance=0.5, isotopeShift=0.0, composition=AVERAGE_AMINO):
     """Isotopes determination and calculation of peaks charge.
         peaklist (mspy.peaklist) - peaklist to process
         maxCharge (float) - max charge to be searched
         mzTolerance (float) - absolute m/z tolerance for isotopes distance
         intTolerance (float) - relative intensity tolerance for isotopes and model (in %/100)
         isotopeShift (float) - isotope distance correction (neutral mass) (for HDX etc.)
+        composition (dict) - averagine building block composition
     """
     
     # check peaklist
@@ -488,6 +492,9 @@ def deisotope(peaklist, maxCharge=1, mzTolerance=0.15, intTolerance=0.5, isotope
         peak.setcharge(None)
         peak.setisotope(None)
     
+    # get averagine lookup table
+    averagineTable = AVERAGINE_TABLES.table(composition)
+    
     # get charges
     if maxCharge < 0:
         charges = [-x for x in range(1, abs(maxCharge)+1)]
@@ -525,8 +532,8 @@ def deisotope(peaklist, maxCharge=1, mzTolerance=0.15, intTolerance=0.5, isotope
                 continue
             
             # get theoretical isotopic pattern
-            mass = min(15000, int( mod_basics.mz( parent.mz, 0, z))) / 200
-            pattern = patternLookupTable[mass]
+            mass = mod_basics.mz(parent.mz, 0, z)
+            pattern = averagineTable.pattern(mass)
             
             # check minimal number of isotopes in the cluster
             limit = 0
@@ -661,99 +668,232 @@ def averagine(mz, charge=0, composition=AVERAGE_AMINO):
 # ----
 
 
-def _gentable(highmass, step=200, composition=AVERAGE_AMINO, table='tuple'):
-    """Print pattern lookup table."""
+# AVERAGINE TABLES
+# ----------------
+
+class averaginetable:
+    """Lookup table of averagine isotopic patterns for building block composition.
+        composition (dict) - building block composition
+        step (float) - mass step of calculated patterns
+        maxMass (float) - max neutral mass covered by table
+        threshold (float) - relative intensity threshold for isotopes (in %/100)
+    """
     
-    for mass in range(0, highmass, step):
-        formula = averagine(mass, charge=0, composition=composition)
+    version = 1
+    
+    def __init__(self, composition=AVERAGE_AMINO, step=50., maxMass=200000., threshold=0.001):
         
-        pattern = ''
-        for mz, abundance in formula.pattern(fwhm=0.1, threshold=0.001):
-            pattern += '%.3f, ' % abundance
+        self.composition = dict(composition)
+        self.step = float(step)
+        self.maxMass = float(maxMass)
+        self.threshold = threshold
+        self.changed = False
         
-        if table == 'tuple':
-            print '(%s), #%d' % (pattern[:-2], mass)
-        elif table == 'dict':
-            print '%d: (%s),' % (mass, pattern[:-2])
-# ----
+        # init arrays
+        count = int(math.ceil(self.maxMass / self.step)) + 1
+        self._offsets = numpy.zeros(count, dtype=numpy.int32)
+        self._rows = [None]*count
+        self._lock = threading.Lock()
+    # ----
+    
+    
+    def pattern(self, mass):
+        """Get interpolated relative abundances of isotopes for given neutral mass.
+            mass (float) - neutral mass
+        """
+        
+        # get neighbouring rows
+        position = min(max(0., mass), self.maxMass) / self.step
+        index = min(int(position), len(self._rows)-2)
+        fraction = position - index
+        
+        offsetA, rowA = self._row(index)
+        offsetB, rowB = self._row(index+1)
+        
+        # interpolate rows
+        start = min(offsetA, offsetB)
+        abundances = numpy.zeros(max(offsetA+len(rowA), offsetB+len(rowB)) - start)
+        abundances[offsetA-start:offsetA-start+len(rowA)] += rowA * (1. - fraction)
+        abundances[offsetB-start:offsetB-start+len(rowB)] += rowB * fraction
+        abundances /= abundances.max()
+        
+        # remove isotopes below threshold at both ends
+        indices = numpy.flatnonzero(abundances >= self.threshold)
+        abundances = abundances[indices[0]:indices[-1]+1]
+        
+        return tuple(abundances.tolist())
+    # ----
+    
+    
+    def signature(self):
+        """Get unique identifier of table params."""
+        
+        params = (self.version, sorted(self.composition.items()), self.step, self.maxMass, self.threshold)
+        return hashlib.md5(repr(params)).hexdigest()
+    # ----
+    
+    
+    def load(self, path):
+        """Load calculated patterns from file.
+            path (str) - table file path
+        """
+        
+        # read data
+        try:
+            data = numpy.load(path)
+            signature = str(data['signature'])
+            offsets = data['offsets']
+            lengths = data['lengths']
+            abundances = data['abundances']
+        except (IOError, ValueError, KeyError):
+            return False
+        
+        # check params
+        if signature != self.signature() or len(offsets) != len(self._rows):
+            return False
+        
+        # make rows
+        with self._lock:
+            start = 0
+            for x in range(len(self._rows)):
+                if lengths[x]:
+                    self._offsets[x] = offsets[x]
+                    self._rows[x] = abundances[start:start+lengths[x]]
+                    start += lengths[x]
+            self.changed = False
+        
+        return True
+    # ----
+    
+    
+    def save(self, path):
+        """Save calculated patterns into file.
+            path (str) - table file path
+        """
+        
+        with self._lock:
+            
+            # make arrays
+            lengths = numpy.zeros(len(self._rows), dtype=numpy.int32)
+            abundances = [numpy.zeros(0)]
+            for x, row in enumerate(self._rows):
+                if row is not None:
+                    lengths[x] = len(row)
+                    abundances.append(row)
+            abundances = numpy.concatenate(abundances)
+            
+            # save data
+            try:
+                dataFile = file(path, 'wb')
+                numpy.savez(dataFile, signature=self.signature(), offsets=self._offsets, lengths=lengths, abundances=abundances)
+                dataFile.close()
+            except IOError:
+                return False
+            
+            self.changed = False
+        
+        return True
+    # ----
+    
+    
+    def _row(self, index):
+        """Get isotopes offset and abundances for row, calculate if missing."""
+        
+        # row already calculated
+        row = self._rows[index]
+        if row is not None:
+            return self._offsets[index], row
+        
+        # calculate averagine pattern
+        formula = averagine(index*self.step, charge=0, composition=self.composition)
+        monoMass = formula.mass(0)
+        pattern = formula.pattern(fwhm=0.5, threshold=self.threshold/10., real=False)
+        
+        # sum peaks into nominal isotopes
+        isotopes = {}
+        for mz, abundance in pattern:
+            isotope = int(round((mz - monoMass) / ISOTOPE_DISTANCE))
+            isotopes[isotope] = isotopes.get(isotope, 0.) + abundance
+        
+        offset = min(isotopes)
+        row = numpy.zeros(max(isotopes) - offset + 1)
+        for isotope, abundance in isotopes.items():
+            row[isotope-offset] = abundance
+        row /= row.max()
+        
+        # store row
+        with self._lock:
+            self._offsets[index] = offset
+            self._rows[index] = row
+            self.changed = True
+        
+        return offset, row
+    # ----
+    
+
+
+class averaginetables:
+    """Storage of averagine lookup tables with optional disk cache.
+        directory (str or None) - cache directory
+    """
+    
+    def __init__(self, directory=None):
+        
+        self.directory = directory
+        self._tables = {}
+    # ----
+    
+    
+    def table(self, composition=AVERAGE_AMINO, step=50., maxMass=200000., threshold=0.001):
+        """Get lookup table for given composition and params.
+            composition (dict) - building block composition
+            step (float) - mass step of calculated patterns
+            maxMass (float) - max neutral mass covered by table
+            threshold (float) - relative intensity threshold for isotopes (in %/100)
+        """
+        
+        # get stored table
+        key = (tuple(sorted(composition.items())), step, maxMass, threshold)
+        if key in self._tables:
+            return self._tables[key]
+        
+        # make new table and load from cache
+        table = averaginetable(composition, step, maxMass, threshold)
+        if self.directory:
+            table.load(self._path(table))
+        
+        self._tables[key] = table
+        
+        return table
+    # ----
+    
+    
+    def save(self):
+        """Save changed tables into cache directory."""
+        
+        if not self.directory:
+            return False
+        
+        for table in self._tables.values():
+            if table.changed:
+                table.save(self._path(table))
+        
+        return True
+    # ----
+    
+    
+    def clear(self):
+        """Remove all tables."""
+        self._tables = {}
+    # ----
+    
+    
+    def _path(self, table):
+        """Get cache file path for table."""
+        return os.path.join(self.directory, 'averagine-%s.npz' % table.signature()[:12])
+    # ----
+    
 
 
-# pattern lookup table for amino building block
-patternLookupTable = (
-    (1.000, 0.059, 0.003), #0
-    (1.000, 0.122, 0.013), #200
-    (1.000, 0.241, 0.040, 0.005), #400
-    (1.000, 0.303, 0.059, 0.008), #600
-    (1.000, 0.426, 0.109, 0.020, 0.003), #800
-    (1.000, 0.533, 0.166, 0.038, 0.006), #1000
-    (1.000, 0.655, 0.244, 0.066, 0.014, 0.002), #1200
-    (1.000, 0.786, 0.388, 0.143, 0.042, 0.009, 0.001), #1400
-    (1.000, 0.845, 0.441, 0.171, 0.053, 0.013, 0.002), #1600
-    (1.000, 0.967, 0.557, 0.236, 0.080, 0.021, 0.005), #1800
-    (0.921, 1.000, 0.630, 0.291, 0.107, 0.032, 0.007, 0.001), #2000
-    (0.828, 1.000, 0.687, 0.343, 0.136, 0.044, 0.011, 0.002), #2200
-    (0.752, 1.000, 0.744, 0.400, 0.171, 0.060, 0.017, 0.004), #2400
-    (0.720, 1.000, 0.772, 0.428, 0.188, 0.068, 0.020, 0.005), #2600
-    (0.667, 1.000, 0.825, 0.487, 0.228, 0.088, 0.028, 0.007), #2800
-    (0.616, 1.000, 0.884, 0.556, 0.276, 0.113, 0.039, 0.010, 0.002), #3000
-    (0.574, 1.000, 0.941, 0.628, 0.330, 0.143, 0.052, 0.015, 0.003), #3200
-    (0.536, 0.999, 1.000, 0.706, 0.392, 0.179, 0.069, 0.022, 0.005), #3400
-    (0.506, 0.972, 1.000, 0.725, 0.412, 0.193, 0.077, 0.025, 0.006), #3600
-    (0.449, 0.919, 1.000, 0.764, 0.457, 0.226, 0.094, 0.033, 0.009, 0.001), #3800
-    (0.392, 0.853, 1.000, 0.831, 0.543, 0.295, 0.136, 0.053, 0.017, 0.004), #4000
-    (0.353, 0.812, 1.000, 0.869, 0.593, 0.336, 0.162, 0.067, 0.023, 0.006), #4200
-    (0.321, 0.776, 1.000, 0.907, 0.644, 0.379, 0.190, 0.082, 0.030, 0.009), #4400
-    (0.308, 0.760, 1.000, 0.924, 0.669, 0.401, 0.205, 0.090, 0.033, 0.011, 0.001), #4600
-    (0.282, 0.729, 1.000, 0.962, 0.723, 0.451, 0.239, 0.110, 0.042, 0.014, 0.003), #4800
-    (0.258, 0.699, 1.000, 1.000, 0.780, 0.504, 0.277, 0.132, 0.053, 0.018, 0.004), #5000
-    (0.228, 0.645, 0.962, 1.000, 0.809, 0.542, 0.308, 0.153, 0.065, 0.023, 0.007), #5200
-    (0.203, 0.598, 0.927, 1.000, 0.839, 0.581, 0.343, 0.176, 0.078, 0.029, 0.010), #5400
-    (0.192, 0.577, 0.911, 1.000, 0.854, 0.602, 0.361, 0.189, 0.086, 0.033, 0.011), #5600
-    (0.171, 0.536, 0.880, 1.000, 0.884, 0.644, 0.399, 0.216, 0.102, 0.040, 0.014, 0.003), #5800
-    (0.154, 0.501, 0.851, 1.000, 0.912, 0.686, 0.439, 0.244, 0.120, 0.050, 0.018, 0.004), #6000
-    (0.139, 0.468, 0.823, 1.000, 0.942, 0.730, 0.482, 0.278, 0.141, 0.062, 0.023, 0.007), #6200
-    (0.126, 0.441, 0.799, 1.000, 0.969, 0.772, 0.524, 0.310, 0.162, 0.073, 0.028, 0.009), #6400
-    (0.121, 0.427, 0.787, 1.000, 0.983, 0.794, 0.547, 0.328, 0.174, 0.080, 0.031, 0.011), #6600
-    (0.104, 0.381, 0.732, 0.971, 1.000, 0.848, 0.614, 0.390, 0.219, 0.109, 0.045, 0.016, 0.004), #6800
-    (0.092, 0.349, 0.691, 0.944, 1.000, 0.872, 0.648, 0.422, 0.244, 0.125, 0.054, 0.020, 0.006), #7000
-    (0.082, 0.321, 0.654, 0.919, 1.000, 0.894, 0.682, 0.456, 0.270, 0.143, 0.063, 0.024, 0.008), #7200
-    (0.073, 0.296, 0.620, 0.895, 1.000, 0.917, 0.718, 0.492, 0.299, 0.162, 0.077, 0.030, 0.011), #7400
-    (0.069, 0.284, 0.604, 0.884, 1.000, 0.929, 0.735, 0.509, 0.313, 0.172, 0.084, 0.033, 0.012), #7600
-    (0.062, 0.262, 0.573, 0.861, 1.000, 0.952, 0.772, 0.548, 0.345, 0.195, 0.098, 0.040, 0.015, 0.003), #7800
-    (0.056, 0.243, 0.544, 0.839, 1.000, 0.976, 0.811, 0.589, 0.380, 0.220, 0.114, 0.049, 0.019, 0.005), #8000
-    (0.051, 0.227, 0.521, 0.821, 1.000, 0.997, 0.846, 0.628, 0.413, 0.244, 0.130, 0.058, 0.022, 0.007), #8200
-    (0.045, 0.206, 0.486, 0.786, 0.980, 1.000, 0.869, 0.660, 0.444, 0.268, 0.147, 0.070, 0.027, 0.010), #8400
-    (0.042, 0.196, 0.468, 0.767, 0.968, 1.000, 0.879, 0.676, 0.460, 0.281, 0.156, 0.075, 0.030, 0.011), #8600
-    (0.038, 0.179, 0.437, 0.733, 0.947, 1.000, 0.899, 0.705, 0.491, 0.307, 0.173, 0.086, 0.036, 0.013, 0.002), #8800
-    (0.033, 0.163, 0.408, 0.701, 0.926, 1.000, 0.919, 0.736, 0.524, 0.335, 0.193, 0.099, 0.043, 0.016, 0.004), #9000
-    (0.030, 0.149, 0.382, 0.670, 0.906, 1.000, 0.938, 0.768, 0.558, 0.364, 0.215, 0.113, 0.051, 0.020, 0.006), #9200
-    (0.026, 0.132, 0.348, 0.629, 0.877, 1.000, 0.971, 0.823, 0.620, 0.420, 0.258, 0.143, 0.069, 0.028, 0.010), #9400
-    (0.024, 0.126, 0.337, 0.616, 0.868, 1.000, 0.981, 0.839, 0.638, 0.437, 0.271, 0.153, 0.074, 0.031, 0.011), #9600
-    (0.022, 0.116, 0.317, 0.592, 0.851, 1.000, 1.000, 0.872, 0.676, 0.472, 0.298, 0.172, 0.087, 0.037, 0.014, 0.002), #9800
-    (0.020, 0.106, 0.294, 0.561, 0.822, 0.983, 1.000, 0.888, 0.700, 0.498, 0.320, 0.188, 0.099, 0.043, 0.017, 0.004), #10000
-    (0.017, 0.096, 0.272, 0.529, 0.790, 0.965, 1.000, 0.905, 0.727, 0.526, 0.346, 0.207, 0.113, 0.050, 0.020, 0.006), #10200
-    (0.015, 0.087, 0.251, 0.499, 0.761, 0.946, 1.000, 0.922, 0.755, 0.556, 0.373, 0.227, 0.126, 0.061, 0.024, 0.008), #10400
-    (0.014, 0.083, 0.242, 0.486, 0.747, 0.937, 1.000, 0.930, 0.768, 0.570, 0.385, 0.237, 0.134, 0.065, 0.026, 0.009), #10600
-    (0.013, 0.075, 0.225, 0.459, 0.720, 0.920, 1.000, 0.947, 0.796, 0.602, 0.415, 0.260, 0.149, 0.075, 0.032, 0.012, 0.001), #10800
-    (0.012, 0.069, 0.208, 0.435, 0.695, 0.904, 1.000, 0.963, 0.824, 0.633, 0.443, 0.284, 0.165, 0.085, 0.037, 0.015, 0.002), #11000
-    (0.010, 0.063, 0.194, 0.412, 0.669, 0.888, 1.000, 0.980, 0.852, 0.667, 0.475, 0.309, 0.184, 0.098, 0.044, 0.018, 0.005), #11200
-    (0.009, 0.057, 0.180, 0.391, 0.646, 0.872, 1.000, 0.997, 0.882, 0.702, 0.509, 0.336, 0.204, 0.113, 0.052, 0.021, 0.006), #11400
-    (0.009, 0.054, 0.173, 0.379, 0.631, 0.861, 0.995, 1.000, 0.892, 0.717, 0.523, 0.350, 0.214, 0.119, 0.057, 0.023, 0.008), #11600
-    (0.008, 0.049, 0.160, 0.355, 0.602, 0.834, 0.980, 1.000, 0.906, 0.739, 0.548, 0.373, 0.231, 0.132, 0.066, 0.026, 0.010), #11800
-    (0.007, 0.042, 0.141, 0.321, 0.557, 0.791, 0.953, 1.000, 0.931, 0.781, 0.596, 0.417, 0.268, 0.158, 0.082, 0.037, 0.014, 0.002), #12000
-    (0.006, 0.038, 0.130, 0.301, 0.531, 0.767, 0.939, 1.000, 0.945, 0.805, 0.624, 0.443, 0.289, 0.174, 0.093, 0.043, 0.017, 0.004), #12200
-    (0.005, 0.035, 0.120, 0.283, 0.507, 0.744, 0.925, 1.000, 0.960, 0.830, 0.653, 0.470, 0.312, 0.191, 0.106, 0.051, 0.020, 0.006), #12400
-    (0.005, 0.033, 0.115, 0.274, 0.495, 0.732, 0.918, 1.000, 0.967, 0.842, 0.668, 0.485, 0.324, 0.200, 0.112, 0.054, 0.023, 0.007), #12600
-    (0.004, 0.030, 0.107, 0.257, 0.472, 0.710, 0.904, 1.000, 0.982, 0.868, 0.699, 0.515, 0.351, 0.219, 0.126, 0.063, 0.027, 0.010), #12800
-    (0.004, 0.027, 0.098, 0.242, 0.450, 0.689, 0.890, 1.000, 0.997, 0.894, 0.731, 0.547, 0.378, 0.241, 0.141, 0.072, 0.032, 0.012, 0.002), #13000
-    (0.003, 0.025, 0.090, 0.224, 0.426, 0.661, 0.867, 0.989, 1.000, 0.911, 0.756, 0.574, 0.402, 0.260, 0.155, 0.082, 0.037, 0.014, 0.003), #13200
-    (0.003, 0.022, 0.082, 0.208, 0.402, 0.633, 0.843, 0.975, 1.000, 0.925, 0.777, 0.598, 0.425, 0.279, 0.169, 0.092, 0.043, 0.017, 0.005), #13400
-    (0.003, 0.021, 0.079, 0.202, 0.392, 0.621, 0.833, 0.969, 1.000, 0.930, 0.786, 0.609, 0.435, 0.288, 0.176, 0.097, 0.046, 0.018, 0.006), #13600
-    (0.003, 0.019, 0.073, 0.188, 0.370, 0.595, 0.810, 0.955, 1.000, 0.943, 0.808, 0.634, 0.460, 0.309, 0.191, 0.108, 0.053, 0.022, 0.007), #13800
-    (0.002, 0.017, 0.067, 0.175, 0.350, 0.570, 0.787, 0.942, 1.000, 0.956, 0.831, 0.662, 0.487, 0.331, 0.209, 0.121, 0.062, 0.026, 0.010), #14000
-    (0.002, 0.016, 0.061, 0.163, 0.330, 0.547, 0.765, 0.929, 1.000, 0.968, 0.855, 0.690, 0.515, 0.356, 0.227, 0.135, 0.070, 0.031, 0.012, 0.002), #14200
-    (0.002, 0.014, 0.056, 0.151, 0.312, 0.524, 0.743, 0.916, 1.000, 0.982, 0.878, 0.718, 0.544, 0.382, 0.247, 0.149, 0.079, 0.037, 0.014, 0.003), #14400
-    (0.002, 0.013, 0.054, 0.146, 0.304, 0.514, 0.733, 0.909, 1.000, 0.989, 0.890, 0.733, 0.559, 0.395, 0.257, 0.156, 0.084, 0.039, 0.016, 0.004), #14600
-    (0.001, 0.012, 0.047, 0.131, 0.276, 0.478, 0.697, 0.881, 0.989, 1.000, 0.920, 0.777, 0.605, 0.437, 0.292, 0.182, 0.102, 0.051, 0.022, 0.007), #14800
-    (0.001, 0.010, 0.043, 0.121, 0.259, 0.454, 0.671, 0.859, 0.977, 1.000, 0.932, 0.797, 0.629, 0.460, 0.312, 0.197, 0.114, 0.058, 0.025, 0.008, 0.001), #15000
-)
+# init averagine tables
+AVERAGINE_TABLES = averaginetables()
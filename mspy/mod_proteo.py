@@ -17,7 +17,9 @@
 
 # load libs
 import re
+import sre_parse
 import itertools
+import numpy
 
 # load stopper
 from mod_stopper import CHECK_FORCE_QUIT
@@ -26,8 +28,13 @@ from mod_stopper import CHECK_FORCE_QUIT
 import blocks
 
 # load objects
+import obj_compound
 import obj_sequence
 
+# load modules
+import mod_basics
+import mod_composition
+
 
 # SEQUENCE DIGESTION
 # ------------------
@@ -60,31 +67,30 @@ def digest(sequence, enzyme, miscleavage=0, allowMods=False, strict=True):
     # get enzyme
     if enzyme in blocks.enzymes:
         enzyme = blocks.enzymes[enzyme]
-        expression = re.compile(enzyme.expression+'$')
     else:
         raise KeyError, 'Unknown enzyme! -> ' + enzyme
     
+    # get modified positions
+    modified = set()
+    if not allowMods:
+        modified = _modifiedPositions(sequence, strict)
+    
     # get digest indices
     slices = [] # from | to | miscl
     lastIndex = 0
-    peptide = ''
-    for x, aa in enumerate(sequence):
+    for x in _cleavageSites(sequence.chain, enzyme.expression):
         
-        # check expression
-        peptide += aa
-        if expression.search(peptide):
-            
-            # skip not allowed modifications
-            if not allowMods and sequence.ismodified(x-1, strict) and not enzyme.modsBefore:
-                continue
-            elif not allowMods and sequence.ismodified(x, strict) and not enzyme.modsAfter:
-                continue
-            else:
-                slices.append((lastIndex, x, 0))
-                lastIndex = x
+        # skip not allowed modifications
+        if (x-1) in modified and not enzyme.modsBefore:
+            continue
+        elif x in modified and not enzyme.modsAfter:
+            continue
+        else:
+            slices.append((lastIndex, x, 0))
+            lastIndex = x
     
     # add last peptide
-    slices.append((lastIndex, x+1, 0))
+    slices.append((lastIndex, len(sequence), 0))
     
     # add indices for partials
     indices = len(slices)
@@ -117,6 +123,67 @@ def digest(sequence, enzyme, miscleavage=0, allowMods=False, strict=True):
 # ----
 
 
+def _cleavageSites(chain, expression):
+    """Get sorted indices of monomers following cleavage sites. Site is found
+    wherever the expression match ends at monomer end, including overlapping matches."""
+    
+    # get monomer indices by string ends
+    string = ''.join(chain)
+    ends = {}
+    end = 0
+    for x, monomer in enumerate(chain):
+        end += len(monomer)
+        ends[end] = x
+    
+    # fixed-length expression - one pass over overlapping matches
+    width = sre_parse.parse(expression).getwidth()
+    if width[0] == width[1] and width[0] > 0:
+        expression = re.compile('(?=%s)' % expression)
+        sites = []
+        for match in expression.finditer(string):
+            end = match.start() + width[0]
+            if end in ends:
+                sites.append(ends[end])
+        return sites
+    
+    # variable-length expression - check match ends one by one, searching
+    # only within max expression width before each end; unbounded expressions
+    # (using * or +) still search from sequence start, i.e. quadratic time
+    expression = re.compile('(?:%s)$' % expression)
+    return [ends[end] for end in sorted(ends) if expression.search(string, max(0, end - width[1]), end)]
+# ----
+
+
+def _modifiedPositions(sequence, strict):
+    """Get set of positions having modification, -1 stands for the last residue
+    as used by sequence.ismodified()."""
+    
+    chain = sequence.chain
+    positions = set()
+    for mod in sequence.modifications:
+        if not (strict or mod[2] == 'f'):
+            continue
+        
+        # positioned and terminal modifications
+        if type(mod[1]) == int:
+            positions.add(mod[1])
+        elif mod[1] == 'nTerm':
+            positions.add(0)
+        elif mod[1] == 'cTerm':
+            positions.update((-1, len(chain)-1))
+        
+        # global modifications
+        else:
+            for x, monomer in enumerate(chain):
+                if monomer == mod[1]:
+                    positions.add(x)
+            if chain and chain[-1] == mod[1]:
+                positions.add(-1)
+    
+    return positions
+# ----
+
+
 def coverage(ranges, length, human=True):
     """Calculate sequence coverage.
         ranges: (list of mspy.sequence or list of user ranges (start,stop))
@@ -149,14 +216,32 @@ def coverage(ranges, length, human=True):
 # SEQUENCE FRAGMENTATION
 # ----------------------
 
-def fragment(sequence, series, scrambling=False):
+def fragment(sequence, series, scrambling=False, mzRange=None, charges=[1], massType=0):
     """Generate list of neutral peptide fragments from given peptide.
         sequence: (sequence) mspy sequence object
         series: (list) list of fragment serie names - must be defined in mspy.fragments
         scrambling: (int) allow sequence scrambling
+        mzRange: (tuple) m/z range of returned fragments, None for all
+        charges: (list) charges used to check m/z range
+        massType: (0 or 1) mass type used to check m/z range, 0 = monoisotopic, 1 = average
     """
     
-    frags = []
+    return list(iterfragments(sequence, series, scrambling, mzRange, charges, massType))
+# ----
+
+
+def iterfragments(sequence, series, scrambling=False, mzRange=None, charges=[1], massType=0):
+    """Generate unique neutral peptide fragments from given peptide one by one.
+        sequence: (sequence) mspy sequence object
+        series: (list) list of fragment serie names - must be defined in mspy.fragments
+        scrambling: (int) allow sequence scrambling
+        mzRange: (tuple) m/z range of returned fragments, None for all
+        charges: (list) charges used to check m/z range
+        massType: (0 or 1) mass type used to check m/z range, 0 = monoisotopic, 1 = average
+    """
+    
+    have = set()
+    scrambled = []
     scramblingFilter = ('M')
     
     # check sequence object
@@ -165,48 +250,31 @@ def fragment(sequence, series, scrambling=False):
     
     # generate fragments for linear peptide
     if not sequence.cyclic:
-        for serie in series:
-            frags += fragmentserie(sequence, serie)
+        frags = itertools.chain(*[iterfragmentserie(sequence, serie) for serie in series])
     
     # generate fragments for cyclic peptide
     else:
-        for peptide in sequence.linearized():
-            for serie in series:
-                frags += fragmentserie(peptide, serie, cyclicParent=True)
+        frags = itertools.chain(*[iterfragmentserie(peptide, serie, cyclicParent=True) for peptide in sequence.linearized() for serie in series])
     
-    # generate scrambling fragments
-    if scrambling:
-        buff = []
-        for frag in frags:
-            
-            # check fragment
-            if len(frag) <= 2 or not frag.fragmentSerie in ('a', 'b', 'M'):
-                continue
-            elif frag.fragmentSerie == 'M' and sequence.cyclic:
-                continue
-            
-            # generate fragments
-            for peptide in frag.linearized():
-                for serie in series:
-                    if not serie in scramblingFilter:
-                        buff += fragmentserie(peptide, serie, cyclicParent=sequence.cyclic)
-        
-        frags += buff
-    
-    # remove same fragments
-    buff = []
-    have = []
     for frag in frags:
-        frhash = [frag.fragmentSerie] + frag.indexes()
-        if frag.fragmentSerie == 'M':
-            frhash.sort()
-        if not frhash in have:
-            buff.append(frag)
-            have.append(frhash)
-    
-    frags = buff
+        
+        # remember fragments for scrambling
+        if scrambling and len(frag) > 2 and frag.fragmentSerie in ('a', 'b', 'M'):
+            if not (frag.fragmentSerie == 'M' and sequence.cyclic):
+                scrambled.append(frag)
+        
+        if _checkFragment(frag, have, mzRange, charges, massType):
+            yield frag
     
-    return frags
+    # generate scrambling fragments
+    for frag in scrambled:
+        for peptide in frag.linearized():
+            for serie in series:
+                if serie in scramblingFilter:
+                    continue
+                for scrambledFrag in iterfragmentserie(peptide, serie, cyclicParent=sequence.cyclic):
+                    if _checkFragment(scrambledFrag, have, mzRange, charges, massType):
+                        yield scrambledFrag
 # ----
 
 
@@ -216,6 +284,16 @@ def fragmentserie(sequence, serie, cyclicParent=False):
         serie: (str) fragment serie name - must be defined in mspy.fragments
     """
     
+    return list(iterfragmentserie(sequence, serie, cyclicParent))
+# ----
+
+
+def iterfragmentserie(sequence, serie, cyclicParent=False):
+    """Generate neutral peptide fragments of given serie one by one.
+        sequence: (sequence) mspy sequence object
+        serie: (str) fragment serie name - must be defined in mspy.fragments
+    """
+    
     # check sequence object
     if not isinstance(sequence, obj_sequence.sequence):
         raise TypeError, "Cannot fragment non-sequence object!"
@@ -224,93 +302,115 @@ def fragmentserie(sequence, serie, cyclicParent=False):
     if sequence.cyclic:
         raise TypeError, 'Direct fragmentation of cyclic peptides is not supported!'
     
-    frags = []
     length = len(sequence)
     
     # get serie definition
     serie = blocks.fragments[serie]
     
+    # get nonsense terminal fragments
+    first = False
+    last = False
+    if serie.terminus in ('N', 'S'):
+        first = serie.nTermFilter
+        last = serie.cTermFilter
+    elif serie.terminus == 'C':
+        first = serie.cTermFilter
+        last = serie.nTermFilter
+    
     # molecular ion
     if serie.terminus == 'M':
         frag = sequence[:]
         frag.fragmentSerie = serie.name
-        frags.append(frag)
+        if cyclicParent:
+            frag.nTermFormula = ''
+            frag.cTermFormula = ''
+        yield frag
     
     # N-terminal fragments
     elif serie.terminus == 'N':
         for x in range(length):
+            
+            CHECK_FORCE_QUIT()
+            
+            if (first and x == 0) or (last and x == length-1):
+                continue
+            
             frag = sequence[:x+1]
             frag.fragmentSerie = serie.name
             frag.fragmentIndex = (x+1)
             frag.cTermFormula = serie.cTermFormula
-            frags.append(frag)
-            
-            CHECK_FORCE_QUIT()
+            if cyclicParent:
+                frag.nTermFormula = 'H'
+            yield frag
     
     # C-terminal fragments
     elif serie.terminus == 'C':
         for x in range(length):
+            
+            CHECK_FORCE_QUIT()
+            
+            if (first and x == 0) or (last and x == length-1):
+                continue
+            
             frag = sequence[length-(x+1):]
             frag.fragmentSerie = serie.name
             frag.fragmentIndex = (x+1)
             frag.nTermFormula = serie.nTermFormula
-            frags.append(frag)
-            
-            CHECK_FORCE_QUIT()
+            if cyclicParent:
+                frag.cTermFormula = 'H-1'
+            yield frag
     
     # singlet fragments
     elif serie.terminus == 'S':
         for x in range(length):
+            
+            CHECK_FORCE_QUIT()
+            
+            if (first and x == 0) or (last and x == length-1):
+                continue
+            
             frag = sequence[x:x+1]
             frag.fragmentSerie = serie.name
             frag.fragmentIndex = (x+1)
             frag.nTermFormula = serie.nTermFormula
             frag.cTermFormula = serie.cTermFormula
-            frags.append(frag)
-            
-            CHECK_FORCE_QUIT()
+            yield frag
     
     # internal fragments
     elif serie.terminus == 'I':
         for x in range(1,length-1):
             for y in range(2,length-x):
+                
+                CHECK_FORCE_QUIT()
+                
                 frag = sequence[x:x+y]
                 frag.fragmentSerie = serie.name
                 frag.nTermFormula = serie.nTermFormula
                 frag.cTermFormula = serie.cTermFormula
-                frags.append(frag)
-                
-                CHECK_FORCE_QUIT()
-    
-    # correct termini for cyclic peptides
-    if cyclicParent:
-        for frag in frags:
-            if serie.terminus == 'M':
-                frag.nTermFormula = ''
-                frag.cTermFormula = ''
-            elif serie.terminus == 'N':
-                frag.nTermFormula = 'H'
-            elif serie.terminus == 'C':
-                frag.cTermFormula = 'H-1'
-    
-    # remove nonsense terminal fragments
-    if serie.terminus == 'N':
-        if frags and serie.nTermFilter:
-            del frags[0]
-        if frags and serie.cTermFilter:
-            del frags[-1]
-    elif serie.terminus == 'C':
-        if frags and serie.nTermFilter:
-            del frags[-1]
-        if frags and serie.cTermFilter:
-            del frags[0]
-    elif serie.terminus == 'S':
-        if frags and serie.nTermFilter:
-            del frags[0]
-        if frags and serie.cTermFilter:
-            del frags[-1]
-    
-    return frags
+                yield frag
+# ----
+
+
+def _checkFragment(frag, have, mzRange, charges, massType):
+    """Check fragment is new and within m/z range. Fragment hash is stored to have."""
+    
+    # check same fragments
+    frhash = frag.indexes()
+    if frag.fragmentSerie == 'M':
+        frhash.sort()
+    frhash = (frag.fragmentSerie,) + tuple(frhash)
+    if frhash in have:
+        return False
+    have.add(frhash)
+    
+    # check m/z range
+    if mzRange:
+        for charge in charges:
+            if mzRange[0] <= frag.mz(charge)[massType] <= mzRange[1]:
+                return True
+        return False
+    
+    return True
 # ----
 
 
@@ -363,6 +463,7 @@ def fragmentlosses(fragments, losses=[], defined=False, limit=1, filterIn={}, fi
             # apply losses
             for loss in combination:
                 newFrag.fragmentLosses.append(loss)
+                newFrag.reset()
                 
                 # check neutral gains
                 if loss in frag.fragmentGains:
@@ -444,4 +545,471 @@ def fragmentgains(fragments, gains=[], filterIn={'H2O':['b'], 'CO':['b', 'c', 'b
 # ----
 
 
-  
\ No newline at end of file
+  
+
+
+
+# FRAGMENT LADDERS
+# ----------------
+
+class fragmentladder:
+    """Fragment masses calculated from cumulative peptide compositions.
+        Fragments are described by their range within the peptide and all the
+        masses are calculated at once as NumPy arrays. Sequence objects are made
+        on request only, e.g. for matched fragments. Fragments are the same and
+        in the same order as made by fragment, fragmentlosses and fragmentgains
+        functions using default filters.
+        sequence: (sequence) mspy sequence object
+        series: (list) list of fragment serie names - must be defined in mspy.fragments
+        losses: (list) list of neutral losses
+        defined: (bool) use monomer-defined neutral losses
+        limit: (int) max length of loss combination
+        gains: (list) list of neutral gains
+    """
+    
+    def __init__(self, sequence, series, losses=[], defined=False, limit=1, gains=[]):
+        
+        # check sequence object
+        if not isinstance(sequence, obj_sequence.sequence):
+            raise TypeError, "Cannot fragment non-sequence object!"
+        
+        self.sequence = sequence
+        
+        # fragments as (peptide, serie, start, stop, index, nTermFormula, cTermFormula, losses, gains, filtered)
+        self.fragments = []
+        self.masses = None
+        
+        # get linear peptides
+        if sequence.cyclic:
+            self._peptides = sequence.linearized()
+        else:
+            self._peptides = [sequence]
+        
+        # get vector length covering all atoms
+        self._registry = mod_composition.registry()
+        self._compositions = {}
+        self._length = self._getLength(series, losses, gains)
+        
+        # get cumulative compositions
+        self._prefixes = []
+        for peptide in self._peptides:
+            self._prefixes.append(self._makePrefixes(peptide))
+        
+        # make fragments
+        frags, vectors = self._makeFragments(series)
+        lossFrags, lossVectors = self._makeLosses(frags, vectors, losses, defined, limit)
+        frags += lossFrags
+        vectors = numpy.vstack((vectors, lossVectors))
+        gainFrags, gainVectors = self._makeGains(frags, vectors, gains)
+        frags += gainFrags
+        vectors = numpy.vstack((vectors, gainVectors))
+        
+        # calculate masses
+        self.fragments = frags
+        self.masses = self._registry.masses(vectors)
+    # ----
+    
+    
+    def __len__(self):
+        """Get number of fragments."""
+        return len(self.fragments)
+    # ----
+    
+    
+    def mz(self, charge, agentFormula='H', agentCharge=1, massType=0):
+        """Get m/z values of all fragments.
+            charge: (int) charge
+            agentFormula: (str or mspy.compound) charging agent formula
+            agentCharge: (int) charging agent unit charge
+            massType: (0 or 1) mass type, 0 = monoisotopic, 1 = average
+        """
+        
+        return mod_basics.mz(self.masses[:,massType], charge, agentFormula=agentFormula, agentCharge=agentCharge, massType=massType)
+    # ----
+    
+    
+    def fragment(self, i):
+        """Make sequence object of selected fragment.
+            i: (int) fragment index
+        """
+        
+        x, serie, start, stop, index, nTermFormula, cTermFormula, losses, gains, filtered = self.fragments[i]
+        
+        # make fragment
+        frag = self._peptides[x][start:stop]
+        frag.fragmentSerie = serie
+        frag.fragmentIndex = index
+        frag.nTermFormula = nTermFormula
+        frag.cTermFormula = cTermFormula
+        frag.fragmentLosses = list(losses)
+        frag.fragmentGains = list(gains)
+        frag.fragmentFiltered = filtered
+        
+        return frag
+    # ----
+    
+    
+    def match(self, peaks, charges=[1], tolerance=0.5, units='Da', massType=0, agentFormula='H', agentCharge=1, filterFragments=False):
+        """Match fragments to peaks. Matches are returned as list of
+            (fragment, charge, m/z, peak index) ordered by fragments.
+            peaks: (list of float or mspy.peak or mspy.peaklist) peaks to match
+            charges: (list of int) fragment charges to check
+            tolerance: (float) m/z tolerance
+            units: ('Da' or 'ppm') tolerance units
+            massType: (0 or 1) mass type, 0 = monoisotopic, 1 = average
+            agentFormula: (str or mspy.compound) charging agent formula
+            agentCharge: (int) charging agent unit charge
+            filterFragments: (bool) skip fragments with non-specific losses
+        """
+        
+        # get sorted peaks
+        peakMZs = numpy.array([getattr(p, 'mz', p) for p in peaks], dtype=numpy.float64)
+        order = numpy.argsort(peakMZs, kind='mergesort')
+        peakMZs = peakMZs[order]
+        
+        # get fragments to match
+        use = numpy.ones(len(self.fragments), dtype=bool)
+        if filterFragments:
+            use = numpy.array([not item[9] for item in self.fragments], dtype=bool)
+        
+        # find peaks for all charges
+        found = []
+        for charge in charges:
+            
+            CHECK_FORCE_QUIT()
+            
+            mzs = self.mz(charge, agentFormula, agentCharge, massType)
+            if units == 'ppm':
+                tolerances = mzs * tolerance / 1000000
+            else:
+                tolerances = tolerance
+            
+            lo = numpy.searchsorted(peakMZs, mzs - tolerances, side='left')
+            hi = numpy.searchsorted(peakMZs, mzs + tolerances, side='right')
+            for i in numpy.flatnonzero((hi > lo) & use):
+                for p in range(lo[i], hi[i]):
+                    found.append((i, charge, float(mzs[i]), int(order[p])))
+        
+        # make matched fragments only
+        found.sort(key=lambda item: item[0])
+        frags = {}
+        matches = []
+        for i, charge, mz, peak in found:
+            if not i in frags:
+                frags[i] = self.fragment(i)
+            matches.append((frags[i], charge, mz, peak))
+        
+        return matches
+    # ----
+    
+    
+    def _composition(self, formula):
+        """Get composition of formula."""
+        
+        if not formula in self._compositions:
+            self._compositions[formula] = obj_compound.compound(formula).composition()
+        
+        return self._compositions[formula]
+    # ----
+    
+    
+    def _vector(self, composition):
+        """Get composition vector of formula or composition."""
+        
+        if not isinstance(composition, dict):
+            composition = self._composition(composition)
+        
+        return self._registry.vector(composition, self._length)
+    # ----
+    
+    
+    def _getLength(self, series, losses, gains):
+        """Get vector length covering all used atoms."""
+        
+        # get used compositions
+        compositions = []
+        for peptide in self._peptides:
+            for monomer in set(peptide.chain):
+                compositions.append(blocks.monomers[monomer].composition)
+                for loss in blocks.monomers[monomer].losses:
+                    compositions.append(self._composition(loss))
+            for mod in peptide.modifications + peptide.labels:
+                compositions.append(blocks.modifications[mod[0]].composition)
+            compositions.append(self._composition(peptide.nTermFormula))
+            compositions.append(self._composition(peptide.cTermFormula))
+        
+        for name in series:
+            compositions.append(self._composition(blocks.fragments[name].nTermFormula))
+            compositions.append(self._composition(blocks.fragments[name].cTermFormula))
+        
+        for formula in list(losses) + list(gains) + ['H-1']:
+            compositions.append(self._composition(formula))
+        
+        # get max atom index
+        length = 0
+        for composition in compositions:
+            for atom in composition:
+                length = max(length, self._registry.index[atom]+1)
+        
+        return length
+    # ----
+    
+    
+    def _makePrefixes(self, peptide):
+        """Get cumulative monomer compositions and terminal modifications."""
+        
+        # get monomers composition
+        residues = numpy.zeros((len(peptide)+1, self._length), dtype=numpy.int64)
+        for x, monomer in enumerate(peptide.chain):
+            residues[x+1] = self._vector(blocks.monomers[monomer].composition)
+        
+        # add modifications and labels kept by slicing
+        nTermMods = numpy.zeros(self._length, dtype=numpy.int64)
+        cTermMods = numpy.zeros(self._length, dtype=numpy.int64)
+        for name, position, state in peptide.modifications + peptide.labels:
+            vector = self._vector(blocks.modifications[name].composition)
+            if position == 'nTerm':
+                nTermMods += vector
+            elif position == 'cTerm':
+                cTermMods += vector
+            elif type(position) == int:
+                residues[position+1] += vector
+            else:
+                for x, monomer in enumerate(peptide.chain):
+                    if monomer == position:
+                        residues[x+1] += vector
+        
+        # check if peptide comes from cyclic parent
+        broken = False
+        for item in peptide.history:
+            if 'break' in item:
+                broken = True
+                break
+        
+        return [numpy.cumsum(residues, axis=0), nTermMods, cTermMods, peptide.indexes(), broken]
+    # ----
+    
+    
+    def _makeFragments(self, series):
+        """Make basic fragments of all peptides."""
+        
+        frags = []
+        vectors = []
+        have = set()
+        cyclicParent = self.sequence.cyclic
+        
+        for x, peptide in enumerate(self._peptides):
+            length = len(peptide)
+            prefixes, nTermMods, cTermMods, indexes, broken = self._prefixes[x]
+            
+            for name in series:
+                
+                CHECK_FORCE_QUIT()
+                
+                # get serie definition
+                serie = blocks.fragments[name]
+                buff = []
+                
+                # molecular ion
+                if serie.terminus == 'M':
+                    if cyclicParent:
+                        buff.append((0, length, None, '', ''))
+                    else:
+                        buff.append((0, length, None, peptide.nTermFormula, peptide.cTermFormula))
+                
+                # N-terminal fragments
+                elif serie.terminus == 'N':
+                    nTerm = peptide.nTermFormula
+                    if cyclicParent:
+                        nTerm = 'H'
+                    for i in range(length):
+                        buff.append((0, i+1, i+1, nTerm, serie.cTermFormula))
+                
+                # C-terminal fragments
+                elif serie.terminus == 'C':
+                    cTerm = peptide.cTermFormula
+                    if cyclicParent:
+                        cTerm = 'H-1'
+                    for i in range(length):
+                        buff.append((length-(i+1), length, i+1, serie.nTermFormula, cTerm))
+                
+                # singlet fragments
+                elif serie.terminus == 'S':
+                    for i in range(length):
+                        buff.append((i, i+1, i+1, serie.nTermFormula, serie.cTermFormula))
+                
+                # internal fragments
+                elif serie.terminus == 'I':
+                    for i in range(1, length-1):
+                        for j in range(2, length-i):
+                            buff.append((i, i+j, None, serie.nTermFormula, serie.cTermFormula))
+                
+                # remove nonsense terminal fragments
+                if serie.terminus in ('N', 'S'):
+                    if buff and serie.nTermFilter:
+                        del buff[0]
+                    if buff and serie.cTermFilter:
+                        del buff[-1]
+                elif serie.terminus == 'C':
+                    if buff and serie.nTermFilter:
+                        del buff[-1]
+                    if buff and serie.cTermFilter:
+                        del buff[0]
+                
+                # remove same fragments and get compositions
+                for start, stop, index, nTerm, cTerm in buff:
+                    
+                    frhash = indexes[start:stop]
+                    if serie.terminus == 'M':
+                        frhash = sorted(frhash)
+                    frhash = (serie.name,) + tuple(frhash)
+                    if frhash in have:
+                        continue
+                    have.add(frhash)
+                    
+                    vector = prefixes[stop] - prefixes[start] + self._vector(nTerm + cTerm)
+                    if start == 0:
+                        vector += nTermMods
+                    if stop == length:
+                        vector += cTermMods
+                    
+                    frags.append((x, serie.name, start, stop, index, nTerm, cTerm, (), (), False))
+                    vectors.append(vector)
+        
+        return frags, self._stack(vectors)
+    # ----
+    
+    
+    def _makeLosses(self, frags, vectors, losses, defined, limit):
+        """Apply neutral losses to fragments."""
+        
+        # make losses combinations
+        combinations = []
+        for x in range(1, min(len(losses), limit) + 1):
+            for c in itertools.combinations(losses, x):
+                combinations.append(list(c))
+        
+        # get losses to apply for each fragment
+        candidates = []
+        cache = {}
+        for i, item in enumerate(frags):
+            
+            CHECK_FORCE_QUIT()
+            
+            # get monomers with defined losses
+            x, name, start, stop = item[:4]
+            key = tuple([m for m in self._peptides[x].chain[start:stop] if blocks.monomers[m].losses])
+            
+            # get losses for these monomers
+            if not key in cache:
+                
+                # get monomer-defined losses to check specifity
+                definedLosses = []
+                for monomer in key:
+                    definedLosses += blocks.monomers[monomer].losses
+                
+                # append new combinations with monomer-defined losses
+                lossesToApply = combinations[:]
+                if defined:
+                    for monomer in key:
+                        for lossItem in ([[]] + lossesToApply[:]):
+                            for loss in blocks.monomers[monomer].losses:
+                                newItem = lossItem + [loss]
+                                newItem.sort()
+                                
+                                if not [loss] in lossesToApply:
+                                    lossesToApply.append([loss])
+                                if len(newItem) <= limit and not newItem in lossesToApply:
+                                    lossesToApply.append(newItem)
+                
+                # filter non-specific losses
+                buff = []
+                for combination in lossesToApply:
+                    filtered = False
+                    for loss in combination:
+                        if not loss in definedLosses:
+                            filtered = True
+                    buff.append((tuple(combination), filtered))
+                cache[key] = buff
+            
+            for combination, filtered in cache[key]:
+                candidates.append((i, combination, filtered))
+        
+        # group candidates by losses
+        groups = {}
+        for c, item in enumerate(candidates):
+            groups.setdefault(item[1], []).append(c)
+        
+        # check compositions after each loss
+        valid = numpy.zeros(len(candidates), dtype=bool)
+        lossVectors = numpy.zeros((len(candidates), self._length), dtype=numpy.int64)
+        for combination, members in groups.items():
+            members = numpy.array(members)
+            current = vectors[[candidates[c][0] for c in members]]
+            check = numpy.ones(len(members), dtype=bool)
+            for loss in combination:
+                current = current - self._vector(loss)
+                check &= (current >= 0).all(axis=1)
+            valid[members] = check
+            lossVectors[members] = current
+        
+        # make fragments
+        buff = []
+        for c in numpy.flatnonzero(valid):
+            i, combination, filtered = candidates[c]
+            buff.append(frags[i][:7] + (combination, (), filtered))
+        
+        return buff, lossVectors[valid]
+    # ----
+    
+    
+    def _makeGains(self, frags, vectors, gains, filterIn={'H2O':['b'], 'CO':['b', 'c', 'break']}, filterOut={}):
+        """Apply neutral gains to fragments."""
+        
+        buff = []
+        buffVectors = []
+        for i, item in enumerate(frags):
+            
+            CHECK_FORCE_QUIT()
+            
+            x, name = item[:2]
+            losses = item[7]
+            
+            # apply gains
+            for gain in gains:
+                
+                # check neutral losses
+                if gain in losses:
+                    continue
+                
+                # check fragment type filters
+                if (gain in filterOut and name in filterOut[gain]) \
+                    or (gain in filterIn and not name in filterIn[gain]):
+                    continue
+                
+                # check break (cyclic parent)
+                if gain in filterIn and 'break' in filterIn[gain] and not self._prefixes[x][4]:
+                    continue
+                
+                # check fragment composition
+                vector = vectors[i] + self._vector(gain)
+                if (vector < 0).any():
+                    continue
+                
+                buff.append(item[:8] + (item[8] + (gain,), item[9]))
+                buffVectors.append(vector)
+        
+        return buff, self._stack(buffVectors)
+    # ----
+    
+    
+    def _stack(self, vectors):
+        """Make array of vectors."""
+        
+        if not vectors:
+            return numpy.zeros((0, self._length), dtype=numpy.int64)
+        
+        return numpy.array(vectors)
+    # ----
+    
+
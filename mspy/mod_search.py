@@ -0,0 +1,618 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import math
+import time
+import collections
+import multiprocessing
+import numpy
+
+# load stopper
+from mod_stopper import CHECK_FORCE_QUIT
+
+# load objects
+import obj_peaklist
+
+# load modules
+import mod_basics
+import mod_proteo
+import mod_database
+
+# load parsers
+import parser_mgf
+
+
+# LOCAL PMF SEARCH
+# ----------------
+
+class pmfsearch():
+    """Local peptide mass fingerprint search against digest index.
+        Proteins are scored by probability of getting observed number of matched
+        peaks by chance, given the number of their peptides and density of
+        database peptides around each peak. Hits are stored in the same format
+        as made by mspy.mascot.parse.
+        index: (mspy.digestindex or str) digest index or its path
+    """
+    
+    def __init__(self, index):
+        
+        # load index
+        if not isinstance(index, mod_database.digestindex):
+            index = mod_database.digestindex(index)
+        self.index = index
+        
+        # count peptides of each protein
+        self._counts = numpy.bincount(index.data['protein'], minlength=len(index.proteins))
+        
+        self.queries = []
+        self.hits = {}
+    # ----
+    
+    
+    def search(self, peaklist, charge=1, tolerance=0.1, tolUnits='Da', maxHits=20, processes=None):
+        """Search peaklist against digest index.
+            peaklist: (mspy.peaklist or list of mspy.peak) peaks to search
+            charge: (int) charge used for peaks without charge
+            tolerance: (float) mass tolerance
+            tolUnits: ('Da', 'ppm') tolerance units
+            maxHits: (int) max number of reported hits
+            processes: (int or None) number of worker processes for scoring
+        """
+        
+        self.queries = []
+        self.hits = {}
+        
+        # check peaklist
+        if not isinstance(peaklist, obj_peaklist.peaklist):
+            peaklist = obj_peaklist.peaklist(peaklist)
+        
+        # get queries and matched peptides
+        matches = []
+        densities = []
+        for peak in peaklist:
+            
+            CHECK_FORCE_QUIT()
+            
+            # skip isotopes
+            if peak.isotope not in (None, 0):
+                continue
+            
+            # get peptides within tolerance
+            peakCharge = peak.charge or charge
+            indices = self.index.search(peak.mz, peakCharge, tolerance, tolUnits)
+            
+            self.queries.append((peak.mz, peakCharge))
+            matches.append(indices)
+            densities.append(len(indices) / float(max(1, len(self.index))))
+        
+        # check matches
+        if not self.queries:
+            return False
+        
+        # get matched queries of proteins
+        proteins = {}
+        for query, indices in enumerate(matches):
+            for i, protein in zip(indices.tolist(), self.index.data['protein'][indices].tolist()):
+                if not protein in proteins:
+                    proteins[protein] = {}
+                if not query in proteins[protein]:
+                    proteins[protein][query] = []
+                proteins[protein][query].append(i)
+        
+        if not proteins:
+            return True
+        
+        # score candidate proteins
+        candidates = sorted(proteins.keys())
+        items = [(self._counts[p], len(proteins[p])) for p in candidates]
+        probabilities = pmfprobabilities(items, densities, processes)
+        
+        # get best hits
+        scores = []
+        for x, protein in enumerate(candidates):
+            scores.append((probabilities[x], -len(proteins[protein]), protein))
+        scores.sort()
+        
+        # make hits
+        count = len(self.index.proteins)
+        threshold = 10 * math.log10(count / 0.05)
+        for number, (probability, matched, protein) in enumerate(scores[:maxHits]):
+            self.hits[number+1] = self._makeHit(protein, proteins[protein], probability, threshold)
+        
+        return True
+    # ----
+    
+    
+    def _makeHit(self, protein, queries, probability, threshold):
+        """Make hit record of protein in Mascot-like format."""
+        
+        sequence = self.index.protein(protein)
+        offset, accession = self.index.proteins[protein]
+        
+        # make peptides
+        peptides = []
+        ranges = []
+        for query in sorted(queries):
+            mz, charge = self.queries[query]
+            expMass = mod_basics.mz(mz, 0, currentCharge=charge, massType=self.index.massType)
+            for i in queries[query]:
+                peptide = self.index.peptide(i)
+                start, stop = peptide.history[-1][1:3]
+                ranges.append((start, stop))
+                calcMass = self.index.masses[i]
+                
+                before = '-'
+                if start > 0:
+                    before = sequence.chain[start-1]
+                after = '-'
+                if stop < len(sequence):
+                    after = sequence.chain[stop]
+                
+                peptides.append({
+                    'query': str(query+1),
+                    'rank': '1',
+                    'isbold': '1',
+                    'pep_exp_mz': '%.4f' % mz,
+                    'pep_exp_mr': '%.4f' % expMass,
+                    'pep_exp_z': str(charge),
+                    'pep_calc_mr': '%.4f' % calcMass,
+                    'pep_delta': '%.4f' % (expMass - calcMass),
+                    'pep_start': str(start+1),
+                    'pep_end': str(stop),
+                    'pep_miss': str(peptide.miscleavages),
+                    'pep_seq': ''.join(peptide.chain),
+                    'pep_res_before': before,
+                    'pep_res_after': after,
+                    'pep_var_mod': self._formatVariant(int(self.index.data[i]['variant'])),
+                })
+        
+        # make protein
+        score = -10 * math.log10(max(probability, 1e-300))
+        protein = {
+            'prot_accession': accession,
+            'prot_desc': sequence.title,
+            'prot_score': '%.0f' % score,
+            'prot_thresh': '%.0f' % threshold,
+            'prot_expect': '%.2g' % (probability * len(self.index.proteins)),
+            'prot_mass': '%.0f' % sequence.mass(self.index.massType),
+            'prot_matches': str(len(queries)),
+            'prot_cover': '%.1f' % mod_proteo.coverage(ranges, len(sequence), human=False),
+            'prot_len': str(len(sequence)),
+            'prot_seq': ''.join(sequence.chain),
+            'peptides': peptides,
+        }
+        
+        return {accession: protein}
+    # ----
+    
+    
+    def _formatVariant(self, variant):
+        """Format variable modifications of peptide."""
+        
+        mods = {}
+        for name, position in self.index.variants[variant]:
+            key = name
+            if position:
+                key = '%s (%s)' % (name, position)
+            mods[key] = mods.get(key, 0) + 1
+        
+        buff = []
+        for key in sorted(mods):
+            if mods[key] > 1:
+                buff.append('%d %s' % (mods[key], key))
+            else:
+                buff.append(key)
+        
+        return '; '.join(buff)
+    # ----
+
+
+
+
+def pmfprobabilities(items, densities, processes=None):
+    """Calculate probabilities of random protein matches.
+        Number of random matches is approximated by Poisson distribution with
+        expected value summed over all queries.
+        items: (list) candidate proteins as (peptides count, matched queries count)
+        densities: (list) probability of random peptide matching each query
+        processes: (int or None) number of worker processes for large batches
+    """
+    
+    # score in current process
+    if not processes or processes < 2 or len(items) <= processes*100:
+        return _pmfprobabilities(items, densities)
+    
+    # split items into chunks
+    chunks = []
+    size = max(1, int(math.ceil(len(items) / (processes*4.))))
+    for x in range(0, len(items), size):
+        chunks.append(items[x:x+size])
+    
+    # score in worker processes
+    buff = []
+    pool = multiprocessing.Pool(processes, _pmfprobabilitiesInit, (densities,))
+    try:
+        results = pool.imap(_pmfprobabilitiesWorker, chunks)
+        while len(buff) < len(items):
+            try:
+                buff += results.next(0.1)
+            except multiprocessing.TimeoutError:
+                pass
+            CHECK_FORCE_QUIT()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    
+    return buff
+# ----
+
+
+def _pmfprobabilities(items, densities):
+    """Calculate probabilities of random protein matches for chunk of proteins."""
+    
+    densities = numpy.array(densities, dtype=numpy.float64)
+    
+    buff = []
+    for count, matched in items:
+        
+        CHECK_FORCE_QUIT()
+        
+        # get expected number of random matches
+        expected = numpy.sum(1. - numpy.exp(-count * densities))
+        
+        # get probability of matched queries or more
+        buff.append(_poissonTail(matched, expected))
+    
+    return buff
+# ----
+
+
+def _pmfprobabilitiesInit(densities):
+    """Set query densities within worker process."""
+    
+    global _pmfDensities
+    _pmfDensities = densities
+# ----
+
+
+def _pmfprobabilitiesWorker(items):
+    """Calculate probabilities for chunk of proteins within worker process."""
+    return _pmfprobabilities(items, _pmfDensities)
+# ----
+
+
+def _poissonTail(k, expected):
+    """Get Poisson probability of k or more events."""
+    
+    if k <= 0:
+        return 1.
+    if expected <= 0:
+        return 0.
+    
+    # sum head for common events
+    if k <= expected:
+        head = 0.
+        for j in range(k):
+            head += math.exp(-expected + j*math.log(expected) - math.lgamma(j+1))
+        return max(0., 1. - head)
+    
+    # sum tail for rare events
+    tail = 0.
+    j = k
+    while True:
+        term = math.exp(-expected + j*math.log(expected) - math.lgamma(j+1))
+        tail += term
+        if term < tail * 1e-12 or j > k + 1000:
+            break
+        j += 1
+    
+    return min(1., tail)
+# ----
+
+
+
+
+
+# BATCH MS/MS SEARCH
+# ------------------
+
+class msmssearch():
+    """Batch MS/MS peptide identification against digest index.
+        Candidate peptides are selected by precursor mass and scored by
+        probability of matching their fragment ladders to spectrum peaks by
+        chance. Spectra are processed in worker processes.
+        index: (mspy.digestindex or str) digest index or its path
+        series: (list) list of fragment serie names - must be defined in mspy.fragments
+        losses: (list) list of neutral losses
+        defined: (bool) use monomer-defined neutral losses
+        limit: (int) max length of loss combination
+        precursorTolerance: (float) precursor mass tolerance
+        precursorUnits: ('Da', 'ppm') precursor tolerance units
+        fragmentTolerance: (float) fragment m/z tolerance
+        fragmentUnits: ('Da', 'ppm') fragment tolerance units
+        charges: (list of int) precursor charges used for spectra without charge
+        maxPeaks: (int or None) number of most intense peaks used per spectrum
+    """
+    
+    columns = ('scanNumber', 'title', 'precursorMZ', 'charge', 'peptide', 'accession', 'start', 'stop', 'miscleavages', 'calcMass', 'error', 'matched', 'fragments', 'score', 'expect', 'candidates', 'time')
+    
+    def __init__(self, index, series=['b', 'y'], losses=[], defined=False, limit=1, precursorTolerance=10., precursorUnits='ppm', fragmentTolerance=0.5, fragmentUnits='Da', charges=[2, 3], maxPeaks=None):
+        
+        # load index
+        if not isinstance(index, mod_database.digestindex):
+            index = mod_database.digestindex(index)
+        self.index = index
+        
+        self.params = {
+            'series': list(series),
+            'losses': list(losses),
+            'defined': defined,
+            'limit': limit,
+            'precursorTolerance': precursorTolerance,
+            'precursorUnits': precursorUnits,
+            'fragmentTolerance': fragmentTolerance,
+            'fragmentUnits': fragmentUnits,
+            'charges': list(charges),
+            'maxPeaks': maxPeaks,
+        }
+        
+        self.psms = []
+        self.stats = {}
+    # ----
+    
+    
+    def search(self, scans, processes=None, chunkSize=20):
+        """Identify peptides of all MS/MS scans.
+            scans: (str or iterable of mspy.scan) MGF file path or scans
+            processes: (int or None) number of worker processes
+            chunkSize: (int) number of spectra sent to worker at once
+        """
+        
+        self.psms = []
+        self.stats = {}
+        
+        startTime = time.time()
+        
+        # stream scans from MGF
+        if isinstance(scans, basestring):
+            scans = parser_mgf.parseMGF(scans).iterscans(dataType='peaklist')
+        
+        # get spectra chunks
+        def chunks():
+            chunk = []
+            for scan in scans:
+                chunk.append(_msmsSpectrum(scan))
+                if len(chunk) == chunkSize:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        
+        # search in current process
+        if not processes or processes < 2:
+            for chunk in chunks():
+                self.psms += _msmssearch(self.index, chunk, self.params)
+        
+        # search in worker processes
+        else:
+            pending = collections.deque()
+            pool = multiprocessing.Pool(processes, _msmssearchInit, (self.index.path, self.params))
+            try:
+                for chunk in chunks():
+                    pending.append(pool.apply_async(_msmssearchWorker, (chunk,)))
+                    while len(pending) >= processes*2:
+                        self.psms += mod_database._waitResult(pending.popleft())
+                while pending:
+                    self.psms += mod_database._waitResult(pending.popleft())
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        
+        # make statistics
+        totalTime = time.time() - startTime
+        times = [psm['time'] for psm in self.psms]
+        self.stats = {
+            'spectra': len(self.psms),
+            'identified': len([psm for psm in self.psms if psm['peptide']]),
+            'candidates': sum([psm['candidates'] for psm in self.psms]),
+            'totalTime': totalTime,
+            'spectraPerSecond': len(self.psms) / max(totalTime, 1e-9),
+            'meanSpectrumTime': sum(times) / max(1, len(times)),
+            'maxSpectrumTime': max(times or [0.]),
+        }
+        
+        return True
+    # ----
+    
+    
+    def table(self, threshold=None):
+        """Get PSM table as tab-separated text.
+            threshold: (float or None) max expect value of reported PSMs
+        """
+        
+        buff = '\t'.join(self.columns) + '\n'
+        for psm in self.psms:
+            if threshold != None and (not psm['peptide'] or psm['expect'] > threshold):
+                continue
+            buff += '\t'.join([str(psm[column]) for column in self.columns]) + '\n'
+        
+        return buff
+    # ----
+    
+    
+    def save(self, path, threshold=None):
+        """Save PSM table as tab-separated file.
+            path: (str) file path
+            threshold: (float or None) max expect value of reported PSMs
+        """
+        
+        try:
+            save = file(path, 'w')
+            save.write(self.table(threshold))
+            save.close()
+            return True
+        except IOError:
+            return False
+    # ----
+
+
+
+
+def _msmsSpectrum(scan):
+    """Get picklable spectrum data from scan."""
+    
+    if scan.peaklist:
+        peaks = numpy.array([[p.mz, p.intensity] for p in scan.peaklist], dtype=numpy.float64)
+    else:
+        peaks = numpy.zeros((0, 2), dtype=numpy.float64)
+    
+    return (scan.scanNumber, scan.title, scan.precursorMZ, scan.precursorCharge, peaks)
+# ----
+
+
+def _msmssearch(index, spectra, params):
+    """Identify peptides for chunk of spectra."""
+    
+    buff = []
+    for scanNumber, title, precursorMZ, precursorCharge, peaks in spectra:
+        
+        CHECK_FORCE_QUIT()
+        
+        startTime = time.time()
+        
+        psm = {
+            'scanNumber': scanNumber,
+            'title': title,
+            'precursorMZ': precursorMZ,
+            'charge': precursorCharge,
+            'peptide': '',
+            'accession': '',
+            'start': None,
+            'stop': None,
+            'miscleavages': None,
+            'calcMass': None,
+            'error': None,
+            'matched': 0,
+            'fragments': 0,
+            'score': 0.,
+            'expect': None,
+            'candidates': 0,
+            'time': 0.,
+        }
+        
+        # use most intense peaks
+        if params['maxPeaks'] and len(peaks) > params['maxPeaks']:
+            peaks = peaks[numpy.argsort(peaks[:,1])[-params['maxPeaks']:]]
+        peakMZs = numpy.sort(peaks[:,0])
+        
+        # check spectrum
+        if precursorMZ == None or not len(peakMZs):
+            psm['time'] = time.time() - startTime
+            buff.append(psm)
+            continue
+        
+        # get probability of random peak match
+        if params['fragmentUnits'] == 'ppm':
+            width = 2 * numpy.sum(peakMZs * params['fragmentTolerance'] / 1000000)
+        else:
+            width = 2 * params['fragmentTolerance'] * len(peakMZs)
+        density = min(1., width / max(1., peakMZs[-1] - peakMZs[0]))
+        
+        # get candidates for each charge
+        charges = params['charges']
+        if precursorCharge:
+            charges = [precursorCharge]
+        
+        best = None
+        scores = []
+        for charge in charges:
+            candidates = index.search(precursorMZ, charge, params['precursorTolerance'], params['precursorUnits'])
+            psm['candidates'] += len(candidates)
+            
+            # score candidates using positioned variable modifications
+            for i in candidates.tolist():
+                candidate = None
+                for peptide in index.positioned(i):
+                    ladder = mod_proteo.fragmentladder(peptide, params['series'], params['losses'], params['defined'], params['limit'])
+                    
+                    # match fragments of all charges below precursor charge
+                    matched = numpy.zeros(len(ladder), dtype=bool)
+                    for fragCharge in range(1, max(2, abs(charge))):
+                        mzs = ladder.mz(fragCharge*cmp(charge, 0), massType=index.massType)
+                        if params['fragmentUnits'] == 'ppm':
+                            tolerances = mzs * params['fragmentTolerance'] / 1000000
+                        else:
+                            tolerances = params['fragmentTolerance']
+                        lo = numpy.searchsorted(peakMZs, mzs - tolerances, side='left')
+                        hi = numpy.searchsorted(peakMZs, mzs + tolerances, side='right')
+                        matched |= (hi > lo)
+                    
+                    # get probability of random matches
+                    count = int(numpy.sum(matched))
+                    probability = _poissonTail(count, len(ladder) * density)
+                    if candidate == None or probability < candidate[0]:
+                        candidate = (probability, i, charge, count, len(ladder), peptide)
+                
+                # keep best variant of candidate
+                if candidate:
+                    scores.append(candidate[0])
+                    if best == None or candidate[0] < best[0]:
+                        best = candidate
+        
+        # store best match
+        if best:
+            probability, i, charge, count, fragments, peptide = best
+            calcMass = float(index.masses[i])
+            expMass = mod_basics.mz(precursorMZ, 0, currentCharge=charge, massType=index.massType)
+            psm['charge'] = charge
+            psm['peptide'] = peptide.format('S [m]')
+            psm['accession'] = index.proteins[int(index.data[i]['protein'])][1]
+            psm['start'] = peptide.history[-1][1] + 1
+            psm['stop'] = peptide.history[-1][2]
+            psm['miscleavages'] = peptide.miscleavages
+            psm['calcMass'] = calcMass
+            psm['error'] = mod_basics.delta(expMass, calcMass, 'ppm')
+            psm['matched'] = count
+            psm['fragments'] = fragments
+            psm['score'] = -10 * math.log10(max(probability, 1e-300))
+            psm['expect'] = probability * len(scores)
+        
+        psm['time'] = time.time() - startTime
+        buff.append(psm)
+    
+    return buff
+# ----
+
+
+def _msmssearchInit(path, params):
+    """Open digest index within worker process."""
+    
+    global _msmsIndex, _msmsParams
+    _msmsIndex = mod_database.digestindex(path)
+    _msmsParams = params
+# ----
+
+
+def _msmssearchWorker(spectra):
+    """Identify peptides for chunk of spectra within worker process."""
+    return _msmssearch(_msmsIndex, spectra, _msmsParams)
+# ----
+
+
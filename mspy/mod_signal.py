@@ -284,11 +284,12 @@ def noise(signal, minX=None, maxX=None, x=None, window=0.1):
 # ----
 
 
-def baseline(signal, window=0.1, offset=0.):
+def baseline(signal, window=0.1, offset=0., rolling=None):
     """Return baseline data.
         signal (numpy array) - signal data points
         window (float or None) - noise calculation window (%/100)
         offset (float) - baseline offset, relative to noise width (in %/100)
+        rolling (bool or None) - use single-pass rolling median instead of separate noise calculation for each window, None for automatic choice
     """
     
     # check signal type
@@ -317,24 +318,39 @@ def baseline(signal, window=0.1, offset=0.):
     raster.append(minimum)
     raster.sort()
     
-    # calc baseline data
-    levels = []
-    widths = []
-    for i, x in enumerate(raster):
-        i1 = locate(signal, x-x*window)
-        i2 = locate(signal, x+x*window)
-        if i1 == i2:
-            noiseLevel = signal[i1][1]
-            noiseWidth = 0.0
-        else:
-            noiseLevel, noiseWidth = noise(signal[i1:i2])
-        levels.append([x, noiseLevel])
-        widths.append([x, noiseWidth])
+    # use rolling median if windows overlap heavily
+    if rolling == None:
+        i1 = numpy.searchsorted(signal[:,0], [x-x*window for x in raster], 'right')
+        i2 = numpy.searchsorted(signal[:,0], [x+x*window for x in raster], 'right')
+        rolling = (i2-i1).sum() > 8 * (i2.max()-i1.min())
+    
+    # calc baseline data using rolling median
+    if rolling:
+        data = calculations.signal_noise_raster(signal, numpy.array(raster), float(window))
+        levels = data[:,0:2].copy()
+        widths = data[:,0::2].copy()
+    
+    # calc baseline data for each window separately
+    else:
+        levels = []
+        widths = []
+        for i, x in enumerate(raster):
+            i1 = locate(signal, x-x*window)
+            i2 = locate(signal, x+x*window)
+            if i1 == i2:
+                noiseLevel = signal[i1][1]
+                noiseWidth = 0.0
+            else:
+                noiseLevel, noiseWidth = noise(signal[i1:i2])
+            levels.append([x, noiseLevel])
+            widths.append([x, noiseWidth])
+        levels = numpy.array(levels)
+        widths = numpy.array(widths)
     
     # smooth baseline data
     swindow = 5 * window * (signal[-1][0] - signal[0][0])
-    levels = smooth(numpy.array(levels), 'GA', swindow, 2)
-    widths = smooth(numpy.array(widths), 'GA', swindow, 2)
+    levels = smooth(levels, 'GA', swindow, 2)
+    widths = smooth(widths, 'GA', swindow, 2)
     
     # make baseline and apply offset
     buff = []
@@ -543,23 +559,22 @@ def savgol(signal, window, cycles=1, order=3):
     window = len(m)
     halfWindow = (window-1) // 2
     
-    # precompute the offset values for better performance
-    offsets = range(-halfWindow, halfWindow+1)
-    offsetData = zip(offsets, m)
+    # reverse coeficients for convolution
+    kernel = m[::-1]
+    chunk = 65536
     
-    # smooth the data
+    # smooth the data in chunks
     while cycles:
-        smoothData = list()
         
         yAxis = numpy.concatenate((numpy.zeros(halfWindow)+yAxis[0], yAxis, numpy.zeros(halfWindow)+yAxis[-1]))
-        for i in range(halfWindow, len(yAxis) - halfWindow):
+        length = len(yAxis) - 2*halfWindow
+        smoothData = numpy.zeros(length)
+        for i in range(0, length, chunk):
             
             CHECK_FORCE_QUIT()
             
-            value = 0.0
-            for offset, weight in offsetData:
-                value += weight * yAxis[i + offset]
-            smoothData.append(value)
+            stop = min(i+chunk, length)
+            smoothData[i:stop] = numpy.convolve(yAxis[i:stop+window-1], kernel, mode='valid')
         
         yAxis = smoothData
         cycles -=1
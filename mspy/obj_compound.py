@@ -23,9 +23,43 @@ import blocks
 
 # load modules
 import mod_basics
+import mod_composition
 import mod_pattern
 
 
+# FORMULA CACHE
+# -------------
+
+# max number of stored formulae
+FORMULA_CACHE_SIZE = 100000
+
+# parsed formulae {expression: composition}
+_formulaCache = {}
+_formulaCacheRevision = None
+
+
+def clearformulacache():
+    """Remove all parsed formulae from cache."""
+    
+    global _formulaCacheRevision
+    
+    _formulaCache.clear()
+    _formulaCacheRevision = blocks.elements.revision
+# ----
+
+
+def _cachedComposition(expression):
+    """Get cached composition for expression or None if not parsed yet."""
+    
+    # clear cache if elements changed
+    if _formulaCacheRevision != blocks.elements.revision:
+        clearformulacache()
+    
+    return _formulaCache.get(expression, None)
+# ----
+
+
+
 # COMPOUND OBJECT DEFINITION
 # --------------------------
 
@@ -34,8 +68,6 @@ class compound:
     
     def __init__(self, expression, **attr):
         
-        # check formula
-        self._checkFormula(expression)
         self.expression = expression
         
         # buffers
@@ -44,6 +76,11 @@ class compound:
         self._mass = None
         self._nominalmass = None
         
+        # check and parse new formula
+        if _cachedComposition(expression) == None:
+            self._checkFormula(expression)
+            self.composition()
+        
         # get additional attributes
         self.attributes = {}
         for name, value in attr.items():
@@ -58,7 +95,8 @@ class compound:
         if isinstance(other, compound):
             self.expression += other.expression
         else:
-            self._checkFormula(other)
+            if _cachedComposition(other) == None:
+                self._checkFormula(other)
             self.expression += other
         
         # clear buffers
@@ -144,36 +182,25 @@ class compound:
         if self._composition != None:
             return self._composition
         
-        # unfold brackets
-        unfoldedFormula = self._unfoldBrackets(self.expression)
+        # check formula cache
+        cached = _cachedComposition(self.expression)
+        if cached != None:
+            self._composition = cached.copy()
+            return self._composition
         
-        # group elements
-        self._composition = {}
-        for symbol, isotop, count in mod_basics.ELEMENT_PATTERN.findall(unfoldedFormula):
-            
-            # make atom
-            if isotop:
-                atom = '%s{%s}' % (symbol, isotop)
-            else:
-                atom = symbol
-            
-            # convert counting
-            if count:
-                count = int(count)
-            else:
-                count = 1
-            
-            # add atom
-            if atom in self._composition:
-                self._composition[atom] += count
-            else:
-                self._composition[atom] = count
+        # parse formula
+        self._composition = self._parseFormula(self.expression)
         
         # remove zeros
         for atom in self._composition.keys():
             if self._composition[atom] == 0:
                 del self._composition[atom]
         
+        # store composition in formula cache
+        if len(_formulaCache) >= FORMULA_CACHE_SIZE:
+            _formulaCache.clear()
+        _formulaCache[self.expression] = self._composition.copy()
+        
         return self._composition
     # ----
     
@@ -183,31 +210,7 @@ class compound:
         
         # get mass
         if self._mass == None:
-            massMo = 0
-            massAv = 0
-            
-            # get composition
-            comp = self.composition()
-            
-            # get mass for each atom
-            for atom in comp:
-                count = comp[atom]
-                
-                # check specified isotope and mass
-                match = mod_basics.ELEMENT_PATTERN.match(atom)
-                symbol, massNumber, tmp = match.groups()
-                if massNumber:
-                    isotope = blocks.elements[symbol].isotopes[int(massNumber)]
-                    atomMass = (isotope[0], isotope[0])
-                else:
-                    atomMass = blocks.elements[symbol].mass
-                
-                # multiply atom mass
-                massMo += atomMass[0]*count
-                massAv += atomMass[1]*count
-            
-            # store mass in buffer
-            self._mass = (massMo, massAv)
+            self._mass = mod_composition.registry().mass(self.composition())
         
         # return mass
         if massType == 0:
@@ -224,30 +227,7 @@ class compound:
         
         # get mass
         if self._nominalmass == None:
-            
-            nominalmass = 0
-            
-            # get composition
-            comp = self.composition()
-            
-            # get mass for each atom
-            for atom in comp:
-                count = comp[atom]
-                
-                # check specified isotope and mass
-                match = mod_basics.ELEMENT_PATTERN.match(atom)
-                symbol, massNumber, tmp = match.groups()
-                if massNumber:
-                    isotope = blocks.elements[symbol].isotopes[int(massNumber)]
-                    atomMass = isotope[0]
-                else:
-                    atomMass = blocks.elements[symbol].mass[0]
-                
-                # multiply atom mass
-                nominalmass += round(atomMass)*count
-            
-            # store mass in buffer
-            self._nominalmass = nominalmass
+            self._nominalmass = mod_composition.registry().nominalmass(self.composition())
         
         return self._nominalmass
     # ----
@@ -264,6 +244,13 @@ class compound:
     # ----
     
     
+    def vector(self, length=None):
+        """Get composition vector."""
+        
+        return mod_composition.registry().vector(self.composition(), length)
+    # ----
+    
+    
     def pattern(self, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True):
         """Get isotopic pattern."""
         
@@ -364,53 +351,66 @@ class compound:
         # check brackets
         if formula.count(')') != formula.count('('):
             raise ValueError, 'Wrong number of brackets in formula! --> ' + formula
+        
+        # check brackets order
+        opened = 0
+        for char in formula:
+            if char == '(':
+                opened += 1
+            elif char == ')':
+                opened -= 1
+                if opened < 0:
+                    raise ValueError, 'Wrong order of brackets in formula! --> ' + formula
     # ----
     
     
-    def _unfoldBrackets(self, string):
-        """Unfold formula and count each atom."""
+    def _parseFormula(self, formula):
+        """Parse formula and count each atom."""
         
-        unfoldedFormula = ''
-        brackets = [0,0]
-        enclosedFormula = ''
+        # init stack of bracket groups
+        stack = [{}]
         
-        i = 0
-        while i < len(string):
+        for symbol, isotope, count, opening, closing in mod_basics.FORMULA_TOKENS_PATTERN.findall(formula):
             
-            # handle brackets
-            if string[i] == '(':
-                brackets[0] += 1
-            elif string[i] == ')':
-                brackets[1] += 1
+            # start new group
+            if opening:
+                stack.append({})
+                continue
             
-            # part outside brackets
-            if brackets == [0,0]:
-                unfoldedFormula += string[i]
-            
-            # part within brackets
-            else:
-                enclosedFormula += string[i]
+            # add atom to current group
+            if symbol:
+                
+                # make atom
+                if isotope:
+                    atom = '%s{%d}' % (symbol, int(isotope))
+                else:
+                    atom = symbol
+                
+                # convert counting
+                if count:
+                    count = int(count)
+                else:
+                    count = 1
                 
-                # unfold part within brackets
-                if brackets[0] == brackets[1]:
-                    enclosedFormula = self._unfoldBrackets(enclosedFormula[1:-1])
-                    
-                    # multiply part within brackets
-                    count = ''
-                    while len(string)>(i+1) and string[i+1].isdigit():
-                        count += string[i+1]
-                        i += 1
-                    if count:
-                        enclosedFormula = enclosedFormula * int(count)
-                    
-                    # add and clear
-                    unfoldedFormula += enclosedFormula
-                    enclosedFormula = ''
-                    brackets = [0,0]
+                group = {atom: count}
             
-            i += 1
+            # close current group and multiply its atoms
+            else:
+                group = stack.pop()
+                if closing:
+                    count = int(closing)
+                    for atom in group:
+                        group[atom] *= count
             
-        return unfoldedFormula
+            # add atoms to parent group
+            parent = stack[-1]
+            for atom, count in group.items():
+                if atom in parent:
+                    parent[atom] += count
+                else:
+                    parent[atom] = count
+        
+        return stack[0]
     # ----
     
     
@@ -339,12 +339,13 @@ class peaklist:
     # ----
     
     
-    def deisotope(self, maxCharge=1, mzTolerance=0.15, intTolerance=0.5, isotopeShift=0.0):
+    def deisotope(self, maxCharge=1, mzTolerance=0.15, intTolerance=0.5, isotopeShift=0.0, composition=mod_peakpicking.AVERAGE_AMINO):
         """Calculate peak charges and find isotopes.
             maxCharge (float) - max charge to be searched
             mzTolerance (float) - absolute m/z tolerance for isotopes distance
             intTolerance (float) - relative intensity tolerance for isotopes and model (in %/100)
             isotopeShift (float) - isotope distance correction (neutral mass) (for HDX etc.)
+            composition (dict) - averagine building block composition
         """
         
         # check peaklist
@@ -357,7 +358,8 @@ class peaklist:
             maxCharge = maxCharge,
             mzTolerance = mzTolerance,
             intTolerance = intTolerance,
-            isotopeShift = isotopeShift
+            isotopeShift = isotopeShift,
+            composition = composition
         )
     # ----
     
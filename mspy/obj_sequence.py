@@ -18,6 +18,7 @@
 #load libs
 import re
 import copy
+import numpy
 
 # load stopper
 from mod_stopper import CHECK_FORCE_QUIT
@@ -30,6 +31,7 @@ import obj_compound
 
 # load modules
 import mod_basics
+import mod_composition
 import mod_pattern
 
 
@@ -99,6 +101,7 @@ class sequence:
         self._formula = None
         self._composition = None
         self._mass = None
+        self._searchIndexes = {}
         
         # get additional attributes
         self.attributes = {}
@@ -131,81 +134,60 @@ class sequence:
         if stop <= start and not self.cyclic:
             raise ValueError, 'Invalid slice!'
         
-        # break the links
-        parent = copy.deepcopy(self)
-        
         # check slice
+        length = len(self.chain)
         start = max(start, 0)
-        stop = min(stop, len(parent))
+        stop = min(stop, length)
         
-        # make new sequence object
+        # make new sequence object sharing validated monomers
+        peptide = sequence([], chainType=self.chainType, cyclic=False)
         if start < stop:
-            seq = parent.chain[start:stop]
-            peptide = sequence(seq, chainType=parent.chainType, cyclic=False)
+            peptide.chain = self.chain[start:stop]
         elif self.cyclic:
-            seq = parent.chain[start:] + parent.chain[:stop]
-            peptide = sequence(seq, chainType=parent.chainType, cyclic=False)
+            peptide.chain = self.chain[start:] + self.chain[:stop]
         
         # add previous history
-        peptide.history = parent.history
+        peptide.history = self.history[:]
         
         # add modifications
-        for mod in parent.modifications:
-            if mod[1] == 'nTerm' and start == 0:
-                peptide.modifications.append(mod)
-            elif mod[1] == 'cTerm' and (stop == -1 or stop == len(parent)):
-                peptide.modifications.append(mod)
-            elif type(mod[1]) in (str, unicode) and mod[1] in peptide.chain:
-                peptide.modifications.append(mod)
-            elif type(mod[1]) == int:
-                if start <= mod[1] < stop:
-                    mod[1] -= start
-                    peptide.modifications.append(mod)
-                elif start >= stop and mod[1] >= start:
-                    mod[1] -= start
-                    peptide.modifications.append(mod)
-                elif start >= stop and mod[1] < stop:
-                    mod[1] += len(parent) - start
-                    peptide.modifications.append(mod)
+        for mod in self.modifications:
+            if mod[1] == 'nTerm':
+                if start == 0:
+                    peptide.modifications.append(mod[:])
+            elif mod[1] == 'cTerm':
+                if stop == -1 or stop == length:
+                    peptide.modifications.append(mod[:])
+            else:
+                position = self._slicePosition(mod[1], start, stop, length, peptide.chain)
+                if position != None:
+                    peptide.modifications.append([mod[0], position, mod[2]])
         
         # add labels
-        for mod in parent.labels:
-            if type(mod[1]) in (str, unicode) and mod[1] in peptide.chain:
-                peptide.labels.append(mod)
-            elif type(mod[1]) == int:
-                if start <= mod[1] < stop:
-                    mod[1] -= start
-                    peptide.labels.append(mod)
-                elif start >= stop and mod[1] >= start:
-                    mod[1] -= start
-                    peptide.labels.append(mod)
-                elif start >= stop and mod[1] < stop:
-                    mod[1] += len(parent) - start
-                    peptide.labels.append(mod)
+        for mod in self.labels:
+            position = self._slicePosition(mod[1], start, stop, length, peptide.chain)
+            if position != None:
+                peptide.labels.append([mod[0], position, mod[2]])
         
         # add terminal modifications
         if start == 0:
-            peptide.nTermFormula = parent.nTermFormula
-        if stop >= len(parent):
-            peptide.cTermFormula = parent.cTermFormula
-        if parent.cyclic:
+            peptide.nTermFormula = self.nTermFormula
+        if stop >= length:
+            peptide.cTermFormula = self.cTermFormula
+        if self.cyclic:
             peptide.nTermFormula = 'H'
             peptide.cTermFormula = 'OH'
         
         # set adjacent monomers
-        if start > 0 or parent.cyclic:
-            peptide.itemBefore = parent.chain[start-1]
-        if stop < len(parent):
-            peptide.itemAfter = parent.chain[stop]
-        if stop == len(parent) and parent.cyclic:
-            peptide.itemAfter = parent.chain[0]
+        if start > 0 or self.cyclic:
+            peptide.itemBefore = self.chain[start-1]
+        if stop < length:
+            peptide.itemAfter = self.chain[stop]
+        if stop == length and self.cyclic:
+            peptide.itemAfter = self.chain[0]
         
         # add event to history
         peptide.history.append(('slice', start, stop))
         
-        # ensure buffers are cleaned
-        peptide.reset()
-        
         return peptide
     # ----
     
@@ -231,6 +213,7 @@ class sequence:
         self._formula = None
         self._mass = None
         self._composition = None
+        self._searchIndexes = {}
     # ----
     
     
@@ -336,7 +319,18 @@ class sequence:
     def duplicate(self):
         """Return copy of current sequence."""
         
-        dupl = copy.deepcopy(self)
+        # copy values
+        dupl = copy.copy(self)
+        
+        # break the links of mutable values
+        dupl.chain = self.chain[:]
+        dupl.modifications = [mod[:] for mod in self.modifications]
+        dupl.labels = [mod[:] for mod in self.labels]
+        dupl.history = self.history[:]
+        dupl.fragmentLosses = self.fragmentLosses[:]
+        dupl.fragmentGains = self.fragmentGains[:]
+        dupl.attributes = copy.deepcopy(self.attributes)
+        
         dupl.reset()
         
         return dupl
@@ -436,12 +430,19 @@ class sequence:
     # ----
     
     
+    def vector(self, length=None):
+        """Get composition vector."""
+        
+        return mod_composition.registry().vector(self.composition(), length)
+    # ----
+    
+    
     def mass(self, massType=None):
         """Get mass."""
         
         # get mass
         if self._mass == None:
-            self._mass = obj_compound.compound(self.formula()).mass()
+            self._mass = mod_composition.registry().mass(self.composition())
         
         # return mass
         if massType == 0:
@@ -565,75 +566,34 @@ class sequence:
         if self.cyclic:
             raise TypeError, 'Search function is not supported for cyclic peptides!'
         
-        matches = []
-        
-        # set terminal modifications
-        if enzyme:
-            enzyme = blocks.enzymes[enzyme]
-            expression = re.compile(enzyme.expression+'$')
-            nTerm = enzyme.nTermFormula
-            cTerm = enzyme.cTermFormula
-        else:
-            semiSpecific = False
-            nTerm = 'H'
-            cTerm = 'OH'
-        
-        # set mass limits
+        # get max neutral mass needed
         if tolUnits == 'ppm':
-            lowMass = mass - (tolerance * mass/1000000)
             highMass = mass + (tolerance * mass/1000000)
         else:
-            lowMass = mass - tolerance
             highMass = mass + tolerance
-        
-        # search sequence
-        length = len(self)
-        for i in range(length):
-            for j in range(i+1, length+1):
-                
-                CHECK_FORCE_QUIT()
-                
-                # get peptide
-                peptide = self[i:j]
-                if i != 0:
-                    peptide.nTerminalFormula = nTerm
-                if j != length:
-                    peptide.cTerminalFormula = cTerm
-                
-                # check enzyme specifity
-                if semiSpecific and peptide.itemBefore and peptide.itemAfter:
-                    if not expression.search(peptide.itemBefore+peptide.chain[0]) and not expression.search(peptide.chain[-1]+peptide.itemAfter):
-                        continue
-                
-                # variate modifications
-                variants = peptide.variations(maxMods=maxMods, position=position)
-                
-                # check mass limits
-                peptides = []
-                masses = []
-                for pep in variants:
-                    pepMZ = pep.mz(charge)[massType]
-                    peptides.append((pepMZ, pep))
-                    masses.append(pepMZ)
-                if max(masses) < lowMass:
-                    continue
-                elif min(masses) > highMass:
-                    break
-                
-                # search for matches
-                for pep in peptides:
-                    if lowMass <= pep[0] <= highMass:
-                        matches.append(pep[1])
-        
-        return matches
+        maxMass = mod_basics.mz(highMass, 0, currentCharge=charge, massType=massType) + 1.
+        
+        # get index for current settings, make bigger one if needed
+        key = (enzyme, semiSpecific, massType, maxMods, position)
+        index = self._searchIndexes.get(key, None)
+        if index == None or index.maxMass < maxMass:
+            if index != None:
+                maxMass = max(maxMass, 2*index.maxMass)
+            index = searchindex(self, enzyme, semiSpecific, massType, maxMods, position, maxMass)
+            self._searchIndexes[key] = index
+        
+        # search index
+        return index.search(mass, charge, tolerance, tolUnits)
     # ----
     
     
-    def variations(self, maxMods=1, position=True, enzyme=None):
+    def variations(self, maxMods=1, position=True, enzyme=None, massRange=None, massType=0):
         """Calculate all possible combinations of variable modifications.
             maxMods: (int) maximum modifications allowed per one residue
             position: (bool) retain modifications positions (much slower)
             enzyme: (str) enzyme name to ensure that modifications are not presented in cleavage site
+            massRange: (tuple) neutral mass range of returned peptides, None for all
+            massType: (0 or 1) mass type of mass range, 0 = monoisotopic, 1 = average
         """
         
         variablePeptides = []
@@ -665,9 +625,29 @@ class sequence:
         
         # make combinations of variable modifications
         variableMods = self._countUniqueModifications(variableMods)
-        combinations = []
-        for x in self._uniqueCombinations(variableMods):
-            combinations.append(x)
+        if not massRange:
+            combinations = self._uniqueCombinations(variableMods)
+        
+        # make combinations within mass range only, using modifications mass deltas
+        else:
+            fixedPeptide = self.duplicate()
+            fixedPeptide.modifications[:] = fixedMods
+            fixedMass = fixedPeptide.mass(massType)
+            
+            deltas = []
+            for mod in variableMods:
+                delta = blocks.modifications[mod[0][0]].mass[massType]
+                if not position and mod[0][1] in ('nTerm', 'cTerm'):
+                    deltas.append([delta] * mod[1])
+                else:
+                    deltas.append([delta * (mod[1]-j) for j in range(mod[1])])
+            
+            bounds = [[0., 0.]]
+            for delta in reversed(deltas):
+                bounds.insert(0, [bounds[0][0] + min(0., min(delta)), bounds[0][1] + max(0., max(delta))])
+            
+            combinations = self._rangedCombinations(variableMods, deltas, bounds, fixedMass, massRange[0]-1e-6, massRange[1]+1e-6)
+            combinations = [item[0] for item in combinations]
         
         # disable positions occupied by fixed modifications
         occupied = []
@@ -699,6 +679,7 @@ class sequence:
         
         # format modifications and filter same
         buff = []
+        have = set()
         for combination in combinations:
             mods = []
             for mod in combination:
@@ -709,8 +690,10 @@ class sequence:
                 else:
                     mods += [[mod[0][0],'','f']]*mod[1]
             mods.sort()
-            if not mods in buff:
+            modsHash = tuple([tuple(mod) for mod in mods])
+            if not modsHash in have:
                 buff.append(mods)
+                have.add(modsHash)
         combinations = buff
         
         # make new peptides
@@ -721,6 +704,10 @@ class sequence:
             variablePeptide = self.duplicate()
             variablePeptide.modifications[:] = fixedMods+combination
             
+            # check precise mass
+            if massRange and not (massRange[0] <= variablePeptide.mass(massType) <= massRange[1]):
+                continue
+            
             # check composition
             if variablePeptide.isvalid():
                 variablePeptides.append(variablePeptide)
@@ -970,6 +957,27 @@ class sequence:
     # ----
     
     
+    def _slicePosition(self, position, start, stop, length, chain):
+        """Get modification position within slice or None if outside."""
+        
+        # global modification
+        if type(position) in (str, unicode):
+            if position in chain:
+                return position
+        
+        # positioned modification
+        elif type(position) == int:
+            if start <= position < stop:
+                return position - start
+            elif start >= stop and position >= start:
+                return position - start
+            elif start >= stop and position < stop:
+                return position + length - start
+        
+        return None
+    # ----
+    
+    
     def _uniqueCombinations(self, items):
         """Generate unique combinations of items."""
         
@@ -981,6 +989,27 @@ class sequence:
     # ----
     
     
+    def _rangedCombinations(self, items, deltas, bounds, mass, lowMass, highMass, start=0):
+        """Generate unique combinations of items within mass range, skip branches which cannot reach it."""
+        
+        for i in range(start, len(items)):
+            
+            # remaining items cannot reach mass range
+            if mass + bounds[i][0] > highMass or mass + bounds[i][1] < lowMass:
+                break
+            
+            # combine with following items which can still reach mass range
+            for cc, ccMass in self._rangedCombinations(items, deltas, bounds, mass, lowMass - max(deltas[i]), highMass - min(deltas[i]), i+1):
+                for j in range(items[i][1]):
+                    current = ccMass + deltas[i][j]
+                    if lowMass <= current <= highMass:
+                        yield [[items[i][0],items[i][1]-j]] + cc, current
+        
+        if lowMass <= mass <= highMass:
+            yield [], mass
+    # ----
+    
+    
     def _countUniqueModifications(self, modifications):
         """Get list of unique modifications with counter."""
         
@@ -1023,5 +1052,228 @@ class sequence:
         return True
     # ----
     
+
+
+class searchindex:
+    """Sorted masses of sequence sub-sequences used for mass search.
+        Each sub-sequence is stored for every possible count of each variable
+        modification. Sub-sequences found within given mass range are checked
+        precisely by making their variations.
+        sequence: (sequence) mspy sequence object
+        enzyme: (str) enzyme used for peptides endings, if None H/OH is used
+        semiSpecific: (bool) semispecific cleavage is checked (enzyme must be set)
+        massType: (0 or 1) mass type, 0 = monoisotopic, 1 = average
+        maxMods: (int) maximum number of modifications at one residue
+        position: (bool) retain position for variable modifications (much slower)
+        maxMass: (float) max neutral mass of stored sub-sequences
+    """
+    
+    def __init__(self, sequence, enzyme=None, semiSpecific=True, massType=0, maxMods=1, position=False, maxMass=5000.):
+        
+        # check cyclic peptides
+        if sequence.cyclic:
+            raise TypeError, 'Search function is not supported for cyclic peptides!'
+        
+        self.sequence = sequence
+        self.enzyme = enzyme
+        self.semiSpecific = semiSpecific
+        self.massType = massType
+        self.maxMods = maxMods
+        self.position = position
+        self.maxMass = maxMass
+        
+        # set terminal formulae
+        if enzyme:
+            self._nTerm = blocks.enzymes[enzyme].nTermFormula
+            self._cTerm = blocks.enzymes[enzyme].cTermFormula
+        else:
+            self.semiSpecific = False
+            self._nTerm = 'H'
+            self._cTerm = 'OH'
+        
+        # sorted masses with sub-sequences indices
+        self.masses = None
+        self.starts = None
+        self.stops = None
+        self._mzs = {}
+        
+        self._makeIndex()
+    # ----
+    
+    
+    def __len__(self):
+        """Get number of stored masses."""
+        return len(self.masses)
+    # ----
+    
+    
+    def search(self, mass, charge, tolerance, tolUnits='Da'):
+        """Search sequence for specified ion.
+            mass: (float) m/z value to search for
+            charge: (int) charge of the m/z value
+            tolerance: (float) mass tolerance
+            tolUnits: ('Da', 'ppm') tolerance units
+        """
+        
+        # set mass limits
+        if tolUnits == 'ppm':
+            lowMass = mass - (tolerance * mass/1000000)
+            highMass = mass + (tolerance * mass/1000000)
+        else:
+            lowMass = mass - tolerance
+            highMass = mass + tolerance
+        
+        # get neutral mass range
+        massRange = (
+            mod_basics.mz(lowMass, 0, currentCharge=charge, massType=self.massType) - 1e-6,
+            mod_basics.mz(highMass, 0, currentCharge=charge, massType=self.massType) + 1e-6
+        )
+        
+        # check mass range
+        if massRange[1] > self.maxMass:
+            raise ValueError, 'Mass range is not covered by search index!'
+        
+        # get m/z values for current charge
+        if not charge in self._mzs:
+            self._mzs[charge] = mod_basics.mz(self.masses, charge, massType=self.massType)
+        mzs = self._mzs[charge]
+        
+        # get sub-sequences within mass range
+        lo = numpy.searchsorted(mzs, lowMass - 1e-6, side='left')
+        hi = numpy.searchsorted(mzs, highMass + 1e-6, side='right')
+        candidates = sorted(set(zip(self.starts[lo:hi].tolist(), self.stops[lo:hi].tolist())))
+        
+        # check variations of sub-sequences
+        matches = []
+        length = len(self.sequence)
+        for i, j in candidates:
+            
+            CHECK_FORCE_QUIT()
+            
+            # get peptide
+            peptide = self.sequence[i:j]
+            if i != 0:
+                peptide.nTermFormula = self._nTerm
+            if j != length:
+                peptide.cTermFormula = self._cTerm
+            
+            # search for matches
+            for pep in peptide.variations(maxMods=self.maxMods, position=self.position, massRange=massRange, massType=self.massType):
+                if lowMass <= pep.mz(charge)[self.massType] <= highMass:
+                    matches.append(pep)
+        
+        return matches
+    # ----
+    
+    
+    def _makeIndex(self):
+        """Make sorted masses of all sub-sequences."""
+        
+        sequence = self.sequence
+        chain = sequence.chain
+        length = len(chain)
+        
+        # get monomer masses with fixed modifications and labels
+        residues = numpy.array([blocks.monomers[m].mass[self.massType] for m in chain], dtype=numpy.float64)
+        nTermMass = obj_compound.compound(sequence.nTermFormula).mass(self.massType)
+        cTermMass = obj_compound.compound(sequence.cTermFormula).mass(self.massType)
+        
+        # get sites of modifications
+        variables = {}
+        mods = [mod + [False] for mod in sequence.modifications]
+        mods += [mod + [True] for mod in sequence.labels]
+        for name, position, state, label in mods:
+            delta = blocks.modifications[name].mass[self.massType]
+            
+            # get sites
+            sites = numpy.zeros(length+2, dtype=numpy.int64)
+            if position == 'nTerm':
+                sites[length] = 1
+            elif position == 'cTerm':
+                sites[length+1] = 1
+            elif type(position) == int:
+                sites[position] = 1
+            elif position:
+                for x, monomer in enumerate(chain):
+                    if monomer == position:
+                        sites[x] = 1
+            
+            # add fixed modifications and labels
+            if state == 'f' or label:
+                residues += sites[:length] * delta
+                nTermMass += sites[length] * delta
+                cTermMass += sites[length+1] * delta
+            
+            # store variable modifications by name
+            elif name in variables:
+                variables[name][1] += sites
+            else:
+                variables[name] = [delta, sites]
+        
+        # get cumulative masses and sites
+        prefixes = numpy.zeros(length+1, dtype=numpy.float64)
+        prefixes[1:] = numpy.cumsum(residues)
+        variables = [(delta, numpy.concatenate(([0], numpy.cumsum(sites[:length]))), sites[length], sites[length+1]) for delta, sites in variables.values()]
+        lightest = sum([min(0., delta) * (sites[-1] + nTerm + cTerm) for delta, sites, nTerm, cTerm in variables])
+        
+        # get cleavage sites
+        cleavage = numpy.zeros(length+1, dtype=bool)
+        if self.semiSpecific:
+            expression = re.compile(blocks.enzymes[self.enzyme].expression+'$')
+            for x in range(1, length):
+                cleavage[x] = bool(expression.search(chain[x-1]+chain[x]))
+        
+        # get terminal masses
+        enzymeNTermMass = obj_compound.compound(self._nTerm).mass(self.massType)
+        enzymeCTermMass = obj_compound.compound(self._cTerm).mass(self.massType)
+        
+        # get sub-sequences of all lengths
+        starts = []
+        stops = []
+        masses = []
+        for size in range(1, length+1):
+            
+            CHECK_FORCE_QUIT()
+            
+            # get sub-sequences masses
+            i = numpy.arange(0, length-size+1)
+            j = i + size
+            mass = prefixes[j] - prefixes[i]
+            mass += numpy.where(i == 0, nTermMass, enzymeNTermMass)
+            mass += numpy.where(j == length, cTermMass, enzymeCTermMass)
+            
+            # stop if all sub-sequences are too heavy
+            if (mass + lightest > self.maxMass).all():
+                break
+            
+            # check enzyme specifity
+            if self.semiSpecific:
+                keep = (i == 0) | (j == length) | cleavage[i] | cleavage[j]
+                i, j, mass = i[keep], j[keep], mass[keep]
+            
+            # add all counts of variable modifications
+            for delta, sites, nTerm, cTerm in variables:
+                counts = sites[j] - sites[i] + nTerm*(i == 0) + cTerm*(j == length)
+                repeats = counts + 1
+                offsets = numpy.repeat(numpy.cumsum(repeats) - repeats, repeats)
+                count = numpy.arange(repeats.sum()) - offsets
+                i, j = numpy.repeat(i, repeats), numpy.repeat(j, repeats)
+                mass = numpy.repeat(mass, repeats) + count * delta
+            
+            # remove too heavy sub-sequences
+            keep = mass + lightest <= self.maxMass
+            starts.append(i[keep])
+            stops.append(j[keep])
+            masses.append(mass[keep])
+        
+        # sort by masses
+        self.masses = numpy.concatenate(masses or [numpy.zeros(0)])
+        self.starts = numpy.concatenate(starts or [numpy.zeros(0, dtype=numpy.int64)])
+        self.stops = numpy.concatenate(stops or [numpy.zeros(0, dtype=numpy.int64)])
+        order = numpy.argsort(self.masses, kind='mergesort')
+        self.masses = self.masses[order]
+        self.starts = self.starts[order]
+        self.stops = self.stops[order]
+    # ----
     
 
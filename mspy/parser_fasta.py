@@ -41,6 +41,9 @@ class parseFASTA():
     
     def __init__(self, path):
         self.path = path
+        self.indexPath = path + '.idx'
+        self.skipped = []
+        self._index = None
         
         # check path
         if not os.path.exists(path):
@@ -51,74 +54,215 @@ class parseFASTA():
     def sequences(self):
         """Get sequences from document."""
         
-        # open document
+        data = []
+        
+        # read data
         try:
-            document = file(self.path)
-            rawData = document.readlines()
-            document.close()
+            for sequence in self.itersequences():
+                data.append(sequence)
         except IOError:
             return False
         
-        # read data
-        reading = False
-        data = []
-        for line in rawData:
-            line = line.strip()
-            
-            # discard comments and empty lines
-            if not line or line[0] == ';':
-                continue
-            
-            # new sequence started
-            if line[0] == '>':
+        return data
+    # ----
+    
+    
+    def itersequences(self):
+        """Generate sequences from document one by one. Titles of entries which
+        cannot be converted to sequence are stored in self.skipped."""
+        
+        self.skipped = []
+        
+        for title, accession, chain, offset in self.records():
+            try:
+                yield obj_sequence.sequence(chain, title=title, accession=accession)
+            except KeyError:
+                self.skipped.append(title)
+    # ----
+    
+    
+    def records(self):
+        """Generate raw records from document as (title, accession, chain, offset)
+        without making sequence objects. Offset is the byte position of the header."""
+        
+        # open document
+        document = file(self.path, 'rb')
+        
+        try:
+            title = None
+            offset = 0
+            position = 0
+            chain = []
+            while True:
+                line = document.readline()
+                if not line:
+                    break
+                lineOffset = position
+                position += len(line)
+                line = line.strip()
                 
-                # store previous sequence
-                if reading:
-                    try:
-                        sequence = obj_sequence.sequence(chain, title=title, accession=accession)
-                        data.append(sequence)
-                    except:
-                        pass
+                # discard comments and empty lines
+                if not line or line[0] == ';':
+                    continue
                 
-                # start new sequence
-                title = line[1:]
-                accession = ''
-                chain = ''
-                reading = True
+                # new sequence started
+                if line[0] == '>':
+                    
+                    # store previous sequence
+                    if title != None:
+                        yield self._makeRecord(title, chain, offset)
+                    
+                    # start new sequence
+                    title = line[1:]
+                    offset = lineOffset
+                    chain = []
                 
-                # get accession
-                if spPattern.match(title):
-                    match = spPattern.match(title)
-                    accession = match.group(1)
-                    title = match.group(2)
-                elif giPattern.match(title):
-                    match = giPattern.match(title)
-                    accession = match.group(1)
-                    title = match.group(2)
-                elif gbPattern.match(title):
-                    match = gbPattern.match(title)
-                    accession = match.group(1)
-                    title = match.group(2)
-                elif refPattern.match(title):
-                    match = refPattern.match(title)
-                    accession = match.group(1)
-                    title = match.group(2)
+                # get sequence chain
+                elif title != None:
+                    chain.append(line)
             
-            # get sequence chain
-            elif reading:
-                for char in ('\t','\n','\r','\f','\v',' ', '*'):
-                    line = line.replace(char, '')
-                chain += line.upper()
-        
-        # store last sequence
-        if reading:
-            try:
-                sequence = obj_sequence.sequence(chain, title=title, accession=accession)
-                data.append(sequence)
-            except:
-                pass
+            # store last sequence
+            if title != None:
+                yield self._makeRecord(title, chain, offset)
         
-        return data
+        finally:
+            document.close()
+    # ----
+    
+    
+    def sequence(self, accession):
+        """Get single sequence by accession using document index.
+            accession: (str) sequence accession or first word of title
+        """
+        
+        # get offset
+        index = self.index()
+        if not accession in index:
+            return None
+        
+        return self.sequenceat(index[accession])
+    # ----
+    
+    
+    def sequenceat(self, offset):
+        """Get single sequence starting at given byte offset.
+            offset: (int) byte position of sequence header
+        """
+        
+        # read record at offset
+        document = file(self.path, 'rb')
+        try:
+            document.seek(offset)
+            title = document.readline().strip()[1:]
+            chain = []
+            while True:
+                line = document.readline()
+                if not line or line[0] == '>':
+                    break
+                line = line.strip()
+                if line and line[0] != ';':
+                    chain.append(line)
+        finally:
+            document.close()
+        
+        # make sequence
+        title, accession, chain, offset = self._makeRecord(title, chain, offset)
+        return obj_sequence.sequence(chain, title=title, accession=accession)
+    # ----
+    
+    
+    def index(self):
+        """Get index of sequences offsets by accession. Index is loaded from the
+        index file or made and saved if the file is missing or outdated."""
+        
+        # use loaded index
+        if self._index != None:
+            return self._index
+        
+        # load index file
+        self._index = self._loadIndex()
+        if self._index != None:
+            return self._index
+        
+        # make index
+        self._index = {}
+        for title, accession, chain, offset in self.records():
+            key = accession or title.split(' ')[0]
+            if not key in self._index:
+                self._index[key] = offset
+        
+        # save index file
+        try:
+            self._saveIndex()
+        except IOError:
+            pass
+        
+        return self._index
+    # ----
+    
+    
+    def _makeRecord(self, title, chain, offset):
+        """Get accession and clean chain for raw record."""
+        
+        accession = ''
+        
+        # get accession
+        for pattern in (spPattern, giPattern, gbPattern, refPattern):
+            match = pattern.match(title)
+            if match:
+                accession = match.group(1)
+                title = match.group(2)
+                break
+        
+        # get sequence chain
+        chain = ''.join(chain)
+        for char in ('\t','\n','\r','\f','\v',' ', '*'):
+            chain = chain.replace(char, '')
+        chain = chain.upper()
+        
+        return title, accession, chain, offset
+    # ----
+    
+    
+    def _loadIndex(self):
+        """Load index from file, None if missing or outdated."""
+        
+        # check file
+        if not os.path.exists(self.indexPath):
+            return None
+        
+        try:
+            document = file(self.indexPath, 'rb')
+            lines = document.readlines()
+            document.close()
+        except IOError:
+            return None
+        
+        # check document size and time
+        stat = os.stat(self.path)
+        if not lines or lines[0].strip() != '#%d\t%d' % (stat.st_size, int(stat.st_mtime)):
+            return None
+        
+        # read offsets
+        index = {}
+        for line in lines[1:]:
+            key, offset = line.rstrip('\n').rsplit('\t', 1)
+            index[key] = int(offset)
+        
+        return index
+    # ----
+    
+    
+    def _saveIndex(self):
+        """Save index to file."""
+        
+        stat = os.stat(self.path)
+        
+        document = file(self.indexPath, 'wb')
+        document.write('#%d\t%d\n' % (stat.st_size, int(stat.st_mtime)))
+        for key, offset in sorted(self._index.items(), key=lambda x: x[1]):
+            document.write('%s\t%d\n' % (key, offset))
+        document.close()
     # ----
     
     
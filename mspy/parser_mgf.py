@@ -29,6 +29,11 @@ import obj_peaklist
 import obj_scan
 
 
+# compile basic patterns
+headerPattern = re.compile('^([A-Z]+)=(.+)')
+pointPattern = re.compile('[ \t]?')
+
+
 # PARSE MGF DATA
 # --------------
 
@@ -105,6 +110,49 @@ class parseMGF():
     # ----
     
     
+    def iterscans(self, dataType='peaklist'):
+        """Generate scans from document one by one without loading whole document.
+            dataType: ('peaklist', 'continuous' or None) scan data type, None for auto
+        """
+        
+        scanData = None
+        scanNumber = 0
+        
+        # open document
+        document = file(self.path)
+        
+        try:
+            for line in document:
+                line = line.strip()
+                
+                # discard comments
+                if not line or line[0] in ('#', ';', '!', '/'):
+                    continue
+                
+                # reserve default scan number for global parameters
+                if scanNumber == 0 and line != 'BEGIN IONS':
+                    scanNumber = 1
+                
+                # start new scan
+                if line == 'BEGIN IONS':
+                    scanData = self._makeScanData(scanNumber)
+                    scanNumber += 1
+                
+                # scan ended
+                elif line == 'END IONS':
+                    if scanData != None:
+                        yield self._makeScan(scanData, dataType)
+                    scanData = None
+                
+                # parse scan data, skip data outside scans
+                elif scanData != None:
+                    self._parseLine(line, scanData)
+        
+        finally:
+            document.close()
+    # ----
+    
+    
     def _parseData(self):
         """Parse data."""
         
@@ -120,8 +168,6 @@ class parseMGF():
         except IOError:
             return False
         
-        headerPattern = re.compile('^([A-Z]+)=(.+)')
-        pointPattern = re.compile('[ \t]?')
         currentID = None
         
         # parse each line
@@ -135,59 +181,15 @@ class parseMGF():
             # append default scan
             if currentID == None or line == 'BEGIN IONS':
                 currentID = len(self._scans)
-                scan = {
-                    'title': '',
-                    'scanNumber': currentID,
-                    'parentScanNumber': None,
-                    'msLevel': None,
-                    'pointsCount': 0,
-                    'polarity': None,
-                    'retentionTime': None,
-                    'lowMZ': None,
-                    'highMZ': None,
-                    'basePeakMZ': None,
-                    'basePeakIntensity': None,
-                    'totIonCurrent': None,
-                    'precursorMZ': None,
-                    'precursorIntensity': None,
-                    'precursorCharge': None,
-                    'spectrumType': 'unknown',
-                    'data': [],
-                }
-                self._scans[currentID] = scan
+                self._scans[currentID] = self._makeScanData(currentID)
             
             # scan ended, use default scan
             if line == 'END IONS':
                 currentID = 0
-                continue
-            
-            # get header data
-            parts = headerPattern.match(line)
-            if parts:
-                if parts.group(1) == 'TITLE':
-                    self._scans[currentID]['title'] = parts.group(2).strip()
-                elif parts.group(1) == 'PEPMASS':
-                    try: self._scans[currentID]['precursorMZ'] = float(pointPattern.split(parts.group(2))[0])
-                    except: pass
-                elif parts.group(1) == 'CHARGE':
-                    charge = parts.group(2).strip()
-                    if charge[-1] in ('+', '-'):
-                        charge = charge[-1]+charge[:-1]
-                    try: self._scans[currentID]['precursorCharge'] = int(charge)
-                    except: pass
-                continue
             
-            # append datapoint
-            parts = pointPattern.split(line)
-            if parts:
-                point = [0,100.]
-                try: point[0] = float(parts[0])
-                except ValueError: continue
-                try: point[1] = float(parts[1])
-                except ValueError, IndexError: pass
-                self._scans[currentID]['data'].append(point)
-                self._scans[currentID]['pointsCount'] += 1
-                continue
+            # parse scan data
+            elif line != 'BEGIN IONS':
+                self._parseLine(line, self._scans[currentID])
         
         # make scanlist
         if self._scans:
@@ -197,6 +199,64 @@ class parseMGF():
     # ----
     
     
+    def _makeScanData(self, scanNumber):
+        """Make empty raw scan data."""
+        
+        scanData = {
+            'title': '',
+            'scanNumber': scanNumber,
+            'parentScanNumber': None,
+            'msLevel': None,
+            'pointsCount': 0,
+            'polarity': None,
+            'retentionTime': None,
+            'lowMZ': None,
+            'highMZ': None,
+            'basePeakMZ': None,
+            'basePeakIntensity': None,
+            'totIonCurrent': None,
+            'precursorMZ': None,
+            'precursorIntensity': None,
+            'precursorCharge': None,
+            'spectrumType': 'unknown',
+            'data': [],
+        }
+        
+        return scanData
+    # ----
+    
+    
+    def _parseLine(self, line, scanData):
+        """Parse header or data point line into raw scan data."""
+        
+        # get header data
+        parts = headerPattern.match(line)
+        if parts:
+            if parts.group(1) == 'TITLE':
+                scanData['title'] = parts.group(2).strip()
+            elif parts.group(1) == 'PEPMASS':
+                try: scanData['precursorMZ'] = float(pointPattern.split(parts.group(2))[0])
+                except: pass
+            elif parts.group(1) == 'CHARGE':
+                charge = parts.group(2).strip()
+                if charge[-1] in ('+', '-'):
+                    charge = charge[-1]+charge[:-1]
+                try: scanData['precursorCharge'] = int(charge)
+                except: pass
+            return
+        
+        # append datapoint
+        parts = pointPattern.split(line)
+        point = [0,100.]
+        try: point[0] = float(parts[0])
+        except ValueError: return
+        try: point[1] = float(parts[1])
+        except (ValueError, IndexError): pass
+        scanData['data'].append(point)
+        scanData['pointsCount'] += 1
+    # ----
+    
+    
     def _makeScan(self, scanData, dataType):
         """Make scan object from raw data."""
         
@@ -2,6 +2,7 @@ import sys
 import numpy
 from distutils.core import setup
 from distutils.extension import Extension
+from distutils.command.build_ext import build_ext
 
 # Build on WIN using MinGW:
 # python setup.py build --compiler=mingw32
@@ -11,11 +12,27 @@ from distutils.extension import Extension
 # python setup.py build
 # Copy calculations.so to mspy directory
 
+# Chunked variants of some functions use OpenMP if available,
+# without it they run in single thread.
+
 
 # make include paths
 numpyInclude = numpy.get_include() + '/numpy'
 pythonInclude = sys.prefix + '/include'
 
+# set OpenMP flags according to compiler (not supported by default Mac compiler)
+class buildExt(build_ext):
+    def build_extensions(self):
+        compileArgs = linkArgs = []
+        if self.compiler.compiler_type == 'msvc':
+            compileArgs = ['/openmp']
+        elif sys.platform != 'darwin':
+            compileArgs = linkArgs = ['-fopenmp']
+        for ext in self.extensions:
+            ext.extra_compile_args = compileArgs
+            ext.extra_link_args = linkArgs
+        build_ext.build_extensions(self)
+
 # make setup
 setup(
     name = 'calculations',
@@ -29,4 +46,5 @@ setup(
             libraries=['m']
         )
     ],
+    cmdclass = {'build_ext': buildExt},
 )